@@ -0,0 +1,417 @@
+'''
+analyze-measurements is a tool for reading every result file in the measurements/ tree and comparing the test cases.
+It reads the three formats in the archive: simpleperf tables (and simpleperf --json records), ping output and iperf -u
+reports. The results are kept in one columnar dataset: a table of files (test case, host pair or link, group and what
+was measured) and one table for each kind of sample, where every column is an array of numbers with the index of the
+file the sample came from. The parsed files are cached on disk, keyed by the modification time and size of each file,
+so only new or changed files are read again. The summaries are computed on whole columns with NumPy if it is
+installed, and with plain Python if not.
+'''
+
+# Different module imports used in this program
+import argparse # Command-line interface
+import array    # Compact columns of numbers
+import json # simpleperf --json records, and --json output
+import os   # Walking the measurement tree and reading modification times
+import pickle   # The cache file
+import re   # Regex for the file names and the text formats
+import sys  # Functions that interact with the interpreter. Like sys.exit()
+try:    # NumPy is optional. Without it the summaries are computed in plain Python
+    import numpy
+except ImportError:
+    numpy = None
+
+# Used to formating, creating lines for print messages
+line = "\n" + "-" * 65 + "\n"
+
+CACHE_NAME = '.analysis-cache'  # The cache file, in the measurement directory
+CACHE_VERSION = 1   # Changed when the parsers or the dataset changes, so an old cache is not used
+
+'''
+DATASET:
+The tables and columns of the dataset, with the array type code of each column ('l' integer, 'd' float).
+ - throughput: one row for each stream in a throughput test (simpleperf, or the client side of iperf)
+ - rtt: one row for each ping reply
+ - udp: one row for each iperf -u server report
+The file column is the index of the file in the files list. Each file has the test case, the host pair or link, the
+group (the -N at the end of the file name, for tests that ran at the same time in test case 4, else 0), the metric in
+the file name (throughput or latency), the format and, for ping, the number of packets sent and received.
+'''
+TABLES = {
+    'throughput': {'file': 'l', 'mbps': 'd', 'bytes': 'd', 'seconds': 'd'},
+    'rtt': {'file': 'l', 'ms': 'd'},
+    'udp': {'file': 'l', 'mbps': 'd', 'server_mbps': 'd', 'jitter_ms': 'd', 'lost': 'l', 'total': 'l', 'out_of_order': 'l'},
+}
+
+'''
+Creates empty tables: a dict with a dict of empty arrays for every table.
+'''
+def create_tables():
+    return {table: {column: array.array(code) for column, code in columns.items()} for table, columns in TABLES.items()}
+
+'''
+PARSE FILE NAME:
+Finds the test case from the directory (test-case-N) and the metric, host pair or link and group from the file name,
+e.g. throughput_h1-h4-2.txt, latency_L1.txt or throughput_udp_iperf_h7-h9.txt. Returns a dict, or None if the file is
+not a measurement.
+'''
+NAME = re.compile(r'^(throughput|latency)_(?:udp_iperf_)?([A-Za-z]+\d+(?:-[A-Za-z]+\d+)?)(?:-(\d+))?\.(?:txt|json)$')
+CASE = re.compile(r'test-case-(\d+)')
+
+def parse_name(path):
+    match = NAME.match(os.path.basename(path))
+    case = CASE.search(path)
+    if not match or not case:
+        return None
+    return {'path': path, 'case': int(case.group(1)), 'pair': match.group(2), 'group': int(match.group(3) or 0),
+        'metric': match.group(1)}
+
+'''
+PARSERS:
+Each parser takes the text of a file, and the file index, and adds rows to the tables. Returns the format name and a
+dict with extra values for the file.
+ - simpleperf: the rows of the result tables. [SUM] rows are skipped (the streams are added up again), and so are the
+   tables after [SERVER RESULTS] and [SERVER REPORT], which measures the same streams from the server. If there are
+   interval rows, only the summary row of each stream is used (the one that starts at 0.0 and is the longest).
+ - simpleperf --json: the summary records from the client (source local, role sender or receiver).
+ - ping: every time= reply, and the packets transmitted and received.
+ - iperf -u: the first client row, and the server report with jitter, lost/total and datagrams out of order.
+'''
+SIMPLEPERF_ROW = re.compile(r'^\|\s*(\S+)\s*\|\s*([\d.]+) - ([\d.]+)\s*\|\s*(\d+)(B|KB|MB)\s*\|\s*([\d.]+) Mbps')
+PING_REPLY = re.compile(r'time=([\d.]+) ms')
+PING_TOTAL = re.compile(r'(\d+) packets transmitted, (\d+) received')
+IPERF_ROW = re.compile(r'sec\s+([\d.]+) (\w?)Bytes\s+([\d.]+) (\w?)bits/sec(?:\s+([\d.]+) ms\s+(\d+)/\s*(\d+))?')
+IPERF_OUT_OF_ORDER = re.compile(r'(\d+) datagrams received out-of-order')
+UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9}   # Prefixes of bits/sec in iperf output
+BYTE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}  # Prefixes of Bytes in iperf output, powers of 2
+FORMATS = {'B': 1, 'KB': 1e3, 'MB': 1e6}    # simpleperf -f formats
+
+def parse_simpleperf(text, index, tables):
+    streams = {}    # Stream id -> (start, end, bytes, Mbps) of the longest row from the start
+    for row in text.split('\n'):
+        if row.startswith('[SERVER'):   # The rest is measured by the server
+            break
+        match = SIMPLEPERF_ROW.match(row)
+        if not match or match.group(1) == '[SUM]' or float(match.group(2)) != 0:
+            continue
+        end = float(match.group(3))
+        if match.group(1) not in streams or end >= streams[match.group(1)][0]:
+            streams[match.group(1)] = (end, int(match.group(4)) * FORMATS[match.group(5)], float(match.group(6)))
+    columns = tables['throughput']
+    for end, data, mbps in streams.values():
+        columns['file'].append(index)
+        columns['mbps'].append(mbps)
+        columns['bytes'].append(data)
+        columns['seconds'].append(end)
+    return 'simpleperf', {}
+
+def parse_simpleperf_json(text, index, tables):
+    columns = tables['throughput']
+    for row in text.split('\n'):
+        if not row.strip():
+            continue
+        record = json.loads(row)
+        if record.get('event') != 'summary' or record.get('source') != 'local' or record.get('id') == '[SUM]':
+            continue
+        columns['file'].append(index)
+        columns['mbps'].append(record['bits_per_second'] / 1e6)
+        columns['bytes'].append(record['bytes'])
+        columns['seconds'].append(record['seconds'])
+    return 'simpleperf-json', {}
+
+def parse_ping(text, index, tables):
+    columns = tables['rtt']
+    for ms in PING_REPLY.findall(text):
+        columns['file'].append(index)
+        columns['ms'].append(float(ms))
+    total = PING_TOTAL.search(text)
+    if total:
+        return 'ping', {'sent': int(total.group(1)), 'received': int(total.group(2))}
+    return 'ping', {}
+
+def parse_iperf(text, index, tables):
+    rows = IPERF_ROW.findall(text)
+    client = next((row for row in rows if not row[4]), None)    # The first row without jitter
+    server = next((row for row in rows if row[4]), None)    # The server report
+    if client:  # Also a throughput row, so it can be compared with simpleperf
+        columns = tables['throughput']
+        columns['file'].append(index)
+        columns['mbps'].append(float(client[2]) * UNITS[client[3]] / 1e6)
+        columns['bytes'].append(float(client[0]) * BYTE_UNITS[client[1]])
+        columns['seconds'].append(0.0)
+    if server:
+        out_of_order = IPERF_OUT_OF_ORDER.search(text)
+        columns = tables['udp']
+        columns['file'].append(index)
+        columns['mbps'].append(float(client[2]) * UNITS[client[3]] / 1e6 if client else 0.0)
+        columns['server_mbps'].append(float(server[2]) * UNITS[server[3]] / 1e6)
+        columns['jitter_ms'].append(float(server[4]))
+        columns['lost'].append(int(server[5]))
+        columns['total'].append(int(server[6]))
+        columns['out_of_order'].append(int(out_of_order.group(1)) if out_of_order else 0)
+    return 'iperf', {}
+
+'''
+Finds the format of a file from its text and parses it with the right parser.
+'''
+def parse_file(text, index, tables):
+    if text.lstrip().startswith('{'):
+        return parse_simpleperf_json(text, index, tables)
+    if text.startswith('PING') or 'icmp_seq' in text:
+        return parse_ping(text, index, tables)
+    if 'Bandwith' in text or 'Recieved' in text:
+        return parse_simpleperf(text, index, tables)
+    if 'bits/sec' in text:
+        return parse_iperf(text, index, tables)
+    return 'unknown', {}
+
+'''
+LOAD DATASET:
+Finds every measurement file under the directory and returns the dataset: {'files': [...], 'tables': {...}}.
+The cache has the parsed rows of every file with its modification time and size, and the last dataset with the list
+of files and times it was made from. If no file has changed, the last dataset is used as it is. Else only the new or
+changed files are parsed, and the dataset is put together again from the cached rows, which is only copying arrays.
+'''
+def load_dataset(directory, use_cache=True):
+    paths = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if parse_name(os.path.relpath(path, directory)):
+                paths.append(path)
+    stamps = [(os.path.relpath(path, directory), os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths]
+
+    cache_path = os.path.join(directory, CACHE_NAME)
+    cache = {'version': CACHE_VERSION, 'files': {}, 'stamps': None, 'dataset': None}
+    if use_cache:
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                loaded = pickle.load(cache_file)
+            if loaded.get('version') == CACHE_VERSION:
+                cache = loaded
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            pass    # No cache, or one that can't be read: everything is parsed
+    if cache['stamps'] == stamps:   # Nothing has changed
+        return cache['dataset']
+
+    dataset = {'files': [], 'tables': create_tables()}
+    parsed = 0
+    for index, (name, mtime, size) in enumerate(stamps):
+        entry = cache['files'].get(name)
+        if entry is None or entry['mtime'] != mtime or entry['size'] != size:  # New or changed: parses the file
+            tables = create_tables()
+            with open(os.path.join(directory, name), encoding='utf-8', errors='replace') as measurement:
+                source, extra = parse_file(measurement.read(), 0, tables)
+            entry = {'mtime': mtime, 'size': size, 'meta': dict(parse_name(name), source=source, **extra), 'tables': tables}
+            cache['files'][name] = entry
+            parsed += 1
+        dataset['files'].append(entry['meta'])
+        for table, columns in entry['tables'].items():  # The file index is 0 in the cache, and index in the dataset
+            target = dataset['tables'][table]
+            target['file'].extend([index] * len(columns['file']))
+            for column, values in columns.items():
+                if column != 'file':
+                    target[column].extend(values)
+
+    for name in list(cache['files']):   # Files that are gone
+        if name not in {stamp[0] for stamp in stamps}:
+            del cache['files'][name]
+    cache['stamps'] = stamps
+    cache['dataset'] = dataset
+    if use_cache:
+        try:
+            with open(cache_path, 'wb') as cache_file:
+                pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            print(f"[WARNING] Could not write the cache {cache_path}", file=sys.stderr)
+    print(f"[PARSED] {parsed} of {len(stamps)} files", file=sys.stderr)
+    return dataset
+
+'''
+GROUP STATISTICS:
+Computes statistics of values for every group. groups is the group number of each value (from 0 to count - 1).
+Returns a dict of lists with one item for each group: n, sum, mean, min, max, p50, p99 and std. Groups without
+values have n 0 and None for the rest. With NumPy the values are sorted by group and value once, and every statistic
+is read from the sorted column for all groups at the same time. Without NumPy each group is sorted on its own.
+'''
+def group_stats(groups, values, count):
+    if numpy is not None:
+        groups = numpy.frombuffer(groups, dtype=numpy.int64) if isinstance(groups, array.array) else numpy.asarray(groups, dtype=numpy.int64)
+        values = numpy.frombuffer(values, dtype=numpy.float64) if isinstance(values, array.array) else numpy.asarray(values, dtype=numpy.float64)
+        order = numpy.lexsort((values, groups)) # By group, then by value
+        values = values[order]
+        groups = groups[order]
+        n = numpy.bincount(groups, minlength=count)
+        sums = numpy.bincount(groups, weights=values, minlength=count)
+        squares = numpy.bincount(groups, weights=values * values, minlength=count)
+        starts = numpy.concatenate(([0], numpy.cumsum(n)[:-1]))    # Where each group starts in the sorted column
+        present = n > 0
+        stats = {'n': n.tolist()}
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / n
+            std = numpy.sqrt(numpy.maximum(squares / n - mean * mean, 0))
+        for name, column in (('sum', sums), ('mean', mean), ('std', std)):
+            stats[name] = [float(value) if ok else None for value, ok in zip(column, present)]
+        last = numpy.maximum(starts + n - 1, 0)
+        for name, position in (('min', starts), ('max', last),
+                ('p50', starts + numpy.ceil(n * 0.5).astype(numpy.int64) - 1),
+                ('p99', starts + numpy.ceil(n * 0.99).astype(numpy.int64) - 1)):
+            picked = values[numpy.clip(position, 0, max(len(values) - 1, 0))] if len(values) else numpy.zeros(count)
+            stats[name] = [float(value) if ok else None for value, ok in zip(picked, present)]
+        return stats
+
+    buckets = [[] for i in range(count)]
+    for group, value in zip(groups, values):
+        buckets[group].append(value)
+    stats = {name: [] for name in ('n', 'sum', 'mean', 'min', 'max', 'p50', 'p99', 'std')}
+    for bucket in buckets:
+        bucket.sort()
+        n = len(bucket)
+        stats['n'].append(n)
+        if not n:
+            for name in ('sum', 'mean', 'min', 'max', 'p50', 'p99', 'std'):
+                stats[name].append(None)
+            continue
+        total = sum(bucket)
+        mean = total / n
+        stats['sum'].append(total)
+        stats['mean'].append(mean)
+        stats['min'].append(bucket[0])
+        stats['max'].append(bucket[-1])
+        stats['p50'].append(bucket[-(-n * 50 // 100) - 1])
+        stats['p99'].append(bucket[-(-n * 99 // 100) - 1])
+        stats['std'].append(max(sum(value * value for value in bucket) / n - mean * mean, 0) ** 0.5)
+    return stats
+
+'''
+SUMMARIZE:
+Makes one summary row for every test: the files with the same test case, host pair and group. The throughput is the
+sum of the streams in a file (parallel streams), the RTT statistics are over every ping reply, and the UDP values
+are from the iperf server report. Returns the rows sorted by test case, pair and group.
+'''
+def summarize(dataset):
+    files = dataset['files']
+    keys = sorted({(meta['case'], meta['pair'], meta['group']) for meta in files})
+    test_of = {key: number for number, key in enumerate(keys)}
+    file_test = [test_of[(meta['case'], meta['pair'], meta['group'])] for meta in files]   # Test number of each file
+    tables = dataset['tables']
+
+    # Throughput: streams -> files (sum of parallel streams) -> tests
+    per_file = group_stats(tables['throughput']['file'], tables['throughput']['mbps'], len(files))
+    measured = [index for index in range(len(files)) if per_file['n'][index]]
+    throughput = group_stats([file_test[index] for index in measured], [per_file['sum'][index] for index in measured], len(keys))
+    streams = group_stats([file_test[index] for index in measured], [per_file['n'][index] for index in measured], len(keys))
+
+    rtt = group_stats([file_test[index] for index in tables['rtt']['file']], tables['rtt']['ms'], len(keys))
+    udp_columns = tables['udp']
+    udp = {}    # Test number -> the values from the last report
+    for row in range(len(udp_columns['file'])):
+        udp[file_test[udp_columns['file'][row]]] = {column: udp_columns[column][row] for column in udp_columns}
+
+    sent = [0] * len(keys)  # Ping packets for the loss
+    received = [0] * len(keys)
+    for index, meta in enumerate(files):
+        sent[file_test[index]] += meta.get('sent', 0)
+        received[file_test[index]] += meta.get('received', 0)
+
+    rows = []
+    for number, (case, pair, group) in enumerate(keys):
+        row = {'case': case, 'pair': pair, 'group': group,
+            'mbps': throughput['mean'][number], 'streams': streams['max'][number],
+            'rtt_min': rtt['min'][number], 'rtt_avg': rtt['mean'][number], 'rtt_p50': rtt['p50'][number],
+            'rtt_p99': rtt['p99'][number], 'rtt_max': rtt['max'][number], 'rtt_mdev': rtt['std'][number],
+            'ping_loss': (sent[number] - received[number]) / sent[number] * 100 if sent[number] else None}
+        if number in udp:
+            report = udp[number]
+            row.update({'mbps': report['mbps'], 'udp_server_mbps': report['server_mbps'], 'jitter_ms': report['jitter_ms'],
+                'udp_loss': report['lost'] / report['total'] * 100 if report['total'] else 0.0, 'out_of_order': report['out_of_order']})
+        rows.append(row)
+    return rows
+
+'''
+COMPARE:
+Compares two test cases: for every host pair that is in both, the throughput and average RTT in each case and how
+much they changed. Tests with the same group are compared, and a test without a group (0) is compared with every
+group of the same pair in the other case (test case 3 with the tests in test case 4 that ran at the same time).
+'''
+def compare(rows, first, second):
+    result = []
+    for row in rows:
+        if row['case'] != first:
+            continue
+        for other in rows:
+            if other['case'] != second or other['pair'] != row['pair']:
+                continue
+            if row['group'] and other['group'] and row['group'] != other['group']:
+                continue
+            result.append({'pair': row['pair'], 'group': max(row['group'], other['group']),
+                'mbps': (row['mbps'], other['mbps'], change(row['mbps'], other['mbps'])),
+                'rtt_avg': (row['rtt_avg'], other['rtt_avg'], change(row['rtt_avg'], other['rtt_avg']))})
+    return result
+
+def change(before, after):  # Change in percent, or None if one is missing
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before * 100
+
+'''
+PRINT ROWS:
+Prints rows in a PrettyTable with the given columns (title, key and format), or as one JSON object per row.
+'''
+def print_rows(rows, columns, as_json=False):
+    if as_json:
+        for row in rows:
+            print(json.dumps(row))
+        return
+    from prettytable import PrettyTable # Only needed for the tables
+    result_table = PrettyTable()
+    result_table.field_names = [title for title, key, form in columns]
+    for row in rows:
+        cells = []
+        for title, key, form in columns:
+            value = row
+            for part in key.split('.'):  # A key like mbps.0 is an item in a tuple
+                value = value[int(part)] if isinstance(value, tuple) else value.get(part)
+            cells.append('-' if value is None else form % value)
+        result_table.add_row(cells)
+    print(result_table)
+    print("")
+
+SUMMARY_COLUMNS = [('Case', 'case', '%d'), ('Pair', 'pair', '%s'), ('Group', 'group', '%d'), ('Streams', 'streams', '%d'),
+    ('Throughput', 'mbps', '%.2f Mbps'), ('RTT min', 'rtt_min', '%.1f ms'), ('RTT avg', 'rtt_avg', '%.1f ms'),
+    ('RTT p99', 'rtt_p99', '%.1f ms'), ('RTT max', 'rtt_max', '%.1f ms'), ('Ping loss', 'ping_loss', '%.1f%%'),
+    ('UDP server', 'udp_server_mbps', '%.2f Mbps'), ('Jitter', 'jitter_ms', '%.3f ms'), ('UDP loss', 'udp_loss', '%.1f%%')]
+
+'''
+ARGPARSE and MAIN:
+Reads the dataset and prints the summary for every test case (or the chosen ones), or a comparison of two cases.
+'''
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="analyze-measurements",
+        description="Reads the measurement files (simpleperf, ping and iperf -u output) into one dataset and prints a summary for every test case")
+    parser.add_argument('directory', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'measurements'),
+        help='the measurement directory with test-case-N directories - default: measurements next to this script')
+    parser.add_argument('--case', type=int, action='append', help='only this test case, can be given more than once')
+    parser.add_argument('--compare', type=int, nargs=2, metavar=('CASE', 'CASE'), help='compare the host pairs that are in both test cases')
+    parser.add_argument('--no-cache', action='store_true', help='parse every file again, and do not read or write the cache')
+    parser.add_argument('--json', action='store_true', help='one JSON object per row instead of tables')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"[ERROR] {args.directory} is not a directory")
+        sys.exit(1)
+    dataset = load_dataset(args.directory, not args.no_cache)
+    rows = summarize(dataset)
+
+    if args.compare:
+        first, second = args.compare
+        if not args.json:
+            print(f"{line} Test case {first} compared with test case {second} {line}")
+        print_rows(compare(rows, first, second), [('Pair', 'pair', '%s'), ('Group', 'group', '%d'),
+            (f'Throughput {first}', 'mbps.0', '%.2f Mbps'), (f'Throughput {second}', 'mbps.1', '%.2f Mbps'), ('Change', 'mbps.2', '%+.1f%%'),
+            (f'RTT avg {first}', 'rtt_avg.0', '%.1f ms'), (f'RTT avg {second}', 'rtt_avg.1', '%.1f ms'), ('Change ', 'rtt_avg.2', '%+.1f%%')], args.json)
+    else:
+        if args.case:
+            rows = [row for row in rows if row['case'] in args.case]
+        print_rows(rows, SUMMARY_COLUMNS, args.json)
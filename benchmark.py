@@ -0,0 +1,230 @@
+'''
+benchmark is a loopback benchmark for simpleperf itself. It runs a simpleperf server and client on 127.0.0.1 for every
+combination of block size, number of parallel streams and engine, and records the throughput and the CPU time that
+the two processes used for each byte. Over loopback there is no network that limits the test, so the numbers tell how
+fast the send and receive engines of simpleperf are. The results can be saved as a baseline, and a later run can be
+compared with the baseline to find the cases that got slower.
+'''
+
+# Different module imports used in this program
+import argparse # Command-line interface
+import json # simpleperf --json records, and the baseline file
+import os   # os.wait4() for the CPU time of each process
+import platform # Machine and Python version, saved with the baseline
+import signal   # Stops the server
+import socket   # Finds a free port
+import statistics   # Median of the repeated runs
+import subprocess   # Runs the server and client
+import sys  # Functions that interact with the interpreter. Like sys.exit()
+import time # Wall clock time of each run
+
+# Used to formating, creating lines for print messages
+line = "\n" + "-" * 65 + "\n"
+
+SIMPLEPERF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simpleperf.py')
+
+# The default benchmark matrix
+BLOCKS = [1000, 8000, 64000, 128000]
+STREAMS = [1, 4]
+ENGINES = ['thread', 'select', 'asyncio']
+
+# A process that used at least this much of one CPU core during the test was the limit, not the loopback
+CPU_BOUND = 0.9
+
+'''
+FREE PORT:
+Finds a free TCP port on 127.0.0.1 for the server. The socket is closed again, and the server binds to the port.
+'''
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+'''
+REAP:
+Waits for a process with os.wait4(), which also returns the resources the process used (and every child of it that
+it waited for, like the worker processes of the client). Returns the user + system CPU time in seconds.
+'''
+def reap(process):
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)  # So subprocess doesn't wait for it again
+    return usage.ru_utime + usage.ru_stime
+
+'''
+RUN CASE:
+Runs one test: starts the server with the engine, waits until it listens, runs the client for the test time and
+stops the server. The bytes are what the server measured for every stream, what actually arrived. Returns a dict with the
+throughput, the CPU time of the client and server, and the CPU time for each byte in nanoseconds.
+'''
+def run_case(block, streams, engine, seconds, extra):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, SIMPLEPERF, '-s', '-p', str(port), '--engine', engine, '-l', str(block), '--json'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    for output in server.stderr:    # The server prints on stderr with --json
+        if 'listening on port' in output:
+            break
+    else:
+        reap(server)
+        raise RuntimeError(f"the server with --engine {engine} did not start")
+
+    client_engine = 'asyncio' if engine == 'asyncio' else 'thread'  # The select engine only exists for the server
+    start = time.monotonic()
+    client = subprocess.Popen([sys.executable, SIMPLEPERF, '-c', '-p', str(port), '-t', str(seconds), '-l', str(block),
+        '-P', str(streams), '--engine', client_engine, '--json'] + extra, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    records = client.stdout.read()
+    client_cpu = reap(client)
+    wall = time.monotonic() - start
+    server.send_signal(signal.SIGINT)
+    server.stderr.close()
+    server_cpu = reap(server)
+    if client.returncode != 0:
+        raise RuntimeError(f"the client exited with {client.returncode}")
+
+    data = 0   # Bytes of every stream the server measured ([SUM] is only there with more than one stream)
+    seconds = 0
+    for record in records.split('\n'):
+        if record.strip():
+            record = json.loads(record)
+            if record['event'] == 'summary' and record['id'] != '[SUM]' and record['source'] == 'server':
+                data += record['bytes']
+                seconds = max(seconds, record['seconds'])
+    if not data or not seconds:
+        raise RuntimeError("no results from the server")
+    return {'bytes': data, 'mbps': data * 8 / seconds / 1e6, 'wall': wall,
+        'client_cpu': client_cpu, 'server_cpu': server_cpu,
+        'ns_per_byte': (client_cpu + server_cpu) / data * 1e9,
+        'client_util': client_cpu / wall, 'server_util': server_cpu / wall}
+
+'''
+RUN BENCHMARK:
+Runs every case in the matrix repeat times, and keeps the median of the throughput and CPU time per byte, so one
+slow run (another program on the machine) doesn't decide the result. Returns a dict with the machine it ran on and
+one result for each case, keyed by "engine/block/streams".
+'''
+def run_benchmark(blocks, streams, engines, seconds, repeat, extra):
+    results = {}
+    for engine in engines:
+        for block in blocks:
+            for count in streams:
+                key = f"{engine}/{block}/{count}"
+                runs = []
+                for i in range(repeat):
+                    try:
+                        runs.append(run_case(block, count, engine, seconds, extra))
+                    except RuntimeError as error:
+                        print(f"[ERROR] {key}: {error}", file=sys.stderr)
+                if not runs:
+                    continue
+                result = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+                # The limit was simpleperf if one of the two processes used about a whole core, or both used every core
+                result['cpu_bound'] = (max(result['client_util'], result['server_util']) >= CPU_BOUND
+                    or result['client_util'] + result['server_util'] >= CPU_BOUND * (os.cpu_count() or 1))
+                result['runs'] = len(runs)
+                results[key] = result
+                print(f"[RUN] {key:>22}  {result['mbps']:10.1f} Mbps  {result['ns_per_byte']:7.3f} ns/byte", file=sys.stderr)
+    return {'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'seconds': seconds, 'extra': extra, 'results': results}
+
+'''
+COMPARE:
+Compares a run with a baseline. A case is a regression if the throughput dropped, or the CPU time per byte rose, by
+more than the threshold in percent. A drop in throughput only counts if the case was CPU bound (in the run or the
+baseline): if neither process used a whole core, something else than simpleperf was the limit and the throughput
+says little about the code. Returns a list of rows, one for each case in both.
+'''
+def compare(run, baseline, threshold):
+    rows = []
+    for key, result in run['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        mbps = (result['mbps'] - base['mbps']) / base['mbps'] * 100
+        cpu = (result['ns_per_byte'] - base['ns_per_byte']) / base['ns_per_byte'] * 100
+        cpu_bound = result['cpu_bound'] or base['cpu_bound']
+        regression = cpu > threshold or (cpu_bound and mbps < -threshold)
+        rows.append({'case': key, 'mbps': result['mbps'], 'base_mbps': base['mbps'], 'mbps_change': mbps,
+            'ns_per_byte': result['ns_per_byte'], 'base_ns_per_byte': base['ns_per_byte'], 'cpu_change': cpu,
+            'cpu_bound': cpu_bound, 'regression': regression})
+    return rows
+
+'''
+PRINT RESULTS:
+Prints the results of a run, and the comparison with the baseline if there is one, as tables.
+'''
+def print_results(run, rows=None):
+    from prettytable import PrettyTable # Only needed for the tables
+    result_table = PrettyTable()
+    result_table.field_names = ['Case', 'Throughput', 'CPU/byte', 'Client CPU', 'Server CPU', 'CPU bound']
+    for key, result in run['results'].items():
+        result_table.add_row([key, f"{result['mbps']:.1f} Mbps", f"{result['ns_per_byte']:.3f} ns",
+            f"{result['client_util'] * 100:.0f}%", f"{result['server_util'] * 100:.0f}%", 'yes' if result['cpu_bound'] else 'no'])
+    print(f"{line} Loopback benchmark, engine/block size/streams {line}")
+    print(result_table)
+    print("")
+    if rows is None:
+        return
+    compare_table = PrettyTable()
+    compare_table.field_names = ['Case', 'Throughput', 'Baseline', 'Change', 'CPU/byte', 'Baseline ', 'Change ', 'Result']
+    for row in rows:
+        compare_table.add_row([row['case'], f"{row['mbps']:.1f} Mbps", f"{row['base_mbps']:.1f} Mbps", f"{row['mbps_change']:+.1f}%",
+            f"{row['ns_per_byte']:.3f} ns", f"{row['base_ns_per_byte']:.3f} ns", f"{row['cpu_change']:+.1f}%",
+            'REGRESSION' if row['regression'] else 'ok'])
+    print(f"{line} Compared with the baseline {line}")
+    print(compare_table)
+    print("")
+
+'''
+ARGPARSE and MAIN:
+Runs the benchmark, saves it with --save, and compares it with --baseline. Exits with 1 if there is a regression,
+so it can be used in a script.
+'''
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="benchmark",
+        description="Runs simpleperf over loopback for every block size, number of streams and engine, and compares with a baseline")
+    parser.add_argument('-t', '--time', type=int, default=3, help='duration of each test in seconds - default: 3')
+    parser.add_argument('--blocks', type=int, nargs='+', default=BLOCKS, help=f'block sizes in bytes (-l) - default: {BLOCKS}')
+    parser.add_argument('--streams', type=int, nargs='+', default=STREAMS, help=f'number of parallel streams (-P) - default: {STREAMS}')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help=f'server engines - default: {ENGINES}')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each case, the median is used - default: 3')
+    parser.add_argument('--save', metavar='FILE', help='save the results as JSON, to use as a baseline later')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with the results saved in this file')
+    parser.add_argument('--threshold', type=float, default=10, help='change in percent that counts as a regression - default: 10')
+    parser.add_argument('--json', action='store_true', help='print the results (and comparison) as JSON instead of tables')
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help='extra client arguments after --, e.g. -- --batch 16 --zerocopy')
+    args = parser.parse_args()
+
+    if args.time <= 0 or args.repeat < 1:
+        print("[ERROR] --time and --repeat must be > 0")
+        sys.exit(1)
+    extra = args.extra[1:] if args.extra[:1] == ['--'] else args.extra
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as error:
+            print(f"[ERROR] Could not read the baseline {args.baseline}: {error}")
+            sys.exit(1)
+
+    run = run_benchmark(args.blocks, args.streams, args.engines, args.time, args.repeat, extra)
+    rows = None
+    if baseline is not None:
+        if baseline['machine'] != run['machine']:   # The numbers are only comparable on the same machine
+            print(f"[WARNING] The baseline is from another machine: {baseline['machine']}", file=sys.stderr)
+        if baseline.get('seconds') != run['seconds'] or baseline.get('extra') != run['extra']:
+            print("[WARNING] The baseline was run with another --time or other client arguments", file=sys.stderr)
+        rows = compare(run, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(run, save_file, indent=2)
+        print(f"[SAVED] {args.save}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({'run': run, 'comparison': rows}, indent=2))
+    else:
+        print_results(run, rows)
+    if rows and any(row['regression'] for row in rows):
+        sys.exit(1)
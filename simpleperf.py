@@ -7,13 +7,52 @@ It runs in two modes: Server mode and client mode. It has different flags for ex
 
 # Different module imports used in this program
 import argparse # argparse is used for a user friendly command-line interface. Here the user can give arguments when running the program
+import array    # Compact arrays of numbers, used for the latency histogram
+import collections  # deque for the last sessions in the server stats
+import contextlib   # Redirects the output of run_client and run_server (see LIBRARY API)
+import csv  # CSV records for --csv
+import errno    # Error numbers from the operating system, used to recognize ENOBUFS/EAGAIN from socket calls
+import importlib.util   # LazyLoader, for the modules that are only loaded when they are used (lazy_import)
+import io   # Buffers for the output of the library functions
 import ipaddress    # can be used to check if an ip address is valid. Returns ValueError if not valid
+import json # Encoding and decoding of the messages on the control connection
+import mmap # Memory-mapped files, for writing what the server receives with -F and --mmap
+import os   # Operating system functions, used to find the number of CPU cores
+import queue    # Exceptions for the results queue
 import re   # Regex functions
+import select   # poll, used by the --stats instrumentation to see if a socket is full (or empty)
+import signal   # Stops the server workers on SIGTERM
+import selectors    # High level I/O multiplexing (epoll/kqueue/select), used by the select server engine
 import sys  # Functions that interact with the interpreter. Like sys.exit()
 import socket   # Functions for socket operations
+import struct   # Packing and unpacking of binary headers, used for UDP datagrams
 import threading    # Functions for server threading
 import time # Various time functions
-from prettytable import PrettyTable # Table formating library. Must be installed with pip: python -m pip install -U prettytable
+try:    # CPU time and context switches for --stats. Only on Unix
+    import resource
+except ImportError:
+    resource = None
+# PrettyTable is imported in print_table, only when tables are printed
+
+'''
+LAZY IMPORTS:
+asyncio, multiprocessing and statistics take most of the time simpleperf needs to start, and a run only uses them
+with some options. lazy_import gives the module without running it, and it is loaded the first time something in it
+is used (importlib.util.LazyLoader), so the names below are used like normal imports.
+'''
+def lazy_import(name):
+    if name in sys.modules: # Already loaded
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+asyncio = lazy_import('asyncio')    # Event loop, used by the asyncio engine for both server and client
+multiprocessing = lazy_import('multiprocessing')    # Functions for running parallel client streams in several processes
+statistics = lazy_import('statistics')  # Mean and standard deviation of the runs with --repeat
 
 # Used to formating, creating lines for print messages
 line = "\n" + "-" * 65 + "\n"
@@ -92,126 +131,1126 @@ def check_num(bytes):
             print("[VALUE ERROR] Error in number of bytes. it should be either in B, KB or MB. e.g. 1MB")
             raise argparse.ArgumentError("")
 
+'''
+Error handling for the --len flag. Accepts a plain number of bytes (e.g. 1000) or a number with B, KB or MB (e.g. 128KB),
+parsed the same way as --num. The block size must be at least 1 byte and at most 16MB, since the client keeps one buffer
+of this size in memory for the whole test. Returns the block size in bytes.
+'''
+MAX_BLOCK_LEN = 16000000    # The largest block size, also what the server accepts in a hello
+
+def check_len(length):
+    if length.isdigit():    # A plain number is interpreted as bytes
+        value = int(length)
+    else:   # Otherwise let check_num handle B, KB and MB
+        value = check_num(length)
+
+    if (value >= 1 and value <= MAX_BLOCK_LEN):   # If the block size is within the valid range
+        return value
+    else:   # Gives an error if the block size is out of range
+        print("[VALUE ERROR] Expected a block size between 1B and 16MB")
+        raise argparse.ArgumentError("")
+
+'''
+Checks that the argument is an integer of at least 1. Used by --parallel and --workers.
+Returns the number.
+'''
+def check_count(num):
+    try:
+        value = int(num)    # Tries to cast the number to an int
+    except: # If it can't cast to int, gives an error
+        raise argparse.ArgumentTypeError("[VALUE ERROR] Expected an integer")
+    else:
+        if (value >= 1):
+            return value
+        else:   # Gives an error if the number is 0 or negative
+            print("[VALUE ERROR] Expected an integer of at least 1")
+            raise argparse.ArgumentError("")
+
+'''
+Error handling for the --bitrate flag. Accepts bits per second as a number with an optional K, M or G (e.g. 20M),
+the same way as iperf. Returns the bitrate in bits per second.
+'''
+def check_bitrate(rate):
+    units = {'': 1, 'K': 1000, 'M': 1000000, 'G': 1000000000}
+    match = re.fullmatch(r'([0-9]+(?:\.[0-9]+)?)([KkMmGg]?)', rate)  # A number and maybe a unit
+    if not match or float(match.group(1)) <= 0:
+        print("[VALUE ERROR] Error in bitrate. It should be a positive number of bits per second, with K, M or G. e.g. 20M")
+        raise argparse.ArgumentError("")
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+'''
+Error handling for the --batch flag. Checks that the argument is an integer between 1 and 1024.
+1024 is the maximum number of buffers (IOV_MAX) the kernel accepts in one sendmsg call on Linux.
+Returns the number of blocks to send per system call.
+'''
+def check_batch(num):
+    try:
+        value = int(num)    # Tries to cast the number to an int
+    except: # If it can't cast to int, gives an error
+        raise argparse.ArgumentTypeError("[VALUE ERROR] Expected an integer")
+    else:
+        if (value >= 1 and value <= 1024):
+            return value
+        else:   # Gives an error if the number is out of range
+            print("[VALUE ERROR] Expected a batch size between 1 and 1024")
+            raise argparse.ArgumentError("")
+
+'''
+Error handling for the --target flag. A target is a server as IP or IP:PORT (the port from -p if it is not set),
+followed by options for the streams to that server only, separated by commas: P=N (parallel streams), R (reverse),
+bidir, bitrate=RATE, len=SIZE, w=SIZE (--window) and C=NAME (--congestion). e.g. 10.0.5.2:8088,P=2,bitrate=10M
+Every option is checked like the flag it stands for. Returns a dict with the ip, the port (None if not set) and the
+options as argument names and values.
+'''
+TARGET_OPTIONS = {'P': ('parallel', check_count), 'R': ('reverse', None), 'bidir': ('bidir', None),
+    'bitrate': ('bitrate', check_bitrate), 'len': ('len', check_len), 'w': ('window', check_len), 'C': ('congestion', str)}
+
+def check_target(spec):
+    address, *options = spec.split(',')
+    ip, _, port = address.rpartition(':') if address.count(':') == 1 else (address, '', '')  # An IPv6 address has no port
+    target = {'ip': check_ip(ip), 'port': check_port(port) if port else None, 'options': {}}
+    for option in options:
+        key, _, value = option.partition('=')
+        if key not in TARGET_OPTIONS:
+            print(f"[VALUE ERROR] Unknown target option '{key}'. Expected one of {', '.join(TARGET_OPTIONS)}")
+            raise argparse.ArgumentError("")
+        name, check = TARGET_OPTIONS[key]
+        if check is None:   # A flag
+            target['options'][name] = True
+        elif not value:
+            print(f"[VALUE ERROR] The target option {key} needs a value, e.g. {key}=...")
+            raise argparse.ArgumentError("")
+        else:
+            target['options'][name] = check(value)
+    return target
+
 '''
 ARGPARSE:
 An user friendly CLI for user arguments. It is a command-line parsing library that gives instruction to the user,
 lets the user choose different arguments and makes it easy to create limitations.
-Used here to create a help menu, set flags, instructions, arguments and restrictions. Returns arguments to be used in the code.
+Used here to create a help menu, set flags, instructions, arguments and restrictions. build_parser returns the parser,
+which main uses for the command line and create_args for the library. Nothing is parsed when the module is imported.
 '''
-# argparse parser object with a description of what this program do
-parser = argparse.ArgumentParser(
-    prog="simpleperf",
-    description="A simple program based on the iPerf tool for measuring network throughput, with a server and a client mode. simpleperf sends and recieves packet between a client and a server using sockets", 
-    epilog="END OF HELP")
+def build_parser():
+    # argparse parser object with a description of what this program do
+    parser = argparse.ArgumentParser(
+        prog="simpleperf",
+        description="A simple program based on the iPerf tool for measuring network throughput, with a server and a client mode. simpleperf sends and recieves packet between a client and a server using sockets", 
+        epilog="END OF HELP")
 
-# ADDS ARGUMENTS TO THE ARGPARSER
+    # ADDS ARGUMENTS TO THE ARGPARSER
 
-# SERVER ARGUMENTS: Own argument group to show arguments for server only
-serverargs = parser.add_argument_group("SERVER ARGUMENTS:", "Arguments for server mode only")
-serverargs.add_argument('-s', '--server', action='store_true', help='enable the server mode. Choosing server or client mode are required.')
-serverargs.add_argument('-b', '--bind', type=check_ip, default='127.0.0.1',
-    help='allows to select the ip address of the servers interface where the client should connect. It must be in the dotted decimal notation format, e.g. 10.0.0.2 - Default: 127.0.0.1')
+    # SERVER ARGUMENTS: Own argument group to show arguments for server only
+    serverargs = parser.add_argument_group("SERVER ARGUMENTS:", "Arguments for server mode only")
+    serverargs.add_argument('-s', '--server', action='store_true', help='enable the server mode. Choosing server or client mode are required.')
+    serverargs.add_argument('-b', '--bind', type=check_ip, default='127.0.0.1',
+        help='allows to select the ip address of the servers interface where the client should connect. It must be in the dotted decimal notation format, e.g. 10.0.0.2 - Default: 127.0.0.1')
+    serverargs.add_argument('--stats-port', type=check_port, help='serve live statistics of the running and finished tests as JSON over HTTP on this port on 127.0.0.1, e.g. curl http://127.0.0.1:8089/ - Default: off')
+    serverargs.add_argument('--stats-socket', type=str, help='serve the same live statistics on a UNIX socket at this path: every connection gets one JSON snapshot - Default: off')
+    serverargs.add_argument('--stats-interval', type=check_positive, help='print one line with the total rate of all tests every x seconds - Default: off')
+    serverargs.add_argument('--mmap', action='store_true', help='with -F: receive straight into a memory-mapped file, instead of into the receive buffer and then writing it to the file')
+    serverargs.add_argument('--rcvbuf', type=check_len, help='size of the kernel receive buffer (SO_RCVBUF) for each connection, in bytes or with B, KB or MB. e.g. 4MB - Default: operating system default')
 
-# CLIENT ARGUMENTS: Own argument group to show arguments for client only
-clientargs = parser.add_argument_group("CLIENT ARGUMENTS:", "Arguments for client mode only")
-clientargs.add_argument('-c', '--client', action='store_true', help='enable the client mode. Choosing server or client mode are required.')
-clientargs.add_argument('-I', '--serverip', type=check_ip, default='127.0.0.1', 
-    help='allows to select the ip address of the server. It must be in the dotted decimal notation format, e.g. 10.0.0.2 - Default: 127.0.0.1')
-clientargs.add_argument('-t', '--time', type=check_positive, default=25, help='the total duration in seconds for which data should be generated, also sent to the server. Must be > 0. Default: 25 sec')
-clientargs.add_argument('-i', '--interval', type=check_positive, help='print statistics per x seconds')
-clientargs.add_argument('-P', '--parallel', type=int, choices=range(1,6), default=1, help='creates parallel connections to connect to the server and send data - min value: 1, max value: 5 - default:1')
-clientargs.add_argument('-n', '--num', type=check_num, help='transfer number of bytes specified by -n flag, it should be either in B, KB or MB. e.g. 1MB')
+    # CLIENT ARGUMENTS: Own argument group to show arguments for client only
+    clientargs = parser.add_argument_group("CLIENT ARGUMENTS:", "Arguments for client mode only")
+    clientargs.add_argument('-c', '--client', action='store_true', help='enable the client mode. Choosing server or client mode are required.')
+    clientargs.add_argument('-I', '--serverip', type=check_ip, default='127.0.0.1', 
+        help='allows to select the ip address of the server. It must be in the dotted decimal notation format, e.g. 10.0.0.2 - Default: 127.0.0.1')
+    clientargs.add_argument('-t', '--time', type=check_positive, default=25, help='the total duration in seconds for which data should be generated, also sent to the server. Must be > 0. Default: 25 sec')
+    clientargs.add_argument('-O', '--omit', type=check_positive, default=0, help='seconds of warm-up (TCP slow start) at the start of the test that are not counted, on the client and the server. The test runs for --time after the warm-up - default: 0')
+    clientargs.add_argument('--repeat', type=check_count, default=1, help='run the test this many times back to back against the same server, over the same control connection, and print the mean and standard deviation of the throughput of the runs - default: 1')
+    clientargs.add_argument('-i', '--interval', type=check_positive, help='print statistics per x seconds')
+    clientargs.add_argument('--intervals-file', type=str, help='also write the throughput of every interval (-i) of every stream to this binary file, as little-endian records of run (uint16), stream (uint32, or streams + direction for [SUM]), end of the interval in seconds (double), bytes (uint64) and bits per second (double)')
+    clientargs.add_argument('--target', type=check_target, action='append', help='a server to test, as IP or IP:PORT with options for its streams after commas: P=N, R, bidir, bitrate=RATE, len=SIZE, w=SIZE and C=NAME. e.g. --target 10.0.5.2,P=2 --target 10.0.5.3:8090,R. Can be given many times: every target gets its own control connection, all streams start at once, and the results have a row for each target and a [SUM] for all of them. -I is not used with --target')
+    clientargs.add_argument('-P', '--parallel', type=check_count, default=1, help='creates parallel connections to connect to the server and send data - min value: 1 - default:1')
+    clientargs.add_argument('-n', '--num', type=check_num, help='transfer number of bytes specified by -n flag, it should be either in B, KB or MB. e.g. 1MB')
+    clientargs.add_argument('--batch', type=check_batch, default=1, help='number of blocks to hand to the kernel in one sendmsg call - min value: 1, max value: 1024 - default: 1')
+    clientargs.add_argument('-R', '--reverse', action='store_true', help='reverse mode: the server sends and the client receives')
+    clientargs.add_argument('--bidir', action='store_true', help='bidirectional mode: every parallel stream is a pair of connections, one in each direction, at the same time')
+    clientargs.add_argument('--bitrate', type=check_bitrate, help='target bitrate in bits per second for each stream, with K, M or G. e.g. 20M - default: as fast as possible for TCP, 1M for UDP')
+    clientargs.add_argument('--latency', action='store_true', help='latency mode: sends one small probe at a time (--len, default 64 bytes) that the server sends back, and prints min, mean, p50, p99, p99.9 and max round-trip time. Works with TCP and UDP (-u)')
+    clientargs.add_argument('--zerocopy', action='store_true', help='send with MSG_ZEROCOPY where the operating system supports it (Linux 4.14+). Falls back to normal sends if not')
 
-# COMMON ARGUMENTS: Own argument group to show arguments for both modes
-commonargs = parser.add_argument_group("COMMON ARGUMENTS:", "Arguments for both server and client mode")
-commonargs.add_argument('-p', '--port', type=check_port, default=8088, 
-    help='allows to use select port number on which the server should listen; the port must be an integer and in the range [1024, 65535], default: 8088')
-commonargs.add_argument('-f', '--format', type=str, choices=['B', 'KB', 'MB'], default='MB', help='allows you to choose the format of the summary of results - it should be either in B, KB or MB, default=MB)') 
+    # COMMON ARGUMENTS: Own argument group to show arguments for both modes
+    commonargs = parser.add_argument_group("COMMON ARGUMENTS:", "Arguments for both server and client mode")
+    commonargs.add_argument('-p', '--port', type=check_port, default=8088, 
+        help='allows to use select port number on which the server should listen; the port must be an integer and in the range [1024, 65535], default: 8088')
+    commonargs.add_argument('-l', '--len', type=check_len,
+        help='size of each block the client sends, and size of the buffer the server receives into, in bytes or with B, KB or MB. e.g. 128KB - max: 16MB - default: 1000 for client, 128KB for server')
+    commonargs.add_argument('-u', '--udp', action='store_true', help='use UDP instead of TCP. The client sends numbered datagrams at --bitrate, and the server reports loss, jitter and datagrams out of order back to the client')
+    commonargs.add_argument('-F', '--file', type=str, help='client: send this file with sendfile (zero-copy from the page cache) instead of generated data, the whole file (or the first --num bytes of it) once for each stream. server: write what every stream receives to this file (FILE.N for stream N, from 0, with more than one stream), preallocated, and report the rate with the time until it is on disk next to the network rate. Thread engine only on the server')
+    commonargs.add_argument('-w', '--window', type=check_len, help='size of the kernel send and receive buffers (SO_SNDBUF and SO_RCVBUF) of every TCP connection, which limits the TCP window, in bytes or with B, KB or MB. e.g. 256KB - Default: operating system default')
+    commonargs.add_argument('--nodelay', action='store_true', help='turn off Nagle\'s algorithm (TCP_NODELAY) on every TCP connection')
+    commonargs.add_argument('-M', '--mss', type=check_count, help='largest TCP segment to send (TCP_MAXSEG) in bytes - Default: from the MTU')
+    commonargs.add_argument('-C', '--congestion', type=str, help='TCP congestion control algorithm, e.g. cubic, reno or bbr (Linux). See /proc/sys/net/ipv4/tcp_available_congestion_control - Default: operating system default')
+    commonargs.add_argument('--tcp-info', action='store_true', help='read TCP_INFO of every connection (Linux) and show the congestion window, smoothed RTT, retransmits and pacing rate next to the throughput: in every interval and summary on the client, and in the summary of the server (the client asks the server for it too)')
+    commonargs.add_argument('--engine', type=str, choices=['thread', 'select', 'asyncio'], default='thread',
+        help='how connections are handled. thread: one thread for each connection. select (server only): one event loop (epoll) for all clients. asyncio: asyncio event loop for all connections - default: thread')
+    commonargs.add_argument('--workers', type=check_count, help='number of processes. client: the parallel connections are spread over them - default: one for each CPU core, but not more than --parallel. server: every process listens on the port (SO_REUSEPORT) and the kernel spreads the connections over them, and the results of every test are printed together - default: 1')
+    commonargs.add_argument('-f', '--format', type=str, choices=['B', 'KB', 'MB'], default='MB', help='allows you to choose the format of the summary of results - it should be either in B, KB or MB, default=MB)') 
+    commonargs.add_argument('--stats', action='store_true', help='count what every stream does in the send and receive loops: system calls, bytes per call, short writes, EAGAIN (sampled every 64 calls) and the time spent blocked in the socket calls, and the CPU time and context switches of the stream. Shown next to the throughput in every interval and summary. Thread engine only')
+    output = commonargs.add_mutually_exclusive_group()   # Only one of the record formats
+    output.add_argument('--json', action='store_true', help='write every interval and summary as one JSON record per line to stdout instead of tables, with full precision bytes, seconds and bits per second. Other messages goes to stderr')
+    output.add_argument('--csv', action='store_true', help='the same as --json, but as CSV with a header line')
+    return parser
 
-# Variable for the user argument inputs
-args = parser.parse_args()
+# The arguments in use: set by main from the command line, or by run_client and run_server (see LIBRARY API)
+args = None
 
 
 '''
 CREATE RESULTS:
-Function for creating print message with results. Uses the PrettyTable library to format the results in tables.
-The function takes server/client mode, ip and port, start time, interval start (if interval is set), elapsed time, data and 
-a boolean for if there are interval set or not. If there is not an interval set, it will print the summary.
-First finds the rate by using data and elapsed time. Checks which format is set. Then creates a PrettyTable, checks which mode is
-set and creates a header row based on that. Checks if there is an interval set, and adds results to the row accordingly. 
+Function for creating print message with results. The function takes server/client mode, ip and port, start time,
+interval start (if interval is set), elapsed time, data and a boolean for if there are interval set or not. If there is
+not an interval set, it will print the summary.
+The row is made by create_row and printed by print_table, which can also print many rows (parallel streams) in one table.
 '''
 def create_result(mode, addr, start_time, interval_start, elapsed_time, data, interval=False):
-    ip = addr[0]    # Chooses index 0 and 1 from the address tupple to split ip and port
-    port = addr[1]
-    relative_interval_start = interval_start - start_time   # Sets the start for every interval
+    row = create_row(addr, start_time, interval_start, elapsed_time, data, interval)
+    print_table(mode, [row])
+
+'''
+CREATE ROW:
+Creates one row for a result table. addr is either the (ip, port) tuple of a connection or a label like [SUM].
+The row is a dict with the full precision values: event (interval or summary), id, start and end of the interval in
+seconds from the start of the test, seconds, bytes and bits_per_second. print_table formats it for the table.
+With --stats, stats is a dict with the counters of the stream for the same time (see read_stats), and the row also
+gets calls, bytes_per_call, short_writes, eagain, blocked_ms, cpu_ms, cpu_percent and switches.
+'''
+def create_row(addr, start_time, interval_start, elapsed_time, data, interval=False, stats=None):
+    if isinstance(addr, str):   # A label instead of an address
+        id = addr
+    else:   # Chooses index 0 and 1 from the address tupple to split ip and port
+        id = f"{addr[0]}:{addr[1]}"
 
-    rate = (data / elapsed_time) * 8 / 1000000 # Calculate rate based on data and time provided. Multiply by 8 to convert to bits pr sec
+    if interval:
+        start = interval_start - start_time # Sets the start for every interval
+    else:   # A summary is from the start of the test
+        start = 0.0
+
+    if elapsed_time > 0:
+        rate = data / elapsed_time * 8  # Calculate rate based on data and time provided. Multiply by 8 to convert to bits pr sec
+    else:   # Nothing could be measured
+        rate = 0.0
+
+    row = {'event': 'interval' if interval else 'summary', 'id': id, 'start': start, 'end': start + elapsed_time,
+        'seconds': elapsed_time, 'bytes': data, 'bits_per_second': rate}
+    if stats is not None:
+        calls = stats['calls']
+        row.update({'calls': calls, 'bytes_per_call': data / calls if calls else 0.0, 'short_writes': stats['short_writes'],
+            'eagain': stats['eagain'], 'blocked_ms': stats['blocked_ns'] / 1e6, 'cpu_ms': stats['cpu_ns'] / 1e6,
+            'cpu_percent': stats['cpu_ns'] / 1e7 / elapsed_time if elapsed_time > 0 else 0.0, 'switches': stats['switches']})
+    return row
+
+'''
+PRINT TABLE:
+Prints rows made by create_row. Checks which mode is set (C: sent, S: received, U: UDP server results, L: latency,
+R: the runs with --repeat, D: the spread of the interval throughput) and
+creates a table with a header row based on that. source is server for results measured by the server that are printed by the client.
+With --json or --csv the rows are written as records instead (write_records), and run_client and run_server keep them.
+PrettyTable is only imported here, the first time a table is printed, so it is not loaded when nobody reads tables.
+'''
+def print_table(mode, rows, source='local'):
+    if result_records is not None:  # The library keeps every row (see LIBRARY API)
+        with record_lock:
+            result_records.extend(create_records(mode, rows, source))
+    if args.json or args.csv:
+        write_records(mode, rows, source)
+        return
+
+    from prettytable import PrettyTable # Table formating library. Must be installed with pip: python -m pip install -U prettytable
 
-    # If/else if to check if the format chosen is MB, KB or B. Then converts the data from byte to the correct format.
-    if args.format == 'MB':
-        data = data // 1000000        # divides data with 1000000 and cast to int for value in MB
-    elif args.format == 'KB':
-        data = data // 1000             # divides data with 1000 and cast to int for value in KB
-    
     # Table from PrettyTable
     result_table = PrettyTable()    # Creates new table
     # Checks if the mode invoked is from server or client. Different field names for the two modes.
     if mode == 'C':
-        result_table.field_names = ["ID", "Interval", "Transfer", "Bandwith"]
+        fields = ["ID", "Interval", "Transfer", "Bandwith"]
     elif mode == 'S':
-        result_table.field_names = ["ID", "Interval", "Recieved", "Rate"]
+        fields = ["ID", "Interval", "Recieved", "Rate"]
+    elif mode == 'U':   # UDP server results, with the rows from create_udp_row
+        fields = ["ID", "Interval", "Recieved", "Rate", "Jitter", "Lost/Total", "Out of order"]
+    elif mode == 'L':   # Latency results, with the rows from create_latency_row
+        fields = ["ID", "Interval", "Samples", "Lost", "Min", "Mean", "p50", "p99", "p99.9", "Max"]
+    elif mode == 'R':   # Throughput of the runs with --repeat, with the rows from create_repeat_row
+        fields = ["ID", "Measured by", "Runs", "Mean", "Stddev", "Min", "Max"]
+    elif mode == 'D':   # Throughput of the intervals, with the rows from create_intervals_row
+        fields = ["ID", "Intervals", "Min", "Mean", "Median", "p5", "p95", "Max", "CoV"]
     else:
+        fields = []
         print("Error in creating result: Wrong mode")   # Error in the edge case that there is no mode chosen (won't really happen)
+    stats_table = args.stats and mode in ('C', 'S')
+    if stats_table:
+        fields += STATS_COLUMNS
+    disk_table = mode == 'S' and any('disk_seconds' in row for row in rows)  # Streams the server wrote to a file (-F)
+    if disk_table:
+        fields += DISK_COLUMNS
+    tcp_table = mode in ('C', 'S') and any('retransmits' in row for row in rows)  # --tcp-info
+    if tcp_table:
+        fields += TCP_INFO_COLUMNS
+    result_table.field_names = fields
 
-    # String for interval time printing dependent on if interval=True/False
-    if interval:
-        interval_str = f"{round(relative_interval_start, 1)} - {round(relative_interval_start + elapsed_time, 1)}"  # Prints interval from rel. start to rel. start + elapsed time
-    else:
-        interval_str = f"0.0 - {round(elapsed_time, 1)}"    # If there is no interval (just summary), prints 0.0 to elapsed time
-
-    # Adds row with all the data provided, with the right rounding and casting of data
-    result_table.add_row([f"{ip}:{port}", interval_str, f"{data}{args.format}", "%.2f Mbps" % rate])
+    for row in rows:
+        if mode == 'L': # Round-trip times in ms
+            result_table.add_row([row['id'], f"{round(row['start'], 1)} - {round(row['end'], 1)}", row['samples'], row['lost']] +
+                ["%.3f ms" % row[key] for key in ('min_ms', 'mean_ms', 'p50_ms', 'p99_ms', 'p999_ms', 'max_ms')])
+            continue
+        if mode == 'R': # Rates in Mbps
+            result_table.add_row([row['id'], 'server' if row['source'] == 'server' else 'client', row['runs']] +
+                ["%.2f Mbps" % (row[key] / 1000000) for key in ('bits_per_second', 'stddev_bits_per_second',
+                'min_bits_per_second', 'max_bits_per_second')])
+            continue
+        if mode == 'D': # Rates in Mbps, and CoV in percent
+            result_table.add_row([row['id'], row['samples']] + ["%.2f Mbps" % (row[key] / 1000000) for key in ('min_bits_per_second',
+                'bits_per_second', 'p50_bits_per_second', 'p5_bits_per_second', 'p95_bits_per_second', 'max_bits_per_second')] +
+                ["%.1f%%" % (row['cov'] * 100)])
+            continue
+        data = row['bytes']
+        # If/else if to check if the format chosen is MB, KB or B. Then converts the data from byte to the correct format.
+        if args.format == 'MB':
+            data = data // 1000000        # divides data with 1000000 and cast to int for value in MB
+        elif args.format == 'KB':
+            data = data // 1000             # divides data with 1000 and cast to int for value in KB
+        # Formats the row with the right rounding and casting of data
+        cells = [row['id'], f"{round(row['start'], 1)} - {round(row['end'], 1)}", f"{data}{args.format}",
+            "%.2f Mbps" % (row['bits_per_second'] / 1000000)]
+        if mode == 'U':
+            loss = row['lost'] / row['total'] * 100 if row['total'] > 0 else 0.0  # Loss in percent
+            cells += ["%.3f ms" % row['jitter_ms'], f"{row['lost']}/{row['total']} ({loss:.2g}%)", row['out_of_order']]
+        elif stats_table:   # The --stats columns, or - for streams that were not counted
+            if 'calls' in row:
+                cells += [row['calls'], "%.0f" % row['bytes_per_call'], row['short_writes'], row['eagain'], "%.1f ms" % row['blocked_ms'],
+                    "%.1f ms (%.0f%%)" % (row['cpu_ms'], row['cpu_percent']), row['switches']]
+            else:
+                cells += ["-"] * len(STATS_COLUMNS)
+        if disk_table:  # The time until the data was on disk, and the rate with that time
+            if 'disk_seconds' in row:
+                cells += ["%.2f s" % row['disk_seconds'], "%.2f Mbps" % (row['disk_bits_per_second'] / 1000000)]
+            else:
+                cells += ["-"] * len(DISK_COLUMNS)
+        if tcp_table:   # TCP_INFO, or - for what is not known (a [SUM] row only has the retransmits)
+            cells += ["%.0f KB" % (row['cwnd_bytes'] / 1000) if 'cwnd_bytes' in row else "-",
+                "%.2f ms" % row['srtt_ms'] if 'srtt_ms' in row else "-", row.get('retransmits', "-"),
+                "%.2f Mbps" % (row['pacing_bits_per_second'] / 1000000) if row.get('pacing_bits_per_second') is not None else "-"]
+        result_table.add_row(cells)
     print(result_table)
     print("")
 
+# The extra columns in the tables with --stats
+STATS_COLUMNS = ["Calls", "Bytes/call", "Short", "EAGAIN", "Blocked", "CPU", "Switches"]
+# The extra columns for streams the server wrote to a file with -F
+DISK_COLUMNS = ["On disk", "Disk rate"]
+# The extra columns with --tcp-info
+TCP_INFO_COLUMNS = ["Cwnd", "RTT", "Retr", "Pacing"]
+
 '''
-HANDLE CLIENTS:
-A function for handling each client connecting to the server. Function called from the start_server function.
+CREATE UDP ROW:
+Creates a row for the UDP server results. Uses create_row for the first columns, and adds jitter in ms,
+lost and total datagrams and the number of datagrams that came out of order.
+'''
+def create_udp_row(addr, elapsed_time, data, jitter, lost, total, out_of_order):
+    row = create_row(addr, 0, 0, elapsed_time, data, False)
+    row.update({'jitter_ms': jitter * 1000, 'lost': lost, 'total': total, 'out_of_order': out_of_order})
+    return row
+
+'''
+CREATE REPEAT ROW:
+Creates a row for the summary of the runs with --repeat: the mean, standard deviation (of the sample), min and max of
+the throughput in bits per second of every run, in one direction. The row has its own role (sender or receiver) and
+source (local or server), since one table has both what the client and the server measured.
+'''
+def create_repeat_row(id, role, source, rates):
+    return {'event': 'repeat', 'id': id, 'role': role, 'source': source, 'runs': len(rates),
+        'bits_per_second': statistics.mean(rates), 'stddev_bits_per_second': statistics.stdev(rates) if len(rates) > 1 else 0.0,
+        'min_bits_per_second': min(rates), 'max_bits_per_second': max(rates)}
+
+'''
+RECORD OUTPUT:
+With --json or --csv every row is written as one record to stdout as soon as it is made, instead of tables, so the
+results can be read by a program instead of scraping the tables. --json writes one JSON object per line, --csv writes
+a header line first and then one line per record with the RECORD_FIELDS columns. The numbers have full precision: bytes,
+seconds and bits per second. role is sender or receiver (from the mode of the table, if the row does not have one).
+With --repeat every record has the number of the run it is from. All other messages are printed to stderr in these
+modes (see main), so stdout only has the records. run_client and run_server keep the same records in result_records.
+'''
+RECORD_FIELDS = ['event', 'role', 'source', 'id', 'start', 'end', 'seconds', 'bytes', 'bits_per_second',
+    'jitter_ms', 'lost', 'total', 'out_of_order', 'samples', 'min_ms', 'mean_ms', 'p50_ms', 'p99_ms', 'p999_ms', 'max_ms',
+    'calls', 'bytes_per_call', 'short_writes', 'eagain', 'blocked_ms', 'cpu_ms', 'cpu_percent', 'switches',
+    'disk_seconds', 'disk_bits_per_second', 'cwnd_bytes', 'srtt_ms', 'retransmits', 'pacing_bits_per_second', 'run', 'runs', 'stddev_bits_per_second', 'min_bits_per_second', 'max_bits_per_second',
+    'p50_bits_per_second', 'p5_bits_per_second', 'p95_bits_per_second', 'cov']
+record_file = None  # Where the records are written: sys.stdout as it is when they are written, if not set
+current_run = None  # The number of the run with --repeat
+record_lock = threading.Lock()  # Records from different threads are not mixed
+csv_writer = None   # Made when the first CSV record is written, with the header
+result_records = None   # A list that every record is added to, while run_client or run_server runs
+
+def create_records(mode, rows, source):
+    role = 'sender' if mode in ('C', 'L') else 'receiver'
+    records = []
+    for row in rows:
+        record = dict({'role': role, 'source': source}, **row)
+        if current_run is not None:
+            record['run'] = current_run
+        records.append(record)
+    return records
+
+def write_records(mode, rows, source):
+    global csv_writer
+    output = record_file or sys.stdout
+    with record_lock:
+        for record in create_records(mode, rows, source):
+            if args.json:
+                output.write(json.dumps(record) + "\n")
+            else:
+                if csv_writer is None:
+                    csv_writer = csv.DictWriter(output, fieldnames=RECORD_FIELDS)
+                    csv_writer.writeheader()
+                csv_writer.writerow(record)
+        output.flush()  # Streams the records: they are out as soon as they are made
+
+'''
+RECEIVE ENGINE:
+The server receives with recv_into() into one bytearray that is allocated when the client connects, instead of
+recv() which creates a new bytes object for every chunk. The data connections are a pure byte sink: the end of the
+test is told by the client closing its side of the connection, and everything else goes over the control connection,
+so the received data is never looked at, only counted.
+'''
+
+# Default size of the receive buffer on the server, used if --len is not set
+DEFAULT_RECV_LEN = 128000
+
+'''
+Creates the receive buffer. Returns the bytearray and a memoryview of it to receive into.
+'''
+def create_recv_buffer(length):
+    buffer = bytearray(length)
+    return buffer, memoryview(buffer)
+
+'''
+FILE SINK:
+Writes what a stream receives to a file on the server (-F), to measure a transfer to disk and not only over the network.
+The file is preallocated (posix_fallocate) for the size of the test if the client sent --num or a file, else SINK_GROW
+bytes at a time, so the file system does not have to find new blocks while the data arrives. Without --mmap the data
+is received into the receive buffer and written to the file. With --mmap the file is memory-mapped and the data is
+received straight into the mapping, so it is only copied once, from the socket to the page cache. close() cuts the file
+to the bytes received and waits until everything is on disk (msync and fsync), and returns when that was.
+'''
+SINK_GROW = 64 * 1024 * 1024    # Bytes allocated at a time when the size of the test is not known
+
+def allocate_file(fd, offset, length):
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except (AttributeError, OSError):   # Not on every operating system or file system. Then the file is sparse
+        os.ftruncate(fd, offset + length)
+
+class FileSink:
+
+    def __init__(self, path, size=None, use_mmap=False):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = size or SINK_GROW   # Bytes allocated
+        self.written = 0
+        self.map = self.view = None
+        try:
+            allocate_file(self.fd, 0, self.size)
+            if use_mmap:
+                self.map = mmap.mmap(self.fd, self.size)
+                self.view = memoryview(self.map)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def grow(self): # Room for SINK_GROW bytes more, when the test is longer than the allocation
+        allocate_file(self.fd, self.size, SINK_GROW)
+        self.size += SINK_GROW
+        if self.map is not None:
+            self.view.release() # The mapping can't be resized while it is exported
+            self.map.resize(self.size)
+            self.view = memoryview(self.map)
+
+    def receive(self, conn, view):  # Receives once into the file. Returns the number of bytes, 0 when the client is done
+        if self.map is not None:
+            if self.written == self.size:
+                self.grow()
+            n = conn.recv_into(self.view[self.written:])
+        else:
+            n = conn.recv_into(view)
+            if self.written + n > self.size:
+                self.grow()
+            done = 0
+            while done < n: # os.write can write less than asked
+                done += os.write(self.fd, view[done:n])
+        self.written += n
+        return n
+
+    def close(self):    # Cuts the file to what was received and waits until it is on disk. Returns the time when it was
+        try:
+            if self.map is not None:
+                self.map.flush()    # msync, the pages are written back
+                self.view.release()
+                self.map.close()
+            os.ftruncate(self.fd, self.written)
+            os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+        return time.time()
+
+'''
+The file a stream is written to with -F on the server: the file itself, or FILE.N for stream N if the test has more
+than one stream to us. N is the stream id, from 0 (FILE.0, FILE.1, ...).
+'''
+def stream_file(session, stream_id):
+    if list(session['streams'].values()).count(FORWARD) > 1:
+        return f"{args.file}.{stream_id}"
+    return args.file
+
+'''
+CONTROL PROTOCOL:
+A TCP test has one control connection and one data connection for each stream. Every connection starts with four
+bytes that tells what it is: CONTROL_MAGIC or DATA_MAGIC.
+On the control connection the client and server sends messages: a four byte length and a JSON object. A message to
+the server can be at most MAX_MESSAGE bytes, and the connection is closed on a longer one before anything is read
+into memory. The results to the client can be up to MAX_RESULTS bytes, since they grow with the number of streams.
+ 1. The client sends hello with the test parameters: time, number of bytes (num), block size (len), bitrate and
+    the id and direction of every stream (FORWARD: the client sends, REVERSE: the server sends, ECHO: the server
+    sends back what the client sends, for latency mode).
+ 2. The server answers accept with a random cookie for the test (or error).
+ 3. The client opens the data connections. Each starts with DATA_HEADER: the magic, the cookie and the stream id,
+    so the server knows which test and stream it belongs to and what to do with it.
+ 4. When a stream is done the sending side closes its side of the connection (shutdown).
+ 5. The client sends done, and the server answers results with what it measured for every stream.
+'''
+CONTROL_MAGIC = b'SPCT'
+DATA_MAGIC = b'SPDT'
+DATA_HEADER = struct.Struct('!4s16sI')  # Magic, cookie, stream id
+MESSAGE_LENGTH = struct.Struct('!I')    # Length of a control message
+MAX_MESSAGE = 64 * 1024 # The longest control message the server reads
+MAX_RESULTS = 16 * 1024 * 1024  # The longest results message the client reads
+FORWARD = 0 # The client sends and the server receives
+REVERSE = 1 # The server sends and the client receives
+ECHO = 2    # The server sends back everything it receives (latency mode)
+
+sessions = {}   # Cookie -> session, for every test that is running on the server
+sessions_lock = threading.Lock()    # The sessions are used by more than one thread
+
+# Set in every worker process of a server with --workers (see SERVER WORKERS), None in a server of one process
+worker_index = None # The number of this worker
+worker_inboxes = None   # The inbox queue of every worker
+worker_registry = None  # Cookie -> the hello, client and worker of every test, shared by all workers
+worker_reports = None   # Results of the finished tests, to the parent process
+
+'''
+Creates a control message: the length of the JSON and the JSON as bytes.
+'''
+def pack_message(message):
+    data = json.dumps(message).encode()
+    return MESSAGE_LENGTH.pack(len(data)) + data
+
+'''
+Receives one control message from a blocking socket. Returns the message, or None if the connection closes. Raises
+ValueError if the message is longer than limit, without receiving it, or is not valid JSON.
+'''
+def recv_message(sock, limit=MAX_MESSAGE):
+    header = recv_exact(sock, MESSAGE_LENGTH.size)
+    if header is None:
+        return None
+    data = recv_exact(sock, message_length(header, limit))
+    if data is None:
+        return None
+    return json.loads(data)
+
+'''
+The length of a control message from its header. Raises ValueError if it is longer than limit.
+'''
+def message_length(header, limit=MAX_MESSAGE):
+    length = MESSAGE_LENGTH.unpack_from(header)[0]
+    if length > limit:
+        raise ValueError(f"a control message of {length} bytes, at most {limit} bytes are allowed")
+    return length
+
+'''
+Receives exactly n bytes from a blocking socket. Returns them as bytes, or None if the connection closes before.
+'''
+def recv_exact(sock, n):
+    data = bytearray(n)
+    view = memoryview(data)
+    got = 0
+    while got < n:
+        count = sock.recv_into(view[got:])
+        if not count:
+            return None
+        got += count
+    return bytes(data)
+
+'''
+CREATE SESSION:
+Creates a session on the server for a hello message from the client at addr. The session has the test parameters, the
+direction of every stream and the results of the streams that are done. complete is an event (threading.Event or
+asyncio.Event, depending on the engine) that is set when every stream is done. omit is the seconds of warm-up (-O) the
+streams run before the time that is measured, 0 from a client that does not send it. tcp_info is set if the client
+wants the TCP_INFO of every stream in the results (--tcp-info). Returns the session, or raises ValueError if the hello
+is not valid (check_hello).
+With --workers the test is also put in the registry, so the other workers can find it (see mirror_session).
+'''
+def create_session(hello, addr, complete):
+    check_hello(hello)
+    session = new_session(hello, addr, complete, os.urandom(16))
+    with sessions_lock:
+        sessions[session['cookie']] = session
+    if worker_registry is not None: # Before the client gets the cookie and opens the data connections
+        worker_registry[session['cookie']] = {'hello': hello, 'addr': list(addr[:2]), 'owner': worker_index}
+
+    directions = list(session['streams'].values())
+    if session['params']['num'] is not None:
+        length = f"{session['params']['num']} bytes"
+    else:
+        length = f"{session['params']['time']} seconds"
+        if session['params']['omit']:
+            length += f" after {session['params']['omit']} seconds of warm-up"
+    if ECHO in directions:  # Latency mode
+        streams = f"{directions.count(ECHO)} echo stream(s)"
+    else:
+        streams = f"{directions.count(FORWARD)} stream(s) to us, {directions.count(REVERSE)} stream(s) from us"
+    print(f"[TEST] <{addr[0]}:{addr[1]}> {streams}, {length}, blocks of {session['params']['len']} bytes \n")
+    return session
+
+'''
+CHECK HELLO:
+Checks the hello from a client before a session is made from it, since the client decides what the server allocates:
+the test parameters must have the right types and be within the limits of the command line (len is the block size a
+REVERSE stream sends), and streams must be a list of [stream id, direction] pairs with different ids and known
+directions. Raises ValueError if it is not a valid hello.
+'''
+def check_hello(hello):
+    def whole(value, least=0):  # An int (not a bool) of at least least
+        return isinstance(value, int) and not isinstance(value, bool) and value >= least
+    if not isinstance(hello, dict) or hello.get('type') != 'hello':
+        raise ValueError("not a hello")
+    if not whole(hello.get('time')) or not whole(hello.get('omit', 0)):
+        raise ValueError("time and omit must be whole seconds")
+    if hello.get('num') is not None and not whole(hello['num']):
+        raise ValueError("num must be a number of bytes")
+    if not whole(hello.get('len'), 1) or hello['len'] > MAX_BLOCK_LEN:
+        raise ValueError(f"len must be between 1 and {MAX_BLOCK_LEN} bytes")
+    bitrate = hello.get('bitrate')
+    if bitrate is not None and (isinstance(bitrate, bool) or not isinstance(bitrate, (int, float)) or bitrate <= 0):
+        raise ValueError("bitrate must be a positive number of bits per second")
+    streams = hello.get('streams')
+    if not isinstance(streams, list) or not streams:
+        raise ValueError("streams must be a list of streams")
+    for stream in streams:
+        if (not isinstance(stream, list) or len(stream) != 2 or not whole(stream[0])
+                or stream[1] not in (FORWARD, REVERSE, ECHO) or isinstance(stream[1], bool)):
+            raise ValueError("every stream must be [stream id, direction]")
+    if len({stream[0] for stream in streams}) != len(streams):
+        raise ValueError("the stream ids must be different")
+
+'''
+The session dict for a hello and a cookie, without adding it to the sessions. Used by create_session, and by
+mirror_session for a test that was set up on another worker.
+'''
+def new_session(hello, addr, complete, cookie):
+    return {
+        'cookie': cookie,
+        'addr': addr,
+        'params': {'time': int(hello['time']), 'num': hello['num'], 'len': int(hello['len']), 'bitrate': hello['bitrate'],
+            'omit': int(hello.get('omit', 0)), 'tcp_info': bool(hello.get('tcp_info'))},
+        'streams': {int(stream_id): int(direction) for stream_id, direction in hello['streams']},
+        'results': {},
+        'live': {}, # Stream id -> counter_cell with the bytes so far, for the streams that are running (see SERVER STATS)
+        'omitted': {},  # Stream id -> (time, copy of the counter_cell) at the end of the warm-up (see omit_session)
+        'start': time.time(),
+        'complete': complete}
+
+'''
+Finds the session for a data connection. Returns the session, or None if there is no test with the cookie or no stream
+with the id in it. With --workers a test that was set up on another worker is found in the registry (mirror_session).
+'''
+def find_session(cookie, stream_id):
+    with sessions_lock:
+        session = sessions.get(cookie)
+        if session is None and worker_registry is not None:
+            session = mirror_session(cookie)
+    if session is None or stream_id not in session['streams'] or stream_id in session['results']:
+        return None
+    return session
+
+'''
+Registers a stream that has started in its session, and returns the counter_cell the stream writes its bytes to, so
+the server stats can see how far it has come while it runs. Prints how many data streams are running, in every
+session (count_active_streams), the same number as active_streams in the server stats. Control connections and the
+threads of the server itself, like the stats sampler and endpoints, are not counted.
+'''
+def open_stream(session, stream_id):
+    counter = counter_cell()
+    with sessions_lock:
+        session['live'][stream_id] = counter
+        active = count_active_streams()
+    print(f"[ACTIVE CONNECTIONS] {active} \n")
+    return counter
+
+'''
+OMIT SESSION:
+Called when the client tells us on the control connection that the warm-up (-O) is over. Saves the time and a copy of
+the counter_cell of every running stream, and finish_stream only counts what came after that. The client sends it when
+it reads its own counters for the warm-up, so both sides leave out the same seconds.
+'''
+def omit_session(session):
+    now = time.time()
+    with sessions_lock:
+        for stream_id, counter in session['live'].items():
+            session['omitted'][stream_id] = (now, list(counter))
+    if worker_inboxes is not None and 'owner' not in session:  # The streams on the other workers too
+        tell_workers(('omit', session['cookie']))
+
+'''
+Saves the results for a stream that is done, and sets the complete event if it was the last stream in the session.
+stats is the counter_cell of the stream with --stats, and the counters are saved with the results. disk_end is when
+the data was on disk for a stream that was written to a file (-F), and the time until then is saved as disk_elapsed.
+If the warm-up was left out (omit_session), the stream starts at the end of the warm-up, with the bytes and counters
+since then. tcp_info is from read_tcp_info when the stream was done (see wants_tcp_info).
+The results of a stream of a test on another worker (a mirror session) are also sent to that worker.
+'''
+def finish_stream(session, stream_id, addr, start_time, end_time, nbytes, stats=None, disk_end=None, tcp_info=None):
+    with sessions_lock:
+        omitted = session['omitted'].get(stream_id)
+        if omitted is not None:
+            start_time, base = omitted
+            nbytes -= base[0]
+            stats = read_stats(stats, 0, base) if stats is not None else None
+        elif stats is not None:
+            stats = read_stats(stats)
+        result = {'id': stream_id, 'direction': session['streams'][stream_id], 'addr': list(addr[:2]),
+            'start': start_time, 'elapsed': end_time - start_time, 'bytes': nbytes}
+        if stats is not None:
+            result['stats'] = stats
+        if disk_end is not None:
+            result['disk_elapsed'] = disk_end - start_time
+        if tcp_info is not None:
+            result['tcp_info'] = create_tcp_info(tcp_info)
+        session['live'].pop(stream_id, None)
+    if 'owner' in session:
+        worker_inboxes[session['owner']].put(('result', session['cookie'], stream_id, result))
+    store_result(session, stream_id, result)
+
+'''
+Saves the results of a stream in the session, and sets the complete event if it was the last stream.
+'''
+def store_result(session, stream_id, result):
+    with sessions_lock:
+        session['results'][stream_id] = result
+        complete = len(session['results']) == len(session['streams'])
+    if complete:
+        session['complete'].set()
+
+'''
+True if the server should read TCP_INFO of the streams in the session: with --tcp-info on either end.
+'''
+def wants_tcp_info(session):
+    return args.tcp_info or session['params']['tcp_info']
+
+'''
+Removes a session when the control connection is done, and prints the results for every stream. A worker (--workers)
+sends them to the parent process to print instead, and tells the other workers to drop their mirror of the session.
+'''
+def end_session(session):
+    if worker_registry is not None:
+        worker_registry.pop(session['cookie'], None)
+        tell_workers(('end', session['cookie']))
+    with sessions_lock:
+        if sessions.pop(session['cookie'], None) is not None:   # Counted in the server stats once
+            summary = describe_session(session)
+            server_totals['sessions'] += 1
+            server_totals['received'] += summary['bytes_received']
+            server_totals['sent'] += summary['bytes_sent']
+            completed_sessions.append(summary)
+        results = list(session['results'].values())
+    if worker_reports is not None:
+        worker_reports.put((session['addr'], results))
+    else:
+        print_stream_results(results)
+
+'''
+PRINT STREAM RESULTS:
+Prints the results of the streams in a session (from finish_stream) in one table for each direction, with a [SUM] row
+if there are more than one stream in the table. Streams the server has received are printed as received (mode S), and
+streams the server has sent as sent (mode C). Echo streams are printed as received. Used by the server, and by the client for the results from the server
+(source server). Streams that were written to a file (-F) also get the time until the data was on disk and the rate
+with that time, next to the network rate. With --tcp-info the rows get the TCP_INFO of the stream at the end, and the
+[SUM] row all retransmits. Returns the last row of each table ([SUM], or the one stream) by direction.
+'''
+def print_stream_results(results, source='local'):
+    totals = {}
+    for direction, mode in ((FORWARD, 'S'), (REVERSE, 'C'), (ECHO, 'S')):
+        group = sorted((result for result in results if result['direction'] == direction), key=lambda result: result['id'])
+        if not group:
+            continue
+        rows = [create_row(tuple(result['addr']), result['start'], result['start'], result['elapsed'], result['bytes'], False,
+            result.get('stats')) for result in group]
+        if len(group) > 1:
+            elapsed_time = max(result['elapsed'] for result in group)
+            total = sum(result['bytes'] for result in group)
+            rows.append(create_row('[SUM]', 0, 0, elapsed_time, total, False, sum_stats(result.get('stats') for result in group)))
+        disk = [result['disk_elapsed'] for result in group if 'disk_elapsed' in result]
+        if disk:
+            for row, result in zip(rows, group):
+                if 'disk_elapsed' in result:
+                    add_disk_time(row, result['disk_elapsed'])
+            if len(group) > 1:  # The [SUM] row, until the last stream was on disk
+                add_disk_time(rows[-1], max(disk))
+        for row, result in zip(rows, group):    # --tcp-info
+            add_tcp_info(row, result.get('tcp_info'))
+        if len(group) > 1 and any(result.get('tcp_info') for result in group):
+            rows[-1]['retransmits'] = sum(result['tcp_info']['retransmits'] for result in group if result.get('tcp_info'))
+        print_table(mode, rows, source)
+        totals[direction] = rows[-1]
+    return totals
+
+def add_disk_time(row, seconds):
+    row['disk_seconds'] = seconds
+    row['disk_bits_per_second'] = row['bytes'] * 8 / seconds if seconds > 0 else 0.0
+
+'''
+SERVER STATS:
+A live view of a server that runs for a long time. Every session has the counters of its running streams (open_stream),
+and the results of the streams that are done. A sampler thread reads the bytes of every session every stats interval
+(STATS_PERIOD if only the endpoint is on), and saves the rates since the last reading in server_rates. With
+--stats-interval it also prints one [AGGREGATE] line. The endpoints (--stats-port for HTTP, --stats-socket for a UNIX
+socket) answer with server_snapshot as JSON: the current rates, every running session with its bytes and rate, the totals
+of the finished sessions and the last COMPLETED_KEEP of them. They run in threads of their own and only read the
+sessions under sessions_lock, so they work with every engine. UDP tests are not sessions, and are not in the stats.
+'''
+STATS_PERIOD = 1    # Seconds between the readings when there is no --stats-interval
+COMPLETED_KEEP = 20 # Finished sessions in the snapshot
+server_started = time.time()
+server_totals = {'sessions': 0, 'received': 0, 'sent': 0}   # Finished sessions, and their bytes
+completed_sessions = collections.deque(maxlen=COMPLETED_KEEP)   # Summaries of the last finished sessions
+server_rates = {'received_bps': 0.0, 'sent_bps': 0.0, 'sessions': {}}   # From the last reading. Replaced, never changed
+
+'''
+Describes a session: client, when it started, streams and bytes received and sent so far. Must be called with
+sessions_lock held. Streams that are done are counted from the results, running streams from their counter.
+'''
+def describe_session(session):
+    received = sent = 0
+    for stream_id, direction in session['streams'].items():
+        if stream_id in session['results']:
+            nbytes = session['results'][stream_id]['bytes']
+        elif stream_id in session['live']:
+            nbytes = session['live'][stream_id][0]
+        else:   # Not connected yet
+            nbytes = 0
+        if direction == REVERSE:
+            sent += nbytes
+        else:   # Echo streams are counted as received
+            received += nbytes
+    now = time.time()
+    return {'client': f"{session['addr'][0]}:{session['addr'][1]}", 'cookie': session['cookie'].hex()[:8],
+        'start': session['start'], 'seconds': now - session['start'], 'streams': len(session['streams']),
+        'active_streams': len(session['live']), 'bytes_received': received, 'bytes_sent': sent}
+
+'''
+The number of data streams that are running in every session. Must be called with sessions_lock held.
+'''
+def count_active_streams():
+    return sum(len(session['live']) for session in sessions.values())
+
+'''
+Reads the bytes of every session and the totals. Returns (total received, total sent, {cookie: (received, sent)}).
+'''
+def read_server_bytes():
+    with sessions_lock:
+        running = {cookie: describe_session(session) for cookie, session in sessions.items()}
+        received = server_totals['received'] + sum(summary['bytes_received'] for summary in running.values())
+        sent = server_totals['sent'] + sum(summary['bytes_sent'] for summary in running.values())
+    return received, sent, {cookie: (summary['bytes_received'], summary['bytes_sent']) for cookie, summary in running.items()}
+
+'''
+The sampler thread. Reads the bytes every period seconds on the monotonic clock, and saves the rates in bits per second
+since the last reading in server_rates. A session that is new since the last reading counts from 0. Prints the
+[AGGREGATE] line if report is set.
+'''
+def run_stats_sampler(period, report):
+    global server_rates
+    last_clock = time.monotonic()
+    last_received, last_sent, last_sessions = read_server_bytes()
+    next_tick = last_clock + period
+    while True:
+        time.sleep(max(next_tick - time.monotonic(), 0))
+        next_tick += period
+        now = time.monotonic()
+        received, sent, running = read_server_bytes()
+        elapsed = now - last_clock
+        rates = {cookie.hex()[:8]: ((nbytes[0] - last_sessions.get(cookie, (0, 0))[0]) * 8 / elapsed,
+            (nbytes[1] - last_sessions.get(cookie, (0, 0))[1]) * 8 / elapsed) for cookie, nbytes in running.items()}
+        server_rates = {'received_bps': (received - last_received) * 8 / elapsed, 'sent_bps': (sent - last_sent) * 8 / elapsed,
+            'sessions': rates}
+        if report:
+            print(f"[AGGREGATE] {len(running)} active test(s), received {server_rates['received_bps'] / 1000000:.2f} Mbps, "
+                f"sent {server_rates['sent_bps'] / 1000000:.2f} Mbps, total {received // 1000000}MB received, {sent // 1000000}MB sent")
+        last_clock, last_received, last_sent, last_sessions = now, received, sent, running
+
+'''
+Returns the live statistics of the server as a dict, for the endpoints.
+'''
+def server_snapshot():
+    rates = server_rates
+    with sessions_lock:
+        running = [describe_session(session) for session in sessions.values()]
+        active = count_active_streams()
+        totals = dict(server_totals)
+        completed = list(completed_sessions)
+    for summary in running:
+        summary['received_bps'], summary['sent_bps'] = rates['sessions'].get(summary['cookie'], (0.0, 0.0))
+    return {'time': time.time(), 'uptime': time.time() - server_started,
+        'received_bps': rates['received_bps'], 'sent_bps': rates['sent_bps'],
+        'active_sessions': len(running), 'active_streams': active,
+        'sessions': running,
+        'completed': {'sessions': totals['sessions'], 'bytes_received': totals['received'], 'bytes_sent': totals['sent'],
+            'recent': completed}}
+
+'''
+STATS ENDPOINTS:
+serve_stats_http answers every GET with the snapshot as JSON, with http.server in a thread of its own. It only listens
+on 127.0.0.1, since it is for the monitoring on the same machine. serve_stats_socket writes one snapshot to every
+connection on a UNIX socket and closes it. start_server_stats starts the sampler and the endpoints that are asked for.
+'''
+def serve_stats_http(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Only needed with --stats-port
+
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(server_snapshot()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *entry):  # No line for every request
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', port), StatsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+def serve_stats_socket(path):
+    if os.path.exists(path):    # Left from a server that did not stop cleanly
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen()
+
+    def serve():
+        while True:
+            conn, addr = sock.accept()
+            try:
+                conn.sendall(json.dumps(server_snapshot()).encode() + b"\n")
+            except OSError: # The reader went away
+                pass
+            conn.close()
+    threading.Thread(target=serve, daemon=True).start()
+
+def start_server_stats():
+    if not (args.stats_port or args.stats_socket or args.stats_interval):
+        return
+    if args.udp:
+        print("[WARNING] The server stats only count TCP tests")
+    threading.Thread(target=run_stats_sampler, args=(int(args.stats_interval or STATS_PERIOD), bool(args.stats_interval)), daemon=True).start()
+    try:
+        if args.stats_port:
+            serve_stats_http(int(args.stats_port))
+            print(f"[STATS] Live statistics on http://127.0.0.1:{args.stats_port}/")
+        if args.stats_socket:
+            serve_stats_socket(args.stats_socket)
+            print(f"[STATS] Live statistics on the UNIX socket {args.stats_socket}")
+    except OSError as error:
+        print(f"[ERROR] Could not start the stats endpoint: {error}")
+        sys.exit(1)
+
+'''
+HANDLE CONNECTION:
+A function for handling each connection to the server in the thread engine. Function called from the start_server function.
 Takes socket connection, client address, server ip and server port as arguments.
-In an infinite while loop it tries to receive data from client. Keeps receiving data and adds them in a variable.
-Checks if there are no data or a BYE message and closes connection. Then sends all the data to create_results.
+Reads the first four bytes to find out if it is a control connection (handle_control) or a data connection. For a data
+connection it reads the rest of DATA_HEADER and finds the session, then receives with handle_client, sends with
+send_to_client or echoes with echo_client depending on the direction of the stream.
 '''
-def handle_client(conn, addr, server_ip, port):
+def handle_connection(conn, addr, server_ip, port):
+    try:
+        magic = recv_exact(conn, len(CONTROL_MAGIC))
+        if magic == CONTROL_MAGIC:
+            handle_control(conn, addr)
+            return
+        header = recv_exact(conn, DATA_HEADER.size - len(DATA_MAGIC)) if magic == DATA_MAGIC else None
+    except OSError:
+        header = None
+    if header is None:  # Not a simpleperf client, or it closed the connection
+        print(f"[ERROR] Unknown connection from <{addr[0]}:{addr[1]}>. Connection closed")
+        conn.close()
+        return
+
+    magic, cookie, stream_id = DATA_HEADER.unpack(magic + header)
+    session = find_session(cookie, stream_id)
+    if session is None:
+        print(f"[ERROR] <{addr[0]}:{addr[1]}> is not part of a test. Connection closed")
+        conn.close()
+        return
+
     print(f"A simpleperf client with <{addr[0]}:{addr[1]}> is connected with <{server_ip}:{port}> \n")
-    start_time = time.time()    # The start time for the connection
-    end_time = 0 # Declare end_time, to be used for later
-    recv_bytes = 0  # Declare recieved bytes
+    if session['streams'][stream_id] == REVERSE:
+        send_to_client(conn, addr, session, stream_id)
+    elif session['streams'][stream_id] == ECHO:
+        echo_client(conn, addr, session, stream_id)
+    else:
+        handle_client(conn, addr, session, stream_id)
 
-    while True: # Infinite loop
-        try:    # Tries to recive data from client
-            data = conn.recv(1000)  # Sets data as recieved data from client
-        except:
-            print("[ERROR] Could not receive data from client. Connection closed")
+'''
+HANDLE CONTROL:
+Handles the control connection for a test in the thread engine (and for the select engine). Reads hello and creates the
+session, answers with the cookie, and waits for done. If the client sends omit first (-O), the warm-up is left out of
+the session (omit_session). Then waits until every stream is done (at most 10 seconds), sends the results to the client,
+and ends the session. A client that runs more than one test (--repeat) sends the next hello on the same connection, so
+this goes on until the client closes it.
+'''
+def handle_control(conn, addr):
+    session = None
+    try:
+        hello = recv_message(conn)
+        if not isinstance(hello, dict) or hello.get('type') != 'hello':
+            print(f"[ERROR] No hello from <{addr[0]}:{addr[1]}>. Connection closed")
             conn.close()
-        else:   # If there are no errors
-            if not data:    # Stops if there are no more data
-                break
-            if b'BYE' in data:  # If there is a BYE message in data
-                recv_bytes += len(data) - len(b'BYE')  # Subtract the length of the 'BYE' message
-                conn.send(b'ACK:BYE')   # Sends ACK BYE back to client
+            return
+        while isinstance(hello, dict) and hello.get('type') == 'hello':   # One test for each hello
+            session = create_session(hello, addr, threading.Event())
+            conn.sendall(pack_message({'type': 'accept', 'cookie': session['cookie'].hex()}))
+
+            message = recv_message(conn)    # Waits until the client is done, or goes away
+            if isinstance(message, dict) and message.get('type') == 'omit':   # The warm-up is over
+                omit_session(session)
+                message = recv_message(conn)
+            if not isinstance(message, dict) or message.get('type') != 'done':
                 break
-            else:   # If there are data and no BYE message
-                recv_bytes += len(data) # Adds the length of the recieved bytes to the variable
+            session['complete'].wait(timeout=10)    # The last streams may still be closing
+            with sessions_lock:
+                results = list(session['results'].values())
+            conn.sendall(pack_message({'type': 'results', 'streams': results}))
+            end_session(session)
+            session = None
+            hello = recv_message(conn)  # The next test, or None when the client is done
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):  # Lost connection, or a message that is not valid
+        print(f"[ERROR] Control connection with <{addr[0]}:{addr[1]}> failed. Connection closed")
+    if session is not None:
+        end_session(session)
+    conn.close()
+
+'''
+HANDLE CLIENTS:
+Receives the data for one stream in the thread engine. Takes socket connection, client address, session and stream id.
+In a loop it receives data from client into the receive buffer and counts the bytes, until the client closes its side
+of the connection. The time is measured from the first data. Then gives the results to the session with finish_stream.
+The bytes so far are written to the counter of the stream for the server stats.
+With --stats every call after the first data is counted with counted_recv in a loop of its own, so the normal loop is
+the same as without. With -F the data is written to a file with a FileSink in a loop of its own, and the time until
+it is on disk is given to the session too.
+'''
+def handle_client(conn, addr, session, stream_id):
+    buffer, view = create_recv_buffer(args.len or DEFAULT_RECV_LEN)   # The buffer that are used for the whole connection
+    recv_bytes = 0  # Declare recieved bytes
+    start_time = time.time()
+    counter = open_stream(session, stream_id)
+    stats = counter if args.stats else None
+    sink = None
+    disk_end = None
+    if args.file:
+        path = stream_file(session, stream_id)
+        try:
+            sink = FileSink(path, session['params']['num'], args.mmap)
+        except OSError as error:
+            print(f"[ERROR] Could not open {path}: {error}. Receiving without writing it")
+
+    try:    # Tries to recive data from client into the buffer
+        n = sink.receive(conn, view) if sink else conn.recv_into(view)  # Waits for the first data. The test starts now
+        start_time = time.time()
+        if sink is not None:    # -F
+            while n:
+                recv_bytes += n
+                counter[0] = recv_bytes
+                n = sink.receive(conn, view)
+        elif stats is None:
+            while n:    # Stops when there are no more data
+                recv_bytes += n # Adds the number of recieved bytes to the variable
+                counter[0] = recv_bytes
+                n = conn.recv_into(view)
+        else:   # --stats
+            usage = read_usage()
+            while n:
+                recv_bytes += n
+                counter[0] = recv_bytes
+                n = counted_recv(conn, view, stats, usage)
+            update_usage(stats, usage)
+    except OSError:
+        print("[ERROR] Could not receive data from client. Connection closed")
 
     end_time = time.time()  # Sets end time
-    elapsed_time = end_time - start_time    # Sets elapsed time to send to results
-    create_result('S', addr, start_time, end_time, elapsed_time, recv_bytes, False)  # Calls the function to create results and send all the data. False for interval
+    if sink is not None:
+        try:
+            disk_end = sink.close()
+        except OSError as error:
+            print(f"[ERROR] Could not write {path}: {error}")
+    tcp_info = read_tcp_info(conn) if wants_tcp_info(session) else None
+    finish_stream(session, stream_id, addr, start_time, end_time, recv_bytes, stats, disk_end, tcp_info)
+    conn.close()
+
+'''
+SEND TO CLIENT:
+Handles a stream in reverse mode in the thread engine. Sends data with send_data, with the time (and warm-up), number
+of bytes, block size and bitrate from the session. Then closes the sending side of the connection, so the client knows it is
+done, waits for the client to close, and gives the results to the session.
+'''
+def send_to_client(conn, addr, session, stream_id):
+    params = session['params']
+    print(f"[REVERSE] Sending to <{addr[0]}:{addr[1]}> \n")
+    counter = open_stream(session, stream_id)
+    stats = counter if args.stats else None
+    try:
+        start_time, end_time, sent_bytes = send_data(conn, params['time'] + params['omit'], params['num'], params['len'], bitrate=params['bitrate'],
+            counter=counter, stats=args.stats)
+        conn.shutdown(socket.SHUT_WR)   # Tells the client that there is no more data
+        while conn.recv(1024):  # Waits until the client closes the connection
+            pass
+    except OSError:
+        print("[ERROR] Could not send data to client. Connection closed")
+    else:
+        tcp_info = read_tcp_info(conn) if wants_tcp_info(session) else None
+        finish_stream(session, stream_id, addr, start_time, end_time, sent_bytes, stats, tcp_info=tcp_info)
+    conn.close()
+
+'''
+ECHO CLIENT:
+Handles a stream in latency mode in the thread engine. Sends back every chunk as soon as it is received, from the same
+buffer, until the client closes the connection. TCP_NODELAY is set so the small probes are not held back by Nagle's
+algorithm. The bytes echoed are given to the session.
+'''
+def echo_client(conn, addr, session, stream_id):
+    buffer, view = create_recv_buffer(args.len or DEFAULT_RECV_LEN)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    echo_bytes = 0
+    counter = open_stream(session, stream_id)
+    start_time = time.time()
+    try:
+        n = conn.recv_into(view)
+        while n:
+            conn.sendall(view[:n])  # Sends back what was received
+            echo_bytes += n
+            counter[0] = echo_bytes
+            n = conn.recv_into(view)
+    except OSError:
+        print("[ERROR] Could not echo data to client. Connection closed")
+    finish_stream(session, stream_id, addr, start_time, time.time(), echo_bytes)
     conn.close()
 
 '''
 START SERVER:
 A function for starting the server. Listens for connections. If there are a connection, it starts a new thread and sends it to
-the handle_client function. Checks if there are a connection and closes if there are none.
+the handle_connection function. Checks if there are a connection and closes if there are none.
 '''
 def start_server(sock, server_ip, port):
     sock.listen()   # Socket listens for connections
@@ -240,161 +1279,2615 @@ def start_server(sock, server_ip, port):
             if conn:
                 conn.close()
         else:   # If there are no errors
-            thread = threading.Thread(target=handle_client, args=(conn, addr, server_ip, port))  # Creates new thread where target is the client function and sends the connection and address
+            thread = threading.Thread(target=handle_connection, args=(conn, addr, server_ip, port))  # Creates new thread where target is the connection function and sends the connection and address
             thread.start()
-            print(f"[ACTIVE CONNECTIONS] {threading.active_count() - 1} \n") # Prints how many active connections there are. -1 because listen always run as a thread.
 
 '''
-SERVER MODE:
-A function for handling the server mode. If the mode is invoked it gets the address from the user, creates a socket 
-and sends it to the start_server function.
+SELECT SERVER:
+An alternative to start_server for many clients at once (--engine select). Instead of one thread for each data
+connection, one loop uses the selectors module (epoll on Linux) to wait for any socket that is ready, and then receives
+from it or sends to it without blocking. Every connection has its own state: the DATA_HEADER while it is read, the
+session and stream, byte counter and start time. All of them share one receive buffer since only one socket is read at
+a time. A control connection is handed to handle_control in a thread of its own, since it only sends a few messages
+and would block the loop while it waits for the streams. Echo streams (latency mode) send back what they receive, and
+keep what did not fit in the socket until it is writable. Streams in reverse mode are sent to when their socket is
+writable. If they are paced with a bitrate they are taken out of the selector while they wait, and put back when the
+timer in the loop runs out. When a stream is done the results are given to the session with finish_stream.
 '''
-def server_mode():
-    port = int(args.port)    # port from input
-    server_ip = args.bind   #   server_ip from input
-    addr = (server_ip, port) #    server_ip and port called addr to simply
+def start_select_server(sock, server_ip, port):
+    sock.listen()   # Socket listens for connections
+    sock.setblocking(False) # Accept should never block the loop
+    print(f"{line} \t A simpleperf server is listening on port {port} {line}")
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
-    sock.bind(addr)     # Binds address to the socket
+    selector = selectors.DefaultSelector()  # epoll on Linux, kqueue on BSD/macOS
+    selector.register(sock, selectors.EVENT_READ, None) # The listening socket has no client state
+    buffer, view = create_recv_buffer(args.len or DEFAULT_RECV_LEN)   # One buffer for all connections
+    payloads = {}   # Block size -> payload, shared by every stream in reverse mode with the same block size
+    waiting = []    # (time to continue, client number, socket, state) for paced streams, sorted by time
 
-    start_server(sock, server_ip, port)  # Starts the server when invoked
+    '''
+    Closes a data connection and gives the results to the session. Used when a stream is done or has failed.
+    Nothing is saved for connections that never got to send their DATA_HEADER.
+    '''
+    def finish_client(conn, client):
+        end_time = client.get('end_time') or time.time()  # Sets end time
+        tcp_info = read_tcp_info(conn) if client['session'] is not None and wants_tcp_info(client['session']) else None
+        if conn in selector.get_map():
+            selector.unregister(conn)
+        conn.close()
+        if client['session'] is not None:
+            finish_stream(client['session'], client['stream'], client['addr'], client['start_time'] or end_time, end_time, client['bytes'],
+                tcp_info=tcp_info)
 
-'''
-START CLIENT:
-A function for starting (and running) the client. Takes socket and address as arguments.
-Tries to connect to the server. Then checks if there is set an interval and handles that accordingly.
-Checks if there is selected number of bytes or time, then runs a loop handling that.
-'''
-def start_client(sock, server_ip, port):
-    server_addr = (server_ip, port)
-    send_time = int(args.time)            # Defined time as the time from user input
-    packet = b"0" * 1000    # Packet to be sent defined as 1000 bytes
+    '''
+    Reads the start of a new connection: the magic and the rest of DATA_HEADER. Returns False if the connection
+    should be closed, else True.
+    '''
+    def read_header(conn, client):
+        n = conn.recv_into(memoryview(client['header'])[client['got']:client['want']])
+        if not n:
+            return False
+        client['got'] += n
+        if client['got'] < client['want']:  # Waits for the rest
+            return True
+        magic = bytes(client['header'][:len(DATA_MAGIC)])
+        if client['want'] == len(DATA_MAGIC):   # The magic is read
+            if magic == CONTROL_MAGIC:  # A control connection is handled by a thread of its own
+                selector.unregister(conn)
+                conn.setblocking(True)
+                client['phase'] = 'control'
+                threading.Thread(target=handle_control, args=(conn, client['addr'])).start()
+                return True
+            if magic != DATA_MAGIC:
+                return False
+            client['want'] = DATA_HEADER.size   # Reads the rest of the header
+            return True
 
-    print(f"{line} A simpleperf client connecting to server {server_ip}, port {port} {line}")
-    
-    try:    # Tries to connect to the server address
-        sock.connect(server_addr)
-    except: # Prints error if it can't connect to server
-        print("[ERROR] Could not connect, please try again")
-    else:   # If there are no errors
-        # Declares the client address
-        client_ip = sock.getsockname()[0]
-        client_port = sock.getsockname()[1]
-        client_addr = (client_ip, client_port)
-
-        print(f"Client connected with {server_ip} port {port} \n")
-        
-        start_time = time.time()    # Sets start time                
-        bytes = args.num    # Bytes are the number set in CLI
-        total_bytes = 0 # declares total bytes
-
-        # Declares variables for interval flag:
-        if args.interval is not None:   # Checks if a interval is set
-            interval = int(args.interval)
+        magic, cookie, stream_id = DATA_HEADER.unpack(client['header'])
+        session = find_session(cookie, stream_id)
+        if session is None:
+            print(f"[ERROR] <{client['addr'][0]}:{client['addr'][1]}> is not part of a test. Connection closed")
+            return False
+        client['session'] = session
+        client['stream'] = stream_id
+        client['counter'] = open_stream(session, stream_id)    # The bytes so far, for the server stats
+        params = session['params']
+        print(f"A simpleperf client with <{client['addr'][0]}:{client['addr'][1]}> is connected with <{server_ip}:{port}> \n")
+        if session['streams'][stream_id] == REVERSE:    # Starts sending when the socket is writable
+            print(f"[REVERSE] Sending to <{client['addr'][0]}:{client['addr'][1]}> \n")
+            client['phase'] = 'send'
+            client['start_time'] = time.time() # The test starts now
+            if params['len'] not in payloads:
+                payloads[params['len']] = create_payload(params['len'])
+            client['payload'] = payloads[params['len']]
+            client['pacer'] = TokenBucket(params['bitrate'], params['len']) if params['bitrate'] else None
+            selector.modify(conn, selectors.EVENT_WRITE, client)
+        elif session['streams'][stream_id] == ECHO: # Sends back what it receives (latency mode)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client['phase'] = 'echo'
+            client['start_time'] = time.time()
+            client['pending'] = b''    # What is left to echo when the socket was full
         else:
-            interval = None
-        interval_start = start_time
-        interval_bytes = 0
+            client['phase'] = 'recv'
+        return True
 
-        '''
-        NUMBER OF BYTES: 
-        If there are defined number of bytes with the -n flag
-        '''  
-        # IF THERE ARE DEFINED BYTES WITH --NUM
-        if bytes != None:
-            total_bytes = bytes # Sets how many bytes from start
-            while bytes > 0:    # As long as there are more bytes
-
-                if bytes < 1000:    # If there is less than 1000 bytes
-                    sock.send(b"0" * bytes) # Sends bytes as 0 as many times as there are bytes left
-                    interval_bytes += bytes # Adds to interval_bytes
-                    bytes = 0   # No more bytes
-                sock.send(packet)   # If there are > 1000 bytes, keep sending packets of 1000 bytes.
-                interval_bytes += len(packet)   # Adds bytes to interval bytes
-                bytes -= 1000   # Subtract 1000 bytes from the amount given by user
-
-                '''
-                INTERVAL FLAG:
-                If there is set an interval for printing results, it will keep sending data to the create_result function
-                '''
-                current_time = time.time()
-                if interval and current_time - interval_start >= interval:  # If there is set an interval and we hit the interval
-                    elapsed_time = current_time - interval_start    # Elapsed time is the current time subtracted by when the interval started
-                    create_result('C', client_addr, start_time, interval_start, elapsed_time, interval_bytes, True)   # Creates result with the interval given
-                    # "Reset" start time and interval bytes
-                    interval_start = current_time
-                    interval_bytes = 0
-            end_time = time.time()  # Sets end time when the loop is done
-            sock.send(b'BYE')   # Send the BYE message after sending the specified amount of data
-        
-            '''
-        TIME MODE: 
-        If bytes (num) are not defined, it will either be default (25 sec) or defined by the time flag.
-        A while loop that runs as long as the current time is less then the defined end time.
-        '''
-        else:
-            end_time = start_time + send_time   # Defines end time as the start + time chosen by user
-            while time.time() < end_time:   # As long as the current time is less then the end time
-                remaining_time = end_time - time.time() # Defines how long is remaining
-                sock.send(packet)   # Sends packets of 1000 bytes
-                total_bytes += len(packet) # Adds length of packet to the total amount of bytes sent
-                interval_bytes += len(packet)   # Adds bytes to the interval_bytes
-
-                '''
-                INTERVAL FLAG:
-                If there is set an interval for printing results, it will keep sending data to the create_result function
-                '''
-                current_time = time.time()
-                if interval and current_time - interval_start >= interval:  # If there is set an interval and we hit the interval
-                    elapsed_time = current_time - interval_start    # Elapsed time is the current time subtracted by when the interval started
-                    create_result('C', client_addr, start_time, interval_start, elapsed_time, interval_bytes, True)   # Creates result with the interval given
-                    # "Reset" start time and interval bytes
-                    interval_start = current_time
-                    interval_bytes = 0
-        
-        ''' 
-        After the num or time loop are finished, the client sends BYE, sends all the data to the create_result function,
-        then checks for acknowledgement from the server 
-        '''
-        sock.send(b'BYE')   # Sends BYE message
-        total_elapsed_time = end_time - start_time
-        create_result('C', client_addr, start_time, interval_start, total_elapsed_time, total_bytes, False)  # Calls the create result function with the data and no interval (for summary)
-        server_msg = sock.recv(1024)    # Recives message back from server
-        if server_msg == b'ACK:BYE':    # If the server has acknowledged the BYE message
-            print("[SUCCESS] Server acknowledged BYE message \n")   # Print message to show that it succeeded
-        else:
-            print("[ERROR] Unexpected response from server")    # Prints error if there is no response/wrong response from server.
-        sock.close()    # Closes the connection when done
+    '''
+    Sends one block to a stream in reverse mode. When the time is up or all bytes are sent, closes the sending side and
+    waits for the client to close. Returns the number of seconds to wait before the next block if it is paced.
+    '''
+    def send_to(conn, client):
+        params = client['session']['params']
+        if params['num'] is not None:    # NUMBER OF BYTES
+            left = params['num'] - client['bytes']
+        else:   # TIME MODE
+            left = params['len'] if time.time() < client['start_time'] + params['time'] + params['omit'] else 0
+        if left <= 0:   # Done: tells the client there is no more data
+            client['end_time'] = time.time()
+            conn.shutdown(socket.SHUT_WR)
+            client['phase'] = 'drain'
+            selector.modify(conn, selectors.EVENT_READ, client)
+            return 0
+        payload = client['payload']
+        n = conn.send(payload if left >= len(payload) else payload[:left])  # Sends what fits in the socket buffer
+        client['bytes'] += n
+        client['counter'][0] = client['bytes']
+        if client['pacer']:
+            return client['pacer'].consume(n)
+        return 0
+
+    try:
+        while True:
+            timeout = 900   # Waits for sockets that are ready, at most 15 minutes or until the next paced stream
+            if waiting:
+                timeout = max(waiting[0][0] - time.monotonic(), 0)
+            events = selector.select(timeout=timeout)
+            if not events and not waiting:  # If no clients has sent anything in 15 minutes
+                print("[CONNECTION TIMEOUT] Timeout due to inactivity. Closing connections...")
+                break
+
+            now = time.monotonic()
+            while waiting and waiting[0][0] <= now: # Paced streams that can send again
+                resume, number, conn, client = waiting.pop(0)
+                selector.register(conn, selectors.EVENT_WRITE, client)
+
+            for key, mask in events:
+                if key.data is None:    # The listening socket is ready: a new client is connecting
+                    try:
+                        conn, addr = sock.accept()
+                    except (BlockingIOError, InterruptedError):  # Another client took it, or nothing to accept after all
+                        continue
+                    except OSError:
+                        print("[ERROR] Could not connect")
+                        continue
+                    conn.setblocking(False)
+                    # State for this connection: address, the header and how much of it is read, the session and
+                    # stream, when the stream started and bytes received or sent
+                    client = {'addr': addr, 'phase': 'header', 'header': bytearray(DATA_HEADER.size), 'got': 0,
+                        'want': len(DATA_MAGIC), 'session': None, 'stream': None, 'start_time': None, 'bytes': 0}
+                    selector.register(conn, selectors.EVENT_READ, client)
+                    continue
+
+                conn = key.fileobj  # A client socket is ready
+                client = key.data
+                try:
+                    if client['phase'] == 'header':  # Reads the header, and nothing more
+                        if not read_header(conn, client):   # Not a simpleperf client, or it closed the connection
+                            if client['session'] is None:
+                                print(f"[ERROR] Unknown connection from <{client['addr'][0]}:{client['addr'][1]}>. Connection closed")
+                            finish_client(conn, client)
+                        continue
+
+                    if client['phase'] == 'send':   # A stream in reverse mode can take more data
+                        delay = send_to(conn, client)
+                        if delay:   # Ahead of the bitrate: waits without being in the selector
+                            selector.unregister(conn)
+                            waiting.append((time.monotonic() + delay, id(conn), conn, client))
+                            waiting.sort()
+                        continue
+
+                    if client['phase'] == 'echo' and client['pending']: # The rest of the last echo can be sent
+                        sent = conn.send(client['pending'])
+                        client['pending'] = client['pending'][sent:]
+                        if not client['pending']:   # Done, reads again
+                            selector.modify(conn, selectors.EVENT_READ, client)
+                        continue
+
+                    n = conn.recv_into(view)    # Number of bytes recieved
+                    if client['phase'] == 'echo' and n: # Sends it back. What does not fit waits for the socket to be writable
+                        try:
+                            sent = conn.send(view[:n])
+                        except BlockingIOError:
+                            sent = 0
+                        if sent < n:
+                            client['pending'] = bytes(view[sent:n])
+                            selector.modify(conn, selectors.EVENT_WRITE, client)
+                except (BlockingIOError, InterruptedError): # Nothing to read or write after all, try again later
+                    continue
+                except OSError:
+                    print("[ERROR] Could not send or receive data. Connection closed")
+                    finish_client(conn, client)
+                    continue
+
+                if not n:   # The client closed the connection: the stream is done
+                    finish_client(conn, client)
+                elif client['phase'] == 'echo':
+                    client['bytes'] += n
+                    client['counter'][0] = client['bytes']
+                elif client['phase'] == 'recv': # Only counts the data. drain throws it away
+                    if client['start_time'] is None:    # The test starts with the first data
+                        client['start_time'] = time.time()
+                    client['bytes'] += n    # Adds the number of recieved bytes to this stream
+                    client['counter'][0] = client['bytes']
+    except KeyboardInterrupt:
+        # If the user hits ctrl+c, close the server socket and any open connections
+        print("[CLOSING CONNECTIONS] Goodbye!")
+
+    for key in list(selector.get_map().values()):   # Closes every socket that is left
+        key.fileobj.close()
+    for resume, number, conn, client in waiting:
+        conn.close()
+    selector.close()
+    sys.exit(0)
 
 '''
-CLIENT MODE:
-A function for handling the client mode. If the mode is invoked it gets the address from the user. Checks if there is set a parallel flag,
-then starts a new thread for each client set as parallel. Creates a socket and sends the socket and address to the start_client function. 
+UDP MODE:
+With -u the client sends datagrams that starts with a header with a sequence number and the time it was sent
+(UDP_HEADER). The rest of the datagram is the payload. When the client is done it sends a FIN datagram with the negative
+number of datagrams it has sent as sequence number (like iperf), and the server answers with its results (UDP_REPORT).
+The FIN is sent again until the report arrives, since any datagram can be lost.
+Probes in latency mode starts with ECHO_MAGIC instead (LATENCY_PROBE), and are sent straight back by the server.
 '''
-def client_mode():
-    server_ip = args.serverip   # server_ip from input
-    server_port= int(args.port)       # port from input
+UDP_HEADER = struct.Struct('!qq')   # Sequence number, time sent in nanoseconds
+UDP_REPORT = struct.Struct('!qqqqqd')    # Bytes, elapsed nanoseconds, datagrams received, datagrams sent, out of order, jitter in seconds
+DEFAULT_UDP_LEN = 1470  # Default datagram size, the same as iperf
+MAX_UDP_LEN = 65507 # The largest payload of an IPv4 UDP datagram
 
-    # For loop that create client threads for each parallel flag set
-    for clients in range(0, int(args.parallel)):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
-        thread = threading.Thread(target=start_client, args=(sock, server_ip, server_port))  # Starts the client when invoked
-        thread.start()
+'''
+START UDP SERVER:
+Receives datagrams from every client in one loop with recvfrom_into into one buffer. The results are kept for each
+client address: bytes and datagrams received, the highest sequence number seen and how many came out of order.
+Jitter is calculated as in RFC 3550: the difference in transit time (arrival - sent) between two datagrams,
+smoothed with J = J + (|D| - J) / 16. The clocks on the client and server don't have to be in sync, since only the
+difference is used. When a FIN arrives the results are printed and sent back to the client. Latency probes are echoed.
+A finished client is remembered with its report and the number of datagrams it sent, so a FIN that is sent again gets
+the same report, and datagrams that were delayed past the FIN (sequence number below the total) are thrown away
+instead of starting a new test. Finished clients, and clients that stop without a FIN, are forgotten after
+UDP_FORGET_AFTER seconds without a datagram from them.
+'''
+UDP_FORGET_AFTER = 60   # Seconds until a silent or finished client is forgotten
+
+def start_udp_server(sock, server_ip, port):
+    print(f"{line} \t A simpleperf server is listening on UDP port {port} {line}")
+    sock.settimeout(900)    # Set a timeout of 15 minutes for the server socket
+    buffer = bytearray(MAX_UDP_LEN)  # One buffer for every datagram from every client
+    clients = {}    # Client address -> results for the client that sends now
+    finished = {}   # Client address -> (report, datagrams sent, when the last datagram came) after the FIN
+    sweep = time.monotonic() + UDP_FORGET_AFTER # When the old clients are forgotten next
+
+    while True:
+        try:
+            n, addr = sock.recvfrom_into(buffer)
+        except socket.timeout:  # If no clients has sent anything in 15 minutes
+            print("[CONNECTION TIMEOUT] Timeout due to inactivity. Closing connections...")
+            break
+        except KeyboardInterrupt:   # If the user hits ctrl+c
+            print("[CLOSING CONNECTIONS] Goodbye!")
+            break
+        except OSError:
+            print("[ERROR] Could not receive data from client")
+            continue
+        arrival = time.time_ns()    # When the datagram arrived
+        now = time.monotonic()
+        if now >= sweep:    # Forgets the clients that have been silent for too long, so the dicts stay small
+            for old in [a for a, client in clients.items() if now - client['seen'] > UDP_FORGET_AFTER]:
+                del clients[old]
+            for old in [a for a, done in finished.items() if now - done[2] > UDP_FORGET_AFTER]:
+                del finished[old]
+            sweep = now + UDP_FORGET_AFTER
+        if n < UDP_HEADER.size: # Too short to be from simpleperf
+            continue
+        if buffer[:len(ECHO_MAGIC)] == ECHO_MAGIC:  # A latency probe: sends it back as it is
+            try:
+                sock.sendto(memoryview(buffer)[:n], addr)
+            except OSError:
+                pass    # The probe is lost, the client counts it
+            continue
+        seq, sent = UDP_HEADER.unpack_from(buffer)
+
+        if seq < 0: # FIN: the client is done
+            client = clients.pop(addr, None)
+            if client is not None:  # The first FIN from this client
+                total = -seq    # Number of datagrams the client has sent
+                lost = max(total - client['packets'], 0)
+                elapsed = client['last'] - client['first']
+                report = UDP_REPORT.pack(client['bytes'], elapsed, client['packets'], total, client['out_of_order'], client['jitter'])
+                finished[addr] = (report, total, now)
+                row = create_udp_row(addr, elapsed / 1e9, client['bytes'], client['jitter'], lost, total, client['out_of_order'])
+                print_table('U', [row])
+            if addr in finished:    # Sends the report, again if the last one was lost
+                report, total, seen = finished[addr]
+                finished[addr] = (report, total, now)
+                try:
+                    sock.sendto(report, addr)
+                except OSError:
+                    print("[ERROR] Could not send the report to the client")
+            continue
+
+        client = clients.get(addr)
+        if client is None:  # The first datagram from a client, or one that was delayed past the FIN
+            if addr in finished and seq < finished[addr][1]:    # Belongs to the test that is done
+                continue
+            print(f"A simpleperf client with <{addr[0]}:{addr[1]}> is sending to <{server_ip}:{port}> \n")
+            finished.pop(addr, None)
+            client = {'first': arrival, 'last': arrival, 'bytes': 0, 'packets': 0, 'max_seq': -1, 'out_of_order': 0, 'jitter': 0.0, 'transit': None}
+            clients[addr] = client
+
+        client['last'] = arrival
+        client['seen'] = now
+        client['bytes'] += n
+        client['packets'] += 1
+        if seq > client['max_seq']: # In order, maybe after some lost datagrams
+            client['max_seq'] = seq
+        else:   # Came after a datagram with a higher sequence number
+            client['out_of_order'] += 1
+
+        transit = (arrival - sent) / 1e9    # Transit time in seconds. Includes the clock difference, which is removed below
+        if client['transit'] is not None:
+            d = abs(transit - client['transit'])
+            client['jitter'] += (d - client['jitter']) / 16
+        client['transit'] = transit
+
+    sock.close()
+    sys.exit(0)
+
+'''
+SERVER WORKERS:
+With --workers N the server runs N processes instead of one, each with its own listening socket on the same port
+(SO_REUSEPORT), and the kernel spreads the new connections over them, so the server can use more than one CPU core.
+The control connection and the data connections of a test can land on different workers, so the tests are shared:
+ - The worker that gets the hello (the owner) puts the test in the registry, a dict in a multiprocessing.Manager that
+   every worker can read, before the client gets the cookie.
+ - A worker that gets a data connection for a test it does not know finds it in the registry, and makes a mirror of
+   the session (mirror_session) that runs the streams that came to it. The results of the streams are sent to the
+   owner, through its inbox queue, and are saved in the session of the owner like its own (store_result).
+ - The owner tells the other workers when the warm-up (-O) is over and when the test has ended, through their inboxes.
+ - When a test ends, the owner sends the results of every stream to the parent, which prints one report for the
+   client and the total of all tests. The other messages are printed by the workers.
+UDP tests have no sessions, and every client stays on one worker since the kernel picks it from the addresses.
+'''
+
+'''
+Makes a mirror of a test that was set up on another worker, from the registry, and adds it to the sessions. Must be
+called with sessions_lock held. Returns the session, or None if there is no test with the cookie.
+'''
+def mirror_session(cookie):
+    entry = worker_registry.get(cookie)
+    if entry is None:
+        return None
+    session = new_session(entry['hello'], tuple(entry['addr']), threading.Event(), cookie)
+    session['owner'] = entry['owner']   # The worker with the control connection
+    sessions[cookie] = session
+    return session
+
+'''
+Puts a message in the inbox of every other worker.
+'''
+def tell_workers(message):
+    for index, inbox in enumerate(worker_inboxes):
+        if index != worker_index:
+            inbox.put(message)
+
+'''
+Handles a message from another worker: ('result', cookie, stream id, results) for a test this worker owns, and
+('omit', cookie) and ('end', cookie) for a mirror.
+'''
+def handle_worker_message(message):
+    kind, cookie, *entry = message
+    with sessions_lock:
+        session = sessions.get(cookie)
+    if session is None: # The test has ended here already
+        return
+    if kind == 'result' and 'owner' not in session:
+        store_result(session, *entry)
+    elif kind == 'omit' and 'owner' in session:
+        omit_session(session)
+    elif kind == 'end' and 'owner' in session:
+        with sessions_lock:
+            sessions.pop(cookie, None)
+
+'''
+Reads the inbox of this worker in a thread of its own. call runs the handler where it is safe: right away for the
+thread and select engines, and on the event loop (loop.call_soon_threadsafe) for the asyncio engine.
+'''
+def start_inbox(call):
+    def read_inbox():
+        inbox = worker_inboxes[worker_index]
+        while True:
+            call(handle_worker_message, inbox.get())
+    threading.Thread(target=read_inbox, daemon=True).start()
+
+'''
+Runs in each worker process: listens on the port with SO_REUSEPORT and runs the server with the chosen engine.
+settings are the arguments of the parent, since a process that is not forked starts without them. A thread stops the
+worker if the parent is gone, so the port is not kept after a parent that was killed.
+'''
+def server_worker(index, addr, inboxes, registry, reports, settings):
+    global args, worker_index, worker_inboxes, worker_registry, worker_reports
+    args = settings
+    quiet_worker()
+    worker_index, worker_inboxes, worker_registry, worker_reports = index, inboxes, registry, reports
+    parent = os.getppid()
+    def watch_parent():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch_parent, daemon=True).start()
+    try:
+        sock = listen_socket(addr, reuse_port=True)
+    except OSError as error:
+        print(f"[ERROR] Worker {index} could not listen on port {addr[1]}: {error}")
+        sys.exit(1)
+    if args.engine != 'asyncio':    # run_async_server reads the inbox on its event loop
+        start_inbox(lambda handler, *entry: handler(*entry))
+    serve(sock, addr[0], addr[1])
+
+'''
+Starts the workers and prints the results of every test they send, with the total of all tests, until every worker
+has stopped. Ctrl+c (or SIGTERM, when it runs in the main thread) stops the workers and the registry too.
+'''
+def run_server_workers(addr, count):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("[ERROR] --workers needs SO_REUSEPORT, which this operating system does not have")
+        sys.exit(1)
+    if args.stats_port or args.stats_socket or args.stats_interval:   # Every worker only sees its own connections
+        print("[ERROR] The server stats (--stats-port, --stats-socket and --stats-interval) can't be used with --workers")
+        sys.exit(1)
+    manager = multiprocessing.Manager()
+    registry = manager.dict()   # Cookie -> test, for every worker
+    inboxes = [multiprocessing.Queue() for index in range(count)]
+    reports = multiprocessing.Queue()   # (client, results) of every test that ends
+    processes = []
+    for index in range(count):
+        process = multiprocessing.Process(target=server_worker, args=(index, addr, inboxes, registry, reports, args))
+        process.start()
+        processes.append(process)
+    print(f"[WORKERS] {count} server processes share port {addr[1]} with SO_REUSEPORT \n")
+    if threading.current_thread() is threading.main_thread():   # Signals can only be handled there
+        signal.signal(signal.SIGTERM, signal.default_int_handler)   # Like ctrl+c
+
+    totals = {'tests': 0, 'received': 0, 'sent': 0}
+    try:
+        while any(process.is_alive() for process in processes):
+            try:
+                client, results = reports.get(timeout=1)
+            except queue.Empty:
+                continue
+            print(f"[RESULTS] <{client[0]}:{client[1]}>")
+            print_stream_results(results)
+            totals['tests'] += 1
+            totals['received'] += sum(result['bytes'] for result in results if result['direction'] != REVERSE)
+            totals['sent'] += sum(result['bytes'] for result in results if result['direction'] == REVERSE)
+            print(f"[TOTAL] {totals['tests']} test(s), {totals['received'] // 1000000}MB received, {totals['sent'] // 1000000}MB sent \n")
+    except KeyboardInterrupt:   # If the user hits ctrl+c
+        print("[CLOSING CONNECTIONS] Goodbye!")
+    for process in processes:   # The workers got ctrl+c too, unless the signal was only sent to this process
+        process.join(timeout=1)
+        if process.is_alive():
+            process.terminate()
+    manager.shutdown()
+
+'''
+LISTEN SOCKET:
+Creates the socket the server listens on, UDP or TCP, with -w, --nodelay, -M, -C and --rcvbuf, and binds it to addr.
+Accepted connections inherit the options of the listening socket. With reuse_port (--workers) every worker binds its
+own socket to the same port.
+'''
+def listen_socket(addr, reuse_port=False):
+    if args.udp:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
+        tune_socket(sock)   # Accepted connections inherit the options of the listening socket
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if args.rcvbuf: # Sets the receive buffer on the listening socket. Accepted connections inherit it
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf)
+        if not args.udp and not worker_index:    # Once, not for every worker
+            print(f"[RECEIVE BUFFER] SO_RCVBUF is {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes")   # The kernel may double or limit the value
+    sock.bind(addr)     # Binds address to the socket
+    return sock
+
+'''
+SERVE:
+Runs the server on the socket with the chosen engine: start_udp_server for UDP, and start_server, start_select_server
+or run_async_server for TCP.
+'''
+def serve(sock, server_ip, port):
+    if args.udp:    # UDP has its own server loop
+        start_udp_server(sock, server_ip, port)
+    elif args.engine == 'select': # Starts the server with the chosen engine when invoked
+        start_select_server(sock, server_ip, port)
+    elif args.engine == 'asyncio':
+        try:
+            asyncio.run(run_async_server(sock, server_ip, port))
+        except KeyboardInterrupt:   # If the user hits ctrl+c
+            print("[CLOSING CONNECTIONS] Goodbye!")
+        sock.close()
+        sys.exit(0)
+    else:
+        start_server(sock, server_ip, port)
+
+'''
+SERVER MODE:
+A function for handling the server mode. If the mode is invoked it gets the address from the user, creates a socket 
+and sends it to the start_server function, or start_select_server/run_async_server for the select and asyncio engines.
+With --workers the server runs in that many processes (see SERVER WORKERS).
+'''
+def server_mode():
+    port = int(args.port)    # port from input
+    server_ip = args.bind   #   server_ip from input
+    addr = (server_ip, port) #    server_ip and port called addr to simply
+
+    if args.stats and (args.udp or args.engine != 'thread'):  # Only the loops of the thread engine are instrumented
+        print("[WARNING] --stats only counts TCP streams in the thread engine. No stats will be shown")
+    if args.file and (args.udp or args.engine != 'thread'):   # Only handle_client writes to a file
+        print("[WARNING] -F only writes TCP streams in the thread engine. Nothing will be written")
+    elif args.file and args.stats:
+        print("[WARNING] Streams written to a file with -F are not counted by --stats")
+    if args.mmap and not args.file:
+        print("[WARNING] --mmap is only used with -F")
+    if not args.udp:
+        check_tuning()  # -w, --nodelay, -M and -C
+    if args.workers and args.workers > 1:
+        run_server_workers(addr, args.workers)
+        return
+    start_server_stats()    # With --stats-port, --stats-socket or --stats-interval
+    serve(listen_socket(addr), server_ip, port)
+
+'''
+SEND ENGINE:
+The functions below are used by the client to send data as fast as possible. The client allocates one buffer of
+--len bytes when it starts and sends memoryview slices of that buffer for the rest of the test, so no new bytes objects
+are created per block. socket.send() can return before everything is written (a short write), so every function
+keeps track of how much is sent and continues from the right offset until the whole block/batch is in the kernel.
+'''
+
+# MSG_ZEROCOPY and SO_ZEROCOPY are not exported by the socket module, so the values from the Linux headers are used
+MSG_ZEROCOPY = getattr(socket, 'MSG_ZEROCOPY', 0x4000000)
+SO_ZEROCOPY = getattr(socket, 'SO_ZEROCOPY', 60)
+
+'''
+Creates the payload used for every block. Returns a memoryview of a bytearray filled with "0", so slices of it
+can be sent without copying.
+'''
+def create_payload(length):
+    return memoryview(bytearray(b"0") * length)
+
+'''
+Tries to turn on zero-copy sending for the socket with SO_ZEROCOPY. Returns the flag to give sendmsg if it worked,
+and 0 if the operating system does not support it (then the client just sends the normal way).
+'''
+def enable_zerocopy(sock):
+    if not sys.platform.startswith('linux') or not hasattr(sock, 'sendmsg'):   # MSG_ZEROCOPY only exists on Linux
+        return 0
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+    except OSError: # Older kernels gives ENOPROTOOPT
+        print("[WARNING] MSG_ZEROCOPY is not supported here, sending without it")
+        return 0
+    return MSG_ZEROCOPY
+
+'''
+With MSG_ZEROCOPY the kernel reports on the socket error queue when it is done with our buffer. We never change the
+payload, so we don't have to wait for these notifications, but they have to be read or the kernel eventually
+refuses more zero-copy sends with ENOBUFS. Reads all notifications there are without blocking.
+'''
+def reap_zerocopy(sock):
+    while True:
+        try:
+            sock.recvmsg(0, 4096, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):    # No more notifications
+            return
+        except OSError: # Nothing we can do about it here, the next send will tell if something is wrong
+            return
+
+'''
+Sends count blocks of the payload and returns the number of bytes sent (always len(payload) * count).
+With count == 1 and no flags it uses plain socket.send() (with --stats too). Otherwise it gives the kernel all the blocks in one
+sendmsg call (scatter/gather), so a batch of blocks only costs one system call. Short writes are handled by
+starting the next call at the offset where the last one stopped.
+With --stats, counter is the counter_cell of the stream and usage is from read_usage, and every call is counted with
+counted_send (see HOT PATH INSTRUMENTATION).
+'''
+def send_blocks(sock, payload, count=1, flags=0, counter=None, usage=None):
+    block_len = len(payload)
+    total = block_len * count   # How many bytes we have to send
+    sent = 0    # How many bytes we have sent so far
+
+    while sent < total:
+        offset = sent % block_len   # Where in the block the last call stopped
+        if offset == 0:
+            first = payload
+        else:
+            first = payload[offset:]
+
+        if count == 1 and not flags:    # Simple case: one block, one send
+            sent += sock.send(first) if usage is None else counted_send(sock, [first], len(first), 0, counter, usage)
+            continue
+
+        buffers = [first] + [payload] * ((total - sent - len(first)) // block_len)  # The rest of the current block + all full blocks left
+        try:
+            if usage is None:
+                sent += sock.sendmsg(buffers, [], flags)
+            else:   # --stats
+                sent += counted_send(sock, buffers, total - sent, flags, counter, usage)
+        except OSError as error:
+            if error.errno == errno.ENOBUFS and flags & MSG_ZEROCOPY:  # Too many zero-copy notifications waiting
+                reap_zerocopy(sock)
+                continue
+            raise
+
+    return sent
+
+'''
+TOKEN BUCKET:
+Paces the client to --bitrate. The bucket is filled with tokens (bytes) at the target rate and every send takes
+tokens for the bytes it sent. The clock (time.monotonic_ns) is only read when the bucket is empty, so at high rates most
+sends only costs a subtraction. When the bucket is still empty after it is filled up, consume returns how many seconds
+the client must wait, and the client sleeps (time.sleep or asyncio.sleep) instead of spinning. The bucket holds at most
+10 ms of data (or one block), so a sleep that lasts too long is made up for by a short burst, but a slow period is not.
+'''
+class TokenBucket:
+
+    def __init__(self, bitrate, block_len):
+        self.rate = bitrate / 8 / 1e9   # Bytes per nanosecond
+        self.size = max(bitrate / 8 / 100, block_len)   # 10 ms of data, but at least one block
+        self.tokens = block_len # Enough to send the first block at once
+        self.last = time.monotonic_ns() # When the bucket was last filled
+
+    def start(self):    # Empties the bucket, when the test starts after waiting for the other streams
+        self.tokens = 0
+        self.last = time.monotonic_ns()
+
+    def consume(self, nbytes):  # Takes tokens for nbytes that are sent. Returns seconds to wait before the next send
+        self.tokens -= nbytes
+        if self.tokens >= 0:
+            return 0
+        now = time.monotonic_ns()   # Fills the bucket with the tokens since last time
+        self.tokens = min(self.tokens + (now - self.last) * self.rate, self.size)
+        self.last = now
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate / 1e9   # How long it takes to fill the bucket up to 0
+
+'''
+STREAM COUNTERS:
+The interval results are not made by the streams. Every stream writes the number of bytes it has sent or received so
+far into a counter after each send or receive, and the interval reporter in collect_results reads the counters on a
+timer. The counters of a client are a multiprocessing.RawArray with COUNTER_WIDTH unsigned 64-bit numbers for each
+stream (COUNTER_FIELDS), so the worker processes and the reporter share them without a lock: each counter has only one
+writer, and an aligned 64-bit store is never seen half written. A stream gets its counters as a memoryview of its own
+items (counter_cell), so the hot loop only does counter[0] = total_bytes. The other fields are only written with --stats.
+Streams without a reporter get counters of their own that nobody reads (the server uses them for --stats).
+'''
+COUNTER_FIELDS = ['bytes', 'calls', 'short_writes', 'eagain', 'blocked_ns', 'cpu_ns', 'switches']
+COUNTER_WIDTH = len(COUNTER_FIELDS)
+CALLS, SHORT_WRITES, EAGAIN, BLOCKED_NS, CPU_NS, SWITCHES = range(1, COUNTER_WIDTH)   # Index of each field after bytes
+
+def create_counters(count):
+    return multiprocessing.RawArray('Q', count * COUNTER_WIDTH)
+
+def counter_cell(counters=None, index=0):
+    if counters is None:    # Nobody reads it
+        return memoryview(bytearray(8 * COUNTER_WIDTH)).cast('Q')
+    return memoryview(counters).cast('B').cast('Q')[index * COUNTER_WIDTH:(index + 1) * COUNTER_WIDTH]
+
+'''
+Returns the --stats counters of a stream as a dict, from a copy of all counters (or a counter_cell with index 0).
+With last (an older copy) it is the change since then.
+'''
+def read_stats(counts, index=0, last=None):
+    base = index * COUNTER_WIDTH
+    return {field: counts[base + i] - (last[base + i] if last else 0) for i, field in enumerate(COUNTER_FIELDS) if i}
+
+'''
+Adds up the --stats of many streams, for the [SUM] rows. Returns None if there are no stats.
+'''
+def sum_stats(stats):
+    stats = [entry for entry in stats if entry is not None]
+    if not stats:
+        return None
+    return {field: sum(entry[field] for entry in stats) for field in stats[0]}
+
+'''
+HOT PATH INSTRUMENTATION (--stats):
+Counts what a stream does in its send or receive loop, in its counter_cell. Without --stats the loops call the socket
+directly and none of this runs. With --stats the calls are the same blocking calls as without, so the throughput stays
+the same, and the time spent in each call is added to blocked_ns. When the socket buffer is full (or empty) that is
+the time the stream slept in the kernel waiting for the network (or the other side). A blocking send only returns
+with fewer bytes than it was given if it was interrupted, so that is a short write.
+EAGAIN is sampled: every USAGE_EVERY calls the socket is polled without waiting before the call, and if it is not
+ready the call would have returned EAGAIN without blocking, so it is counted. Without poll (Windows) it stays 0.
+The CPU time and context switches come from getrusage. RUSAGE_THREAD (Linux) gives them for the thread of the stream
+only, other systems only have RUSAGE_SELF for the whole process. getrusage is a system call too, so it is only read
+every USAGE_EVERY calls and at the end of the stream.
+'''
+USAGE_EVERY = 64    # Calls between each reading of the CPU time
+RUSAGE_STREAM = getattr(resource, 'RUSAGE_THREAD', getattr(resource, 'RUSAGE_SELF', 0))
+
+def read_usage():   # CPU time in ns and context switches (voluntary and involuntary) of this thread until now
+    if resource is None:
+        return 0, 0
+    usage = resource.getrusage(RUSAGE_STREAM)
+    return int((usage.ru_utime + usage.ru_stime) * 1e9), usage.ru_nvcsw + usage.ru_nivcsw
+
+def update_usage(counter, base):    # Writes the CPU time and context switches since base (from read_usage) to counter
+    cpu, switches = read_usage()
+    counter[CPU_NS] = max(cpu - base[0], 0)
+    counter[SWITCHES] = max(switches - base[1], 0)
+
+def sample_eagain(sock, counter, event):   # Counts an EAGAIN if the socket is not ready for event (POLLOUT or POLLIN) now
+    poller = select.poll()
+    poller.register(sock, event)
+    if not poller.poll(0):
+        counter[EAGAIN] += 1
+
+def counted_send(sock, buffers, size, flags, counter, usage):   # sendmsg of buffers (size bytes together), send if it is one. usage is from read_usage at the start
+    calls = counter[CALLS] + 1
+    counter[CALLS] = calls
+    if not calls % USAGE_EVERY:
+        update_usage(counter, usage)
+        if hasattr(select, 'poll'):
+            sample_eagain(sock, counter, select.POLLOUT)
+    began = time.monotonic_ns()
+    sent = sock.send(buffers[0], flags) if len(buffers) == 1 else sock.sendmsg(buffers, [], flags)
+    counter[BLOCKED_NS] += time.monotonic_ns() - began
+    if sent < size:
+        counter[SHORT_WRITES] += 1
+    return sent
+
+def counted_recv(sock, view, counter, usage):   # recv_into, the same way
+    calls = counter[CALLS] + 1
+    counter[CALLS] = calls
+    if not calls % USAGE_EVERY:
+        update_usage(counter, usage)
+        if hasattr(select, 'poll'):
+            sample_eagain(sock, counter, select.POLLIN)
+    began = time.monotonic_ns()
+    received = sock.recv_into(view)
+    counter[BLOCKED_NS] += time.monotonic_ns() - began
+    return received
+
+'''
+TCP TUNING AND TCP_INFO:
+The socket options that can be set on both ends of a test: -w/--window sets the kernel send and receive buffers
+(SO_SNDBUF and SO_RCVBUF), which decide how large the TCP window can get, --nodelay turns off Nagle's algorithm
+(TCP_NODELAY), -M/--mss sets the largest segment TCP sends (TCP_MAXSEG) and -C/--congestion the congestion control
+algorithm (TCP_CONGESTION, e.g. cubic or reno). They are set before the socket connects or listens, so the window scale
+and MSS are part of the handshake. The server sets them on the listening socket, and the connections it accepts
+inherits them. Each end only sets its own sockets.
+With --tcp-info the kernel's view of every connection is read with getsockopt(TCP_INFO) (Linux only): the congestion
+window in bytes, the smoothed RTT, the retransmitted segments and the pacing rate. A full window with an RTT that stays
+at the delay of the links means the window is the limit. An RTT that grows, and retransmits, means a queue on the path
+fills up. The client reads every stream each TCP_INFO_PERIOD in a thread of each worker (sample_tcp_info) into a
+tcp_info_cell that the interval reporter reads, and the server reads each stream once when it is done.
+'''
+TCP_INFO = struct.Struct('=8x24IQ')  # struct tcp_info on Linux: 8 bytes of state, 24 unsigned ints, and tcpi_pacing_rate
+INFO_MSS, INFO_RTT, INFO_CWND, INFO_RETRANS, INFO_PACING = 2, 15, 18, 23, 24 # Index of the fields we use
+TCP_INFO_OPTION = getattr(socket, 'TCP_INFO', None) # Not on every operating system
+TCP_CONGESTION = getattr(socket, 'TCP_CONGESTION', 13)  # The value from the Linux headers
+TCP_INFO_WIDTH = 4  # What is kept for every stream: cwnd in bytes, RTT in us, total retransmits, pacing rate in bytes/s
+TCP_INFO_PERIOD = 0.1   # Seconds between the readings of the client
+NO_PACING = 2 ** 64 - 1 # The pacing rate when the kernel does not pace the connection
+
+'''
+Sets the options from the command line (or opts, the options of a --target) on a TCP socket. Raises OSError if the
+operating system does not accept one, e.g. a congestion control algorithm that is not loaded.
+'''
+def tune_socket(sock, opts=None):
+    opts = opts or args
+    if opts.window:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, opts.window)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, opts.window)
+    if opts.nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if opts.mss:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG, opts.mss)
+    if opts.congestion:
+        sock.setsockopt(socket.IPPROTO_TCP, TCP_CONGESTION, opts.congestion.encode())
+
+'''
+Checks the options on a new socket before the test starts, and prints what the kernel made of the window (it doubles
+the value, and limits it to net.core.wmem_max and rmem_max). Exits with an error if an option is not accepted.
+'''
+def check_tuning(opts=None):
+    opts = opts or args
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        tune_socket(sock, opts)
+    except OSError as error:
+        if opts.congestion and error.errno in (errno.ENOENT, errno.EPERM):
+            print(f"[ERROR] The congestion control {opts.congestion} is not available. See /proc/sys/net/ipv4/tcp_allowed_congestion_control")
+        else:
+            print(f"[ERROR] Could not set the TCP options: {error}")
+        sys.exit(1)
+    if opts.window:
+        print(f"[WINDOW] SO_SNDBUF is {sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)} bytes, "
+            f"SO_RCVBUF is {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes")
+    if args.tcp_info and TCP_INFO_OPTION is None:
+        print("[WARNING] TCP_INFO is not available on this system. The TCP columns will be empty")
+    sock.close()
+
+'''
+Reads TCP_INFO of a socket. Returns (cwnd in bytes, smoothed RTT in us, total retransmits, pacing rate in bytes/s), or
+None if it can't be read (not Linux, or the socket is closed).
+'''
+def read_tcp_info(sock):
+    if TCP_INFO_OPTION is None:
+        return None
+    try:
+        info = TCP_INFO.unpack(sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO_OPTION, TCP_INFO.size))
+    except (OSError, struct.error): # struct.error: an old kernel with a shorter struct
+        return None
+    return (info[INFO_CWND] * info[INFO_MSS], info[INFO_RTT], info[INFO_RETRANS], info[INFO_PACING])
+
+'''
+Makes the TCP columns of a row from what read_tcp_info returned (or a tcp_info_cell). The retransmits are the ones since
+last, an older reading. Returns None if the connection was never read.
+'''
+def create_tcp_info(values, last=None):
+    if values is None or not values[1]: # An RTT of 0 means there is no reading yet
+        return None
+    return {'cwnd_bytes': values[0], 'srtt_ms': values[1] / 1000, 'retransmits': values[2] - (last[2] if last else 0),
+        'pacing_bits_per_second': values[3] * 8 if values[3] != NO_PACING else None}
+
+def add_tcp_info(row, info):
+    if info is not None:
+        row.update(info)
+
+'''
+The TCP_INFO of the streams in a client worker. client_worker makes one tcp_info_cell for each stream with --tcp-info,
+the streams add their socket with watch_socket when they are connected, and sample_tcp_info reads every socket that is
+watched into its cell. unwatch_socket reads a socket for the last time before the summary. Without --tcp-info there
+are no cells, and watch_socket and unwatch_socket do nothing.
+'''
+tcp_info_cells = {} # Stream id -> tcp_info_cell
+watched = {}    # Stream id -> socket
+watched_lock = threading.Lock() # A socket is not closed while it is read
+
+def tcp_info_cell(infos, index):
+    return memoryview(infos).cast('B').cast('Q')[index * TCP_INFO_WIDTH:(index + 1) * TCP_INFO_WIDTH]
+
+def store_tcp_info(stream_id, sock):
+    values = read_tcp_info(sock)
+    if values is not None:
+        tcp_info_cells[stream_id][:] = array.array('Q', values)
+
+def watch_socket(stream_id, sock):
+    if stream_id in tcp_info_cells:
+        with watched_lock:
+            watched[stream_id] = sock
+
+def unwatch_socket(stream_id):
+    with watched_lock:
+        sock = watched.pop(stream_id, None)
+        if sock is not None:
+            store_tcp_info(stream_id, sock)
+
+def sample_tcp_info(stop):
+    while not stop.wait(TCP_INFO_PERIOD):
+        with watched_lock:
+            for stream_id, sock in watched.items():
+                store_tcp_info(stream_id, sock)
+
+'''
+SEND DATA:
+The send loop, used by the client and by the server in reverse mode. Sends blocks of block_len bytes from one
+preallocated payload, batch blocks for each system call, until send_time seconds has passed or until bytes (if it is
+not None) are sent. The bytes sent so far are written to counter (see STREAM COUNTERS) after every send, so the loop
+does nothing but send and count. With a bitrate the sends are paced by a TokenBucket. With stats (--stats) every call
+is also counted in counter (see HOT PATH INSTRUMENTATION).
+Returns start time, end time and bytes sent.
+'''
+def send_data(sock, send_time, bytes, block_len, batch=1, flags=0, bitrate=None, counter=None, stats=False):
+    payload = create_payload(block_len)   # The one buffer that are sent for the whole test
+    pacer = TokenBucket(bitrate, block_len * batch) if bitrate else None  # Only paced with a bitrate
+    counter = counter if counter is not None else counter_cell()
+    usage = read_usage() if stats else None # The CPU time and context switches before the test, with --stats
+    if pacer:
+        pacer.start()
+
+    start_time = time.time()    # Sets start time                
+    total_bytes = 0 # declares total bytes
+
+    '''
+    NUMBER OF BYTES: 
+    If there are defined number of bytes with the -n flag
+    '''  
+    # IF THERE ARE DEFINED BYTES WITH --NUM
+    if bytes != None:
+        while total_bytes < bytes:    # As long as there are more bytes
+            left = bytes - total_bytes
+            if left < block_len:    # If there is less than one block left, send only what is left
+                sent = send_blocks(sock, payload[:left], 1, flags, counter, usage)
+            else:   # Sends as many full blocks as there are left, but no more than one batch
+                sent = send_blocks(sock, payload, min(batch, left // block_len), flags, counter, usage)
+            total_bytes += sent # Adds the bytes sent to the total amount of bytes sent
+            counter[0] = total_bytes
+            if pacer:   # Waits if we are ahead of --bitrate
+                delay = pacer.consume(sent)
+                if delay:
+                    time.sleep(delay)
+        end_time = time.time()  # Sets end time when the loop is done
+    
+        '''
+    TIME MODE: 
+    If bytes (num) are not defined, it will either be default (25 sec) or defined by the time flag.
+    A while loop that runs as long as the monotonic clock is less then the deadline.
+    '''
+    else:
+        deadline = time.monotonic() + send_time # The end of the test on the monotonic clock, that never jumps
+        while time.monotonic() < deadline:   # As long as the current time is less then the end time
+            sent = send_blocks(sock, payload, batch, flags, counter, usage)   # Sends one batch of blocks
+            total_bytes += sent # Adds the bytes sent to the total amount of bytes sent
+            counter[0] = total_bytes
+            if pacer:   # Waits if we are ahead of --bitrate
+                delay = pacer.consume(sent)
+                if delay:
+                    time.sleep(delay)
+        end_time = start_time + send_time   # Defines end time as the start + time chosen by user
+
+    if usage is not None:   # The last reading of the CPU time
+        update_usage(counter, usage)
+    return start_time, end_time, total_bytes
+
+'''
+SEND FILE:
+The send loop for -F. Sends count bytes of the file at path with socket.sendfile, which uses os.sendfile where the
+operating system has it: the kernel sends straight from the page cache, and the data is never copied to Python.
+The file is sent in chunks of chunk bytes, so the counter (and --bitrate) is updated while it is sent. With stats
+(--stats) every chunk is counted as one call, and the CPU time and context switches are counted.
+Returns start time, end time and bytes sent (less than count if the file got shorter while it was sent).
+'''
+FILE_CHUNK = 1000000    # Bytes for each sendfile call with -F, if --len is not set
+
+def send_file(sock, path, count, chunk, bitrate=None, counter=None, stats=False):
+    pacer = TokenBucket(bitrate, chunk) if bitrate else None
+    counter = counter if counter is not None else counter_cell()
+    usage = read_usage() if stats else None
+    if pacer:
+        pacer.start()
+    total_bytes = 0
+
+    with open(path, 'rb') as file:
+        start_time = time.time()
+        while total_bytes < count:
+            sent = sock.sendfile(file, total_bytes, min(chunk, count - total_bytes))
+            if not sent:    # The end of the file
+                break
+            total_bytes += sent
+            counter[0] = total_bytes
+            if usage is not None:
+                counter[CALLS] += 1
+            if pacer:
+                delay = pacer.consume(sent)
+                if delay:
+                    time.sleep(delay)
+    end_time = time.time()
+
+    if usage is not None:
+        update_usage(counter, usage)
+    return start_time, end_time, total_bytes
+
+'''
+The number of bytes each stream sends with -F: the size of the file, or --num if that is less.
+'''
+def file_length():
+    size = os.path.getsize(args.file)
+    return min(size, args.num) if args.num is not None else size
+
+'''
+The seconds each stream sends in time mode: the warm-up (-O) and then --time.
+'''
+def send_time():
+    return int(args.time) + int(args.omit)
+
+'''
+RECEIVE DATA:
+The receive loop for the client in reverse mode. Receives into one buffer with recv_into until the server closes its side
+of the connection, and writes the bytes received so far to counter like send_data does. With stats (--stats) every
+call is also counted.
+Returns start time, end time and bytes received.
+'''
+def receive_data(sock, counter=None, stats=False):
+    buffer, view = create_recv_buffer(DEFAULT_RECV_LEN) # The buffer that are used for the whole connection
+    counter = counter if counter is not None else counter_cell()
+    usage = read_usage() if stats else None
+    start_time = time.time()    # Sets start time
+    total_bytes = 0
+
+    while True:
+        if usage is None:
+            n = sock.recv_into(view)    # Number of bytes recieved
+        else:   # --stats
+            n = counted_recv(sock, view, counter, usage)
+        if not n:   # The server is done sending
+            break
+        total_bytes += n
+        counter[0] = total_bytes
+
+    if usage is not None:
+        update_usage(counter, usage)
+    return start_time, time.time(), total_bytes
+
+'''
+START CLIENT:
+A function for starting (and running) one stream that sends. Takes socket, address, the cookie from the control
+connection and the stream id as arguments.
+Tries to connect to the server and sends the DATA_HEADER. Then sends data with send_data, with the time, number of
+bytes, block size (--len), batch size and bitrate from the user (and the warm-up, -O, before the time), and closes the sending side of the connection
+to tell the server that the stream is done.
+The address and summary are given to report (print_report if not set), and the bytes sent so far are written to counter
+for the interval reporter. If ready is set, it is called after connecting and the test starts when it returns, so
+parallel streams can start at the same time.
+'''
+def start_client(sock, server_ip, port, cookie, stream_id, report=None, ready=None, counter=None):
+    report = report or print_report
+    server_addr = (server_ip, port)
+    block_len = args.len or 1000    # Size of each block from user input (default 1000 bytes)
+
+    print(f"{line} A simpleperf client connecting to server {server_ip}, port {port} {line}")
+    
+    try:    # Tries to connect to the server address
+        tune_socket(sock)   # -w, --nodelay, -M and -C
+        sock.connect(server_addr)
+        sock.sendall(DATA_HEADER.pack(DATA_MAGIC, cookie, stream_id))   # Tells the server which test and stream this is
+    except OSError: # Prints error if it can't connect to server
+        print("[ERROR] Could not connect, please try again")
+        if ready:   # The other streams are still waiting for this one
+            ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+
+    # Declares the client address
+    client_addr = sock.getsockname()[:2]
+    print(f"Client connected with {server_ip} port {port} \n")
+    report('start', client_addr)    # The reporter needs the address for the interval rows
+    watch_socket(stream_id, sock)   # --tcp-info
+
+    flags = 0   # Flags for sendmsg. Only used with --zerocopy
+    if args.zerocopy:
+        flags = enable_zerocopy(sock)
+
+    if ready:   # Waits until every parallel stream is connected
+        ready()
+
+    try:
+        if args.file:   # The file, with sendfile
+            start_time, end_time, total_bytes = send_file(sock, args.file, file_length(), args.len or FILE_CHUNK, args.bitrate,
+                counter, args.stats)
+        else:
+            start_time, end_time, total_bytes = send_data(sock, send_time(), args.num, block_len, args.batch, flags,
+                args.bitrate, counter, args.stats)
+
+        if flags:   # Reads the last zero-copy notifications before the connection is finished
+            reap_zerocopy(sock)
+
+        sock.shutdown(socket.SHUT_WR)   # Tells the server that there is no more data
+        while sock.recv(1024):  # Waits until the server has received everything and closes
+            pass
+        unwatch_socket(stream_id)   # The last TCP_INFO, before the summary
+    except OSError:
+        print("[ERROR] Could not send data to server. Connection closed")
+        report('error', None, 0, 0, 0, 0)
+    else:
+        report('summary', client_addr, start_time, start_time, end_time - start_time, total_bytes)  # Calls the report function with the data and no interval (for summary)
+    sock.close()    # Closes the connection when done
+
+'''
+START REVERSE CLIENT:
+The client for reverse mode (-R, and the receiving half of --bidir). Takes the same arguments as start_client.
+Connects to the server, waits for the other streams, and sends the DATA_HEADER. The server then sends with the time,
+number of bytes, block size and bitrate from the session. Receives with receive_data until the server is done and
+closes its side of the connection. The results are in the receiving format (mode S).
+'''
+def start_reverse_client(sock, server_ip, port, cookie, stream_id, report=None, ready=None, counter=None):
+    report = report or (lambda kind, *entry: print_report(kind, *entry, mode='S'))
+    server_addr = (server_ip, port)
+
+    print(f"{line} A simpleperf client connecting to server {server_ip}, port {port} (reverse) {line}")
+
+    try:    # Tries to connect to the server address
+        tune_socket(sock)
+        sock.connect(server_addr)
+    except OSError: # Prints error if it can't connect to server
+        print("[ERROR] Could not connect, please try again")
+        if ready:   # The other streams are still waiting for this one
+            ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+
+    client_addr = sock.getsockname()[:2]    # Declares the client address
+    print(f"Client connected with {server_ip} port {port}, receiving \n")
+    report('start', client_addr)
+    watch_socket(stream_id, sock)
+    if ready:   # Waits until every parallel stream is connected, so the server does not start sending before the others
+        ready()
+
+    try:
+        sock.sendall(DATA_HEADER.pack(DATA_MAGIC, cookie, stream_id))   # The server starts sending when it gets this
+        start_time, end_time, total_bytes = receive_data(sock, counter, args.stats)
+        unwatch_socket(stream_id)
+    except OSError:
+        print("[ERROR] Could not receive data from server. Connection closed")
+        report('error', None, 0, 0, 0, 0)
+    else:
+        report('summary', client_addr, start_time, start_time, end_time - start_time, total_bytes)
+    sock.close()    # Closes the connection when done
+
+'''
+START UDP CLIENT:
+The client for UDP mode (-u). Takes the same arguments as start_client. Sends datagrams of --len bytes (default 1470)
+with a sequence number and the time it was sent, at --bitrate bits per second (default 1 Mbit/s), paced by a TokenBucket.
+After the time is up or --num bytes are sent it sends FIN and waits for the report from the server, and gives it to
+report as kind server before the summary.
+'''
+def start_udp_client(sock, server_ip, port, report=None, ready=None, counter=None):
+    report = report or print_report
+    server_addr = (server_ip, port)
+    datagram_len = args.len or DEFAULT_UDP_LEN  # Size of each datagram
+    if datagram_len < UDP_HEADER.size or datagram_len > MAX_UDP_LEN:
+        print(f"[ERROR] The datagram size must be between {UDP_HEADER.size} and {MAX_UDP_LEN} bytes in UDP mode")
+        if ready:
+            ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+    bitrate = args.bitrate or 1000000   # Target bitrate in bits per second
+    pacer = TokenBucket(bitrate, datagram_len)
+    buffer = bytearray(b"0") * datagram_len   # The one datagram buffer. Only the header changes
+
+    print(f"{line} A simpleperf client sending UDP to server {server_ip}, port {port} {line}")
+    sock.connect(server_addr)   # A connected UDP socket only sends to and receives from the server
+    client_addr = sock.getsockname()[:2]
+    print(f"Client sending {datagram_len} byte datagrams at {bitrate / 1000000:g} Mbps \n")
+    report('start', client_addr)
+    counter = counter if counter is not None else counter_cell()
+
+    if ready:   # Waits until every parallel stream is ready
+        ready()
+
+    pacer.start()
+    start_time = time.time()    # Sets start time
+    end_time = start_time + int(args.time)
+    bytes = args.num    # Bytes are the number set in CLI, None in time mode
+    total_bytes = 0
+    seq = 0 # Sequence number of the next datagram
+
+    while True:
+        if bytes is not None:   # NUMBER OF BYTES: stops when enough datagrams are sent
+            if total_bytes >= bytes:
+                break
+        elif time.time() >= end_time:   # TIME MODE: stops when the time is up
+            break
+
+        UDP_HEADER.pack_into(buffer, 0, seq, time.time_ns())    # Writes the header into the buffer
+        try:
+            sock.send(buffer)
+        except ConnectionRefusedError:  # ICMP port unreachable: no server on the port
+            print("[ERROR] The server is not listening on this UDP port")
+            report('error', None, 0, 0, 0, 0)
+            sock.close()
+            return
+        except OSError:  # E.g. ENOBUFS when the send buffer is full. The datagram counts as lost
+            pass
+        seq += 1
+        total_bytes += datagram_len
+        counter[0] = total_bytes
+        delay = pacer.consume(datagram_len)
+        if delay:   # Sleeps if we are ahead of the bitrate
+            time.sleep(delay)
+
+    if bytes is not None:   # In num mode the test ends when everything is sent
+        end_time = time.time()
+
+    sock.settimeout(0.25)   # Waits at most 250 ms for the report each time
+    fin = UDP_HEADER.pack(-seq, time.time_ns())
+    for attempt in range(10):   # Sends FIN until the server answers, at most 10 times
+        try:
+            sock.send(fin)
+            data = sock.recv(UDP_REPORT.size)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+        if len(data) == UDP_REPORT.size:
+            recv_bytes, elapsed, packets, total, out_of_order, jitter = UDP_REPORT.unpack(data)
+            report('server', client_addr, elapsed / 1e9, recv_bytes, jitter, max(total - packets, 0), total, out_of_order)
+            break
+    else:
+        print("[WARNING] Did not receive a report from the server")
+    report('summary', client_addr, start_time, start_time, end_time - start_time, total_bytes)
+    sock.close()
+
+'''
+LATENCY MODE:
+With --latency the client measures round-trip time instead of throughput. Every stream sends small probes
+(LATENCY_PROBE, padded to --len bytes, default 64) with a sequence number and the time it was sent on the monotonic
+clock, and waits for the server to send it back (ECHO streams for TCP, echoed datagrams for UDP). Only one probe is out
+at a time, so the round-trip time is not mixed with queueing behind other probes. With --bitrate the probes are paced.
+A UDP probe that is not back within one second is counted as lost.
+'''
+ECHO_MAGIC = b'SPEC'
+LATENCY_PROBE = struct.Struct('!4sqq')  # Magic, sequence number, time sent in nanoseconds (monotonic)
+DEFAULT_PROBE_LEN = 64  # Default probe size
+
+'''
+LATENCY HISTOGRAM:
+Records round-trip times in nanoseconds in fixed buckets, like an HDR histogram, so millions of samples take the same
+memory (about 30 KB) and percentiles can be read without storing every sample. Values below 2 * SUB_BUCKETS are
+recorded exactly. Above that each power of two is split in SUB_BUCKETS linear buckets, so a value is always within
+1 / SUB_BUCKETS (0.8%) of the bucket it is recorded in. The counts are in an array of unsigned 64-bit numbers.
+min, max and the sum are exact. Histograms from parallel streams are added together with merge.
+'''
+class LatencyHistogram:
+    SUB_BITS = 7    # 128 buckets for every power of two
+    SUB_BUCKETS = 1 << SUB_BITS
+    MAX_VALUE = 1 << 36 # About 68 seconds. Larger values are recorded as this
+
+    def __init__(self):
+        self.counts = array.array('Q', bytes(8 * self.index(self.MAX_VALUE) + 8))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def index(self, value): # The bucket for a value
+        if value < 2 * self.SUB_BUCKETS:    # Exact
+            return value
+        shift = value.bit_length() - self.SUB_BITS - 1  # Keeps the SUB_BITS + 1 highest bits
+        return (shift + 1) * self.SUB_BUCKETS + (value >> shift) - self.SUB_BUCKETS
+
+    def value(self, index): # The middle of a bucket
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return ((index % self.SUB_BUCKETS + self.SUB_BUCKETS) << shift) + (1 << shift) // 2
+
+    def record(self, value):
+        value = min(max(value, 0), self.MAX_VALUE)
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other): # Adds the samples from another histogram
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):  # The value that percent % of the samples are below or equal to
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))  # Rounds up: the rank of the sample
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self.value(index), self.min), self.max)  # Never outside the real samples
+        return self.max
+
+'''
+CREATE LATENCY ROW:
+Creates a row for a latency result (mode L in print_table). Uses create_row for the first columns (with the bytes of
+the probes that are sent), and adds the number of samples and lost probes, and min, mean, p50, p99, p99.9 and max
+round-trip time in milliseconds from the histogram.
+'''
+def create_latency_row(addr, elapsed_time, data, histogram, lost):
+    row = create_row(addr, 0, 0, elapsed_time, data, False)
+    mean = histogram.total / histogram.count if histogram.count else 0
+    row.update({'event': 'latency', 'samples': histogram.count, 'lost': lost, 'min_ms': (histogram.min or 0) / 1e6,
+        'mean_ms': mean / 1e6, 'p50_ms': histogram.percentile(50) / 1e6, 'p99_ms': histogram.percentile(99) / 1e6,
+        'p999_ms': histogram.percentile(99.9) / 1e6, 'max_ms': histogram.max / 1e6})
+    return row
+
+'''
+START LATENCY CLIENT:
+One stream in latency mode. Takes the same arguments as start_client, and the socket can be TCP or UDP (-u).
+Connects (and sends the DATA_HEADER for TCP), waits for the other streams, and sends one probe at a time until the time
+is up or --num bytes of probes are sent. Each round-trip time is recorded in a LatencyHistogram, which is given to
+report as kind latency with the number of lost probes.
+'''
+def start_latency_client(sock, server_ip, port, cookie, stream_id, report=None, ready=None):
+    report = report or print_report
+    udp = sock.type == socket.SOCK_DGRAM
+    probe_len = args.len or DEFAULT_PROBE_LEN
+    if probe_len < LATENCY_PROBE.size or probe_len > MAX_UDP_LEN:
+        print(f"[ERROR] The probe size must be between {LATENCY_PROBE.size} and {MAX_UDP_LEN} bytes in latency mode")
+        if ready:
+            ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+    probe = bytearray(probe_len)    # The one probe buffer. Only the header changes
+    reply = bytearray(probe_len)
+    view = memoryview(reply)
+    pacer = TokenBucket(args.bitrate, probe_len) if args.bitrate else None
+    histogram = LatencyHistogram()
+
+    print(f"{line} A simpleperf client measuring latency to server {server_ip}, port {port} {line}")
+    try:
+        sock.connect((server_ip, port))
+        if udp:
+            sock.settimeout(1)  # A probe that is not back in a second is lost
+        else:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Sends every probe at once
+            sock.sendall(DATA_HEADER.pack(DATA_MAGIC, cookie, stream_id))
+    except OSError:
+        print("[ERROR] Could not connect, please try again")
+        if ready:
+            ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+
+    client_addr = sock.getsockname()[:2]
+    print(f"Client connected with {server_ip} port {port}, sending {probe_len} byte probes \n")
+    report('start', client_addr)
+    if ready:   # Waits until every parallel stream is connected
+        ready()
+    if pacer:
+        pacer.start()
+
+    start_time = time.time()
+    deadline = time.monotonic() + int(args.time)
+    seq = 0
+    lost = 0
+    try:
+        while True:
+            if args.num is not None:    # NUMBER OF BYTES: stops when enough probes are sent
+                if seq * probe_len >= args.num:
+                    break
+            elif time.monotonic() >= deadline:  # TIME MODE: stops when the time is up
+                break
+
+            LATENCY_PROBE.pack_into(probe, 0, ECHO_MAGIC, seq, time.monotonic_ns())
+            sock.sendall(probe)
+            if udp:
+                while True: # Waits for this probe. Late replies to earlier probes are thrown away
+                    try:
+                        n = sock.recv_into(view)
+                    except socket.timeout:
+                        lost += 1
+                        break
+                    if n >= LATENCY_PROBE.size and LATENCY_PROBE.unpack_from(reply)[1] == seq:
+                        histogram.record(time.monotonic_ns() - LATENCY_PROBE.unpack_from(reply)[2])
+                        break
+            else:
+                got = 0
+                while got < probe_len:  # TCP can return the probe in parts
+                    n = sock.recv_into(view[got:])
+                    if not n:
+                        raise ConnectionResetError("the server closed the connection")
+                    got += n
+                histogram.record(time.monotonic_ns() - LATENCY_PROBE.unpack_from(reply)[2])
+            seq += 1
+            if pacer:   # Waits if we are ahead of --bitrate
+                delay = pacer.consume(probe_len)
+                if delay:
+                    time.sleep(delay)
+    except OSError:
+        print("[ERROR] Lost the connection to the server")
+    sock.close()
+    report('latency', client_addr, time.time() - start_time, seq * probe_len, histogram, lost)
+
+'''
+PRINT REPORT:
+The default report function for a client stream. Prints the summary with create_result.
+kind is either start (the address of the stream when it is connected), summary, server (the UDP server report, for
+create_udp_row), latency (for create_latency_row) or error (the stream could not connect, nothing to print). mode is C for streams that sends and S for
+streams that receives (reverse mode).
+'''
+def print_report(kind, *entry, mode='C'):
+    if kind == 'server':
+        print("[SERVER REPORT]")
+        print_table('U', [create_udp_row(*entry)], 'server')
+    elif kind == 'latency':
+        print_table('L', [create_latency_row(*entry)])
+    elif kind == 'summary':
+        create_result(mode, *entry, False)
+
+'''
+CONTROL CONNECTION:
+The client side of the control connection. open_control connects, sends hello with the test parameters and the
+direction of every stream, and returns the socket and the cookie for the data connections. It raises OSError if the
+server can't be reached or does not accept the test. request_test sends the hello for the next test on a control
+connection that is already open (--repeat). opts are the options of a --target (see target_args), the command
+line if not set. send_omit tells the server when the warm-up (-O) is over. finish_control sends done when every stream is finished and returns the
+results the server measured for every stream (see print_stream_results), or None if they never came. The connection
+is left open for the next test, and closed by the caller.
+'''
+def create_hello(directions, opts=None):
+    opts = opts or args # The options of a --target, or the command line
+    block_len = opts.len or (DEFAULT_PROBE_LEN if opts.latency else 1000)
+    num = file_length() if opts.file else opts.num  # With -F the server can preallocate for the whole file
+    return {'type': 'hello', 'time': int(opts.time), 'num': num, 'len': block_len, 'bitrate': opts.bitrate,
+        'omit': int(opts.omit), 'tcp_info': opts.tcp_info, 'streams': [[stream_id, direction] for stream_id, direction in enumerate(directions)]}
+
+def open_control(server_ip, port, directions, opts=None):
+    sock = socket.create_connection((server_ip, port))
+    try:
+        cookie = request_test(sock, directions, CONTROL_MAGIC, opts)
+    except (OSError, ValueError):
+        sock.close()
+        raise
+    return sock, cookie
+
+def request_test(sock, directions, prefix=b'', opts=None):  # prefix is the magic on a new connection, sent with the hello
+    sock.sendall(prefix + pack_message(create_hello(directions, opts)))
+    reply = recv_message(sock)
+    if not reply or reply.get('type') != 'accept':
+        raise ConnectionError((reply or {}).get('message', 'the server did not accept the test'))
+    return bytes.fromhex(reply['cookie'])
+
+def send_omit(sock):   # Tells the server that the warm-up (-O) is over. If the connection is gone, finish_control finds out
+    try:
+        sock.sendall(pack_message({'type': 'omit'}))
+    except OSError:
+        pass
+
+def finish_control(sock):
+    try:
+        sock.sendall(pack_message({'type': 'done'}))
+        reply = recv_message(sock, MAX_RESULTS)
+    except (OSError, ValueError):
+        reply = None
+    if not reply or reply.get('type') != 'results':
+        return None
+    return reply['streams']
+
+'''
+CLIENT WORKER:
+Runs in its own process and runs the given streams, as threads or as asyncio tasks (TCP only). streams is a list
+of (stream id, direction), where FORWARD streams sends with start_client and REVERSE streams receives with start_reverse_client.
+cookie is the cookie from the control connection (None for UDP) that every data connection sends with its stream id.
+Every stream puts its address and results on the results queue as (stream id, kind, ...) instead of printing them,
+so the main process can print all streams together with a sum, and counts its bytes in its item of counters for the
+interval reporter. The streams connect first, then the worker waits on the barrier shared by all workers, so all
+streams start at once. With --tcp-info, infos has a tcp_info_cell for every stream, and a thread reads TCP_INFO of
+the streams into them (sample_tcp_info).
+A worker only runs streams to one server. With more than one --target, first is where the streams of this target
+start in counters, infos and the results (the stream ids are the ones in the session of the target), and options are
+the options of the target, which are set on args in this process only. settings are the arguments of the main
+process, since a process that is not forked starts without them.
+'''
+def client_worker(streams, server_ip, port, cookie, barrier, results, counters, infos=None, first=0, options=None, settings=None):
+    global args
+    if settings is not None:
+        args = argparse.Namespace(**vars(settings))  # A copy, so the options of the target are not set in the main process
+        quiet_worker()
+    if options:
+        vars(args).update(options)
+    # One report function for each stream, that puts the results on the queue together with the stream id
+    def make_report(stream_id):
+        return lambda *result: results.put((first + stream_id,) + result)
+    reports = [make_report(stream_id) for stream_id, direction in streams]
+    directions = [direction for stream_id, direction in streams]
+    stream_ids = [stream_id for stream_id, direction in streams]
+    cells = [counter_cell(counters, first + stream_id) for stream_id in stream_ids]
+    stop = threading.Event()    # Stops the TCP_INFO thread
+    if infos is not None and not args.udp and not args.latency:
+        tcp_info_cells.update((stream_id, tcp_info_cell(infos, first + stream_id)) for stream_id in stream_ids)
+        threading.Thread(target=sample_tcp_info, args=(stop,), daemon=True).start()
+
+    if args.engine == 'asyncio' and not args.udp and not args.latency:  # All streams in this worker runs as tasks in one event loop
+        asyncio.run(run_async_client(server_ip, port, len(streams), reports, barrier.wait, directions, cookie, stream_ids, cells))
+        stop.set()
+        return
+
+    local_barrier = threading.Barrier(len(streams), action=barrier.wait)  # The last stream to connect waits for the other workers
+    threads = []
+    for stream_id, report, direction, cell in zip(stream_ids, reports, directions, cells):
+        if args.latency:    # Latency streams always runs as threads, over TCP or UDP
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if args.udp else socket.SOCK_STREAM)
+            thread = threading.Thread(target=start_latency_client, args=(sock, server_ip, port, cookie, stream_id, report, local_barrier.wait))
+        elif args.udp:    # UDP streams always runs as threads
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            thread = threading.Thread(target=start_udp_client, args=(sock, server_ip, port, report, local_barrier.wait, cell))
+        elif direction == REVERSE:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
+            thread = threading.Thread(target=start_reverse_client, args=(sock, server_ip, port, cookie, stream_id, report, local_barrier.wait, cell))
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
+            thread = threading.Thread(target=start_client, args=(sock, server_ip, port, cookie, stream_id, report, local_barrier.wait, cell))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    stop.set()
+
+'''
+INTERVAL SERIES:
+Keeps the throughput of every interval (-i) of a stream, so the summary can tell how steady it was, not only the
+total. The last INTERVAL_KEEP values are kept in an array of doubles that is used as a ring buffer, so a run of days
+takes the same memory (28 KB for each stream) as a run of minutes. The number of values, min, max, mean and the
+standard deviation (Welford's method) are kept for every value, and the median, p5 and p95 are read from the values
+that are kept. CoV (coefficient of variation) is the standard deviation divided by the mean: 0 for a flat line.
+collect_results keeps one for every stream and one for the [SUM] row of each direction, records the rate of every
+interval in them, and prints a table for each direction after the summaries. With --intervals-file every interval is
+also written to a file as INTERVAL_RECORD (see write_interval).
+'''
+INTERVAL_KEEP = 3600    # An hour of 1 second intervals
+INTERVAL_RECORD = struct.Struct('<HIdQd')   # Run, series (stream id, or streams + direction for [SUM]), end of the interval in seconds, bytes, bits per second
+interval_file = None    # The file from --intervals-file, opened by client_mode
+
+class IntervalSeries:
+
+    def __init__(self, size=INTERVAL_KEEP):
+        self.values = array.array('d', bytes(8 * size))
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0  # Sum of the squared differences from the mean
+        self.min = None
+        self.max = 0.0
+
+    def record(self, value):
+        self.values[self.count % len(self.values)] = value  # Overwrites the oldest value when it is full
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent, kept):    # From the sorted values that are kept, interpolated like statistics.quantiles(method='inclusive')
+        if not kept:
+            return 0.0
+        position = (len(kept) - 1) * percent / 100
+        low = int(position)
+        if low + 1 >= len(kept):
+            return kept[-1]
+        return kept[low] + (kept[low + 1] - kept[low]) * (position - low)
+
+    def stddev(self):
+        return (self.squares / self.count) ** 0.5 if self.count else 0.0
+
+'''
+Writes one interval to the --intervals-file, if there is one.
+'''
+def write_interval(series, end, data, rate):
+    if interval_file is not None:
+        interval_file.write(INTERVAL_RECORD.pack(current_run or 0, series, end, data, rate))
+
+'''
+CREATE INTERVALS ROW:
+Creates a row for the distribution of the interval throughput of a stream or [SUM] (mode D in print_table): the number
+of intervals, and min, mean, median, p5, p95 and max in bits per second, and CoV. role is sender or receiver.
+'''
+def create_intervals_row(id, role, series):
+    kept = sorted(series.values[:min(series.count, len(series.values))])
+    return {'event': 'intervals', 'id': id, 'role': role, 'samples': series.count, 'min_bits_per_second': series.min,
+        'bits_per_second': series.mean, 'p50_bits_per_second': series.percentile(50, kept),
+        'p5_bits_per_second': series.percentile(5, kept), 'p95_bits_per_second': series.percentile(95, kept),
+        'max_bits_per_second': series.max, 'cov': series.stddev() / series.mean if series.mean else 0.0}
+
+'''
+COLLECT RESULTS:
+Runs in the main process while the workers are sending. Gets the addresses and results from the queue, and is also the
+interval reporter: with -i it reads the counters of every stream (see STREAM COUNTERS) on the monotonic clock at
+exactly start + k * interval, and prints the bytes since the last reading as one table for every interval, with a row
+for each stream and a [SUM] row. A stream is in the intervals until the one where it finished. directions has the
+direction of each stream, and start is (time.time(), time.monotonic()) when the streams started. Streams that send
+and streams that receive (reverse mode) are printed in separate tables, each with its own [SUM] row: all bytes from
+the streams divided by the longest time. With more than one --target, targets has the label (IP:PORT) of the target
+of every stream, and the streams of each target are followed by a row for the target. With a warm-up (omit seconds,
+-O) the counters are read at start + omit, on_omit is called to tell the server, and the intervals and summaries
+start from there, so slow start is not in the results. With --tcp-info, infos has the last TCP_INFO of every stream
+(see sample_tcp_info), and every row gets the congestion window, RTT and pacing rate from when it was read, and the
+retransmits since the last reading. When every stream is done the summaries are printed, followed by how steady the
+rate of the intervals was (see INTERVAL SERIES), the latency results (with all samples in the [SUM] row) and the UDP
+server reports if there are any. Returns the summary row of each direction (the [SUM] row, or the row of the one
+stream) for --repeat, or None if every stream failed.
+'''
+def collect_results(results, directions, workers, counters, start, interval=None, omit=0, on_omit=None, infos=None, targets=None):
+    parallel = len(directions)  # Number of streams
+    addrs = {}  # Stream id -> address, for the streams that are connected
+    summaries = []  # Summary rows from streams that are done
+    server_reports = [] # UDP server reports
+    latencies = []  # Latency results, in latency mode
+    done = set()    # Streams that are done (summary or error)
+    failed = set()  # Streams that reported an error
+    stopped = set() # Streams that are done and have been in their last interval
+    start_wall, start_clock = start
+    last_clock = start_clock    # When the counters were read the last time
+    last_counts = [0] * (parallel * COUNTER_WIDTH)  # The counters from the last time
+    omit_counts = None  # The counters at the end of the warm-up
+    omit_clock = start_clock
+    last_infos = omit_infos = None  # TCP_INFO from the last reading, and the end of the warm-up
+    next_tick = start_clock + (omit or interval) if omit or interval else None  # When the counters should be read the next time
+    series = {} # Stream id, or (direction,) for [SUM] -> the IntervalSeries with the rate of every interval
+
+    '''
+    Creates the rows for the tables from the results, one table for each direction, and adds a [SUM] row if there are
+    more than one stream in the table. Every entry is (stream id, result, stats, tcp), stats is None without --stats
+    and tcp is None without --tcp-info. With targets the streams are in the order of the targets, each target
+    followed by its own sum row. Returns the last row of each table
+    '''
+    def print_results(entries, interval):
+        totals = {}
+        for direction, mode in ((FORWARD, 'C'), (REVERSE, 'S')):
+            group = [(entry, stats, tcp) for stream_id, entry, stats, tcp in entries if directions[stream_id] == direction]
+            if not group:
+                continue
+            rows = []
+            if targets:
+                for label in dict.fromkeys(targets):    # In the order of the targets
+                    members = [(entry, stats, tcp) for stream_id, entry, stats, tcp in sorted(entries, key=lambda entry: entry[0])
+                        if directions[stream_id] == direction and targets[stream_id] == label]
+                    if members:
+                        rows += [create_stream_row(*member, interval) for member in members]
+                        rows.append(create_sum_row(f"[{label}]", members, interval))
+            else:
+                rows = [create_stream_row(*member, interval) for member in group]
+            if len(group) > 1:
+                rows.append(create_sum_row('[SUM]', group, interval))
+            print_table(mode, rows)
+            totals[direction] = rows[-1]
+        return totals
+
+    def create_stream_row(entry, stats, tcp, interval):
+        row = create_row(*entry, interval, stats)
+        add_tcp_info(row, tcp)
+        return row
+
+    '''
+    A sum row for a group of streams: all bytes divided by the longest time. Only the retransmits of TCP_INFO add up
+    '''
+    def create_sum_row(id, group, interval):
+        start_time = min(entry[1] for entry, stats, tcp in group)
+        interval_start = min(entry[2] for entry, stats, tcp in group)
+        elapsed_time = max(entry[3] for entry, stats, tcp in group)
+        total = sum(entry[4] for entry, stats, tcp in group)
+        row = create_row(id, start_time, interval_start, elapsed_time, total, interval, sum_stats(stats for entry, stats, tcp in group))
+        if any(tcp for entry, stats, tcp in group):
+            row['retransmits'] = sum(tcp['retransmits'] for entry, stats, tcp in group if tcp)
+        return row
+
+    '''
+    The TCP_INFO columns of a stream, from a copy of infos, with the retransmits since last. None without --tcp-info
+    '''
+    def read_tcp(stream_id, copy, last):
+        if copy is None:
+            return None
+        base = stream_id * TCP_INFO_WIDTH
+        return create_tcp_info(copy[base:base + TCP_INFO_WIDTH], last[base:base + TCP_INFO_WIDTH] if last else None)
+
+    '''
+    Reads the counters and prints the interval from the last reading until now for every stream that is connected and
+    was running at the start of the interval. With --stats the other counters are also the change since the last reading.
+    '''
+    def sample(now):
+        nonlocal last_clock, last_infos
+        counts = counters[:]    # One copy of all counters, read at the same time
+        copy = infos[:] if infos is not None else None
+        entries = []
+        for stream_id in range(parallel):
+            if stream_id in addrs and stream_id not in stopped:
+                base = stream_id * COUNTER_WIDTH    # Where the counters of the stream are
+                entries.append((stream_id, (addrs[stream_id], start_wall, start_wall + (last_clock - start_clock),
+                    now - last_clock, counts[base] - last_counts[base]),
+                    read_stats(counts, stream_id, last_counts) if args.stats else None, read_tcp(stream_id, copy, last_infos)))
+        if entries:
+            sums = print_results(entries, True)
+            for stream_id, entry, stats, tcp in entries:
+                rate = entry[4] * 8 / entry[3] if entry[3] > 0 else 0.0
+                series.setdefault(stream_id, IntervalSeries()).record(rate)
+                write_interval(stream_id, now - omit_clock, entry[4], rate)
+            for direction, row in sums.items():
+                if row['id'] == '[SUM]':
+                    series.setdefault((direction,), IntervalSeries()).record(row['bits_per_second'])
+                    write_interval(parallel + direction, now - omit_clock, row['bytes'], row['bits_per_second'])
+        stopped.update(done)
+        last_counts[:] = counts
+        last_infos = copy
+        last_clock = now
+
+    '''
+    The end of the warm-up: reads the counters that the intervals and summaries start from, and tells the server.
+    Streams that are done already are not in the intervals
+    '''
+    def warm_up(now):
+        nonlocal last_clock, omit_counts, omit_clock, last_infos, omit_infos
+        omit_counts = counters[:]
+        last_counts[:] = omit_counts
+        last_infos = omit_infos = infos[:] if infos is not None else None
+        last_clock = omit_clock = now
+        stopped.update(done)
+        if on_omit:
+            on_omit()
+
+    while len(done) < parallel:
+        if next_tick is not None:   # Reads the counters when it is time, even if there are results waiting
+            now = time.monotonic()
+            if now >= next_tick:
+                if omit and omit_counts is None:    # The first reading is the end of the warm-up
+                    warm_up(now)
+                else:
+                    sample(now)
+                next_tick = next_tick + interval if interval else None
+                while next_tick is not None and next_tick <= now:  # If we are late, the skipped boundaries are part of this interval
+                    next_tick += interval
+        timeout = next_tick - time.monotonic() if next_tick is not None else 1
+        try:
+            stream_id, kind, *entry = results.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):    # The workers are gone without reporting everything
+                print("[ERROR] A client process stopped without reporting results")
+                break
+            continue
+
+        if kind == 'start':
+            addrs[stream_id] = tuple(entry[0])
+        elif kind == 'server':
+            server_reports.append(entry)
+        else:
+            done.add(stream_id)
+            if kind == 'summary':
+                summaries.append((stream_id, entry))
+            elif kind == 'latency':
+                latencies.append(entry)
+            elif kind == 'error':
+                failed.add(stream_id)
+
+    # The last part of an interval, from the last reading until the end. Like iperf, it is not printed if it is
+    # shorter than a tenth of the interval, since the rate of a few milliseconds says nothing
+    now = time.monotonic()
+    if interval and now - last_clock >= interval / 10 and any(counters[i * COUNTER_WIDTH] != last_counts[i * COUNTER_WIDTH]
+            for i in addrs if i not in stopped):
+        sample(now)
+    totals = {}
+    if summaries:   # With --stats the counters of a stream that is done are the stats for the whole stream
+        counts = counters[:]
+        if omit_counts is not None: # Each stream from the end of the warm-up, with the bytes and counters since then
+            omit_wall = start_wall + (omit_clock - start_clock)
+            summaries = [(stream_id, (addr, omit_wall, omit_wall, max(start_time + elapsed_time - omit_wall, 0),
+                data - omit_counts[stream_id * COUNTER_WIDTH]))
+                for stream_id, (addr, start_time, interval_start, elapsed_time, data) in summaries]
+        copy = infos[:] if infos is not None else None
+        totals = print_results([(stream_id, entry, read_stats(counts, stream_id, omit_counts) if args.stats else None,
+            read_tcp(stream_id, copy, omit_infos)) for stream_id, entry in summaries], False)
+    for direction, role in ((FORWARD, 'sender'), (REVERSE, 'receiver'), (ECHO, 'sender')):  # How steady the rate was
+        rows = [create_intervals_row(f"{addrs[stream_id][0]}:{addrs[stream_id][1]}", role, series[stream_id])
+            for stream_id in sorted(key for key in series if not isinstance(key, tuple) and directions[key] == direction)]
+        if (direction,) in series:
+            rows.append(create_intervals_row('[SUM]', role, series[(direction,)]))
+        if rows:
+            print("[INTERVALS] Throughput of the intervals")
+            print_table('D', rows)
+    if latencies:   # One row for each stream, and a [SUM] row with all samples
+        rows = [create_latency_row(*entry) for entry in latencies]
+        if len(latencies) > 1:
+            histogram = LatencyHistogram()
+            for entry in latencies:
+                histogram.merge(entry[3])
+            rows.append(create_latency_row('[SUM]', max(entry[1] for entry in latencies), sum(entry[2] for entry in latencies),
+                histogram, sum(entry[4] for entry in latencies)))
+        print_table('L', rows)
+    if server_reports:
+        print("[SERVER REPORT]")
+        print_table('U', [create_udp_row(*entry) for entry in server_reports], 'server')
+    if len(failed) == parallel: # Nothing was measured
+        return None
+    return totals
+
+'''
+RUN TEST:
+Runs one test for client_mode: spreads the streams of every target over its worker processes, waits until every stream
+of every target is connected, and collects and prints the results with collect_results. Every target is a dict from
+client_mode with the ip, port, directions, workers and options of its streams, where its streams start (first), and
+the control connection and cookie for this test (None for UDP). All workers share one barrier, so the streams to every
+server start at the same time. With -O every server is told on its control connection when the warm-up is over, and
+the results from each server are printed at the end (finish_control). Returns the throughput that the client and the
+servers measured by direction, in bits per second, summed over the targets, or None if every stream failed.
+'''
+def run_test(targets):
+    directions = [direction for target in targets for direction in target['directions']]
+    parallel = len(directions)
+    barrier = multiprocessing.Barrier(sum(target['workers'] for target in targets) + 1)  # Every worker and this process
+    results = multiprocessing.Queue()
+    counters = create_counters(parallel)    # Bytes sent or received by each stream, for the interval reporter
+    infos = multiprocessing.RawArray('Q', parallel * TCP_INFO_WIDTH) if args.tcp_info else None   # TCP_INFO of each stream
+
+    # For loop that creates one process for each worker, with every n-th stream of its target
+    processes = []
+    for target in targets:
+        count = len(target['directions'])
+        for worker in range(target['workers']):
+            streams = [(stream_id, target['directions'][stream_id]) for stream_id in range(worker, count, target['workers'])]
+            process = multiprocessing.Process(target=client_worker, args=(streams, target['ip'], target['port'], target['cookie'],
+                barrier, results, counters, infos, target['first'], target['options'], args))
+            process.start()
+            processes.append(process)
+
+    totals = {}
+    try:
+        barrier.wait(timeout=60)  # Waits for every stream to connect
+    except threading.BrokenBarrierError:
+        print("[ERROR] The client streams did not connect in time")
+    else:
+        start = (time.time(), time.monotonic()) # The streams start now
+        interval = int(args.interval) if args.interval is not None else None
+        def on_omit():
+            for target in targets:
+                if target['control']:
+                    send_omit(target['control'])
+        # The target of every stream, for the rows of each target. Not needed with one
+        labels = [target['label'] for target in targets for direction in target['directions']] if len(targets) > 1 else None
+        totals = collect_results(results, directions, processes, counters, start, interval or None, int(args.omit), on_omit, infos, labels)
+    for process in processes:
+        process.join()
+
+    measured = {}
+    for target in targets:
+        if target['control']:   # Every stream is done. Gets what the server measured
+            name = f" {target['label']}" if len(targets) > 1 else ""
+            server_results = finish_control(target['control'])
+            if server_results is None:
+                print(f"[ERROR] No results from the server{name}")
+            elif server_results:
+                print(f"[SERVER RESULTS]{name}")
+                for direction, row in print_stream_results(server_results, 'server').items():
+                    measured[direction] = measured.get(direction, 0) + row['bits_per_second']
+    if totals is None:
+        return None
+    return {direction: row['bits_per_second'] for direction, row in totals.items()}, measured
+
+'''
+PRINT REPEAT:
+Prints the mean, standard deviation, min and max throughput of the runs with --repeat, for what the client and the
+server measured in each direction. rates is {(direction, source): [bits per second of every run]}.
+'''
+def print_repeat(rates):
+    names = {(FORWARD, 'local'): ('Sent', 'sender'), (REVERSE, 'local'): ('Received', 'receiver'),
+        (FORWARD, 'server'): ('Received', 'receiver'), (REVERSE, 'server'): ('Sent', 'sender')}
+    rows = [create_repeat_row(*names[key], key[1], rates[key]) for key in names if rates.get(key)]
+    if rows:
+        print(f"[REPEAT] {args.repeat} runs")
+        print_table('R', rows)
+
+'''
+TARGET ARGS and STREAM DIRECTIONS:
+target_args returns the arguments of the command line with the options of a --target on top, as an argparse
+Namespace like args, so the checks and the hello can read them the same way. stream_directions returns the
+direction of each stream for those arguments. --bidir gives the streams 0 to P-1 that sends and P to 2P-1 that receives
+'''
+def target_args(options):
+    return argparse.Namespace(**dict(vars(args), **options))
+
+def stream_directions(opts):
+    parallel = int(opts.parallel)   # Number of streams
+    if opts.latency:    # The server echoes the probes
+        return [ECHO] * parallel
+    if opts.bidir:
+        return [FORWARD] * parallel + [REVERSE] * parallel
+    if opts.reverse:
+        return [REVERSE] * parallel
+    return [FORWARD] * parallel
+
+'''
+CLIENT MODE:
+A function for handling the client mode. If the mode is invoked it gets the address from the user. Checks how many parallel
+streams and worker processes there should be (one worker for each CPU core by default), and spreads the streams over the
+workers. Each worker runs its streams as threads with start_client (or as asyncio tasks with --engine asyncio).
+With -R every stream receives instead, and with --bidir every stream is a pair: one that sends and one that receives.
+All streams wait on a shared barrier so they start sending at the same time, and the results are printed by collect_results.
+For TCP the test is set up on a control connection first (open_control), and the results from the server are printed
+at the end (finish_control). With --repeat the test runs again on the same control connection, and print_repeat
+prints the throughput of all the runs. With --intervals-file the intervals of every run are written to one file.
+With --target the client tests several servers at once instead of -I, each with its own streams and options. Every
+target gets its own control connection and at least one worker, so its options can be set in the worker, and the
+streams of all targets start on the same barrier.
+'''
+def client_mode():
+    global current_run, interval_file
+    # Every server to test, -I and -p if there is no --target
+    targets = args.target or [{'ip': args.serverip, 'port': None, 'options': {}}]
+
+    if args.engine == 'select': # The select engine only exists for the server
+        print("[ERROR] --engine select is only for server mode. Use thread or asyncio for the client")
+        sys.exit(1)
+    if args.file:
+        if args.udp or args.latency:
+            print("[ERROR] -F sends a file over TCP from the client, it can't be used with -u, --latency or -R")
+            sys.exit(1)
+        if not os.path.isfile(args.file) or not os.access(args.file, os.R_OK):
+            print(f"[ERROR] Can't read the file {args.file}")
+            sys.exit(1)
+        if args.batch > 1 or args.zerocopy:
+            print("[WARNING] --batch and --zerocopy are not used with -F, the file is sent with sendfile")
+    if int(args.omit) and (args.num is not None or args.file or args.udp or args.latency):
+        print("[ERROR] -O leaves out the warm-up of a TCP test in time mode, it can't be used with -n, -F, -u or --latency")
+        sys.exit(1)
+    if (args.batch > 1 or args.zerocopy) and args.engine == 'asyncio' and not (args.udp or args.latency or args.file):
+        print("[ERROR] --batch and --zerocopy need sendmsg, which --engine asyncio does not use. Use --engine thread")
+        sys.exit(1)
+    if args.stats and (args.udp or args.latency or args.engine != 'thread'):   # Only the loops of start_client and start_reverse_client are instrumented
+        print("[WARNING] --stats only counts TCP streams in the thread engine. The stats columns will be empty")
+    if args.udp or args.latency:
+        if args.window or args.nodelay or args.mss or args.congestion or args.tcp_info or any(
+                'window' in target['options'] or 'congestion' in target['options'] for target in targets):
+            print("[WARNING] -w, --nodelay, -M, -C and --tcp-info are only used for TCP throughput tests")
+
+    first = 0   # Where the streams of the next target start
+    cpus = os.cpu_count() or 1
+    for target in targets:
+        opts = target_args(target['options'])
+        target['port'] = target['port'] or int(args.port)
+        target['label'] = f"{target['ip']}:{target['port']}"
+        name = f" (target {target['label']})" if args.target else ""
+        if args.udp and (opts.reverse or opts.bidir):
+            print(f"[ERROR] -R and --bidir are only for TCP{name}")
+            sys.exit(1)
+        if args.latency and (opts.reverse or opts.bidir):
+            print(f"[ERROR] -R and --bidir can't be used in latency mode{name}")
+            sys.exit(1)
+        if args.file and opts.reverse:
+            print(f"[ERROR] -F sends a file over TCP from the client, it can't be used with -u, --latency or -R{name}")
+            sys.exit(1)
+        if not args.udp and not args.latency:
+            check_tuning(opts)
+        target['opts'] = opts
+        target['directions'] = stream_directions(opts)
+        target['first'] = first
+        first += len(target['directions'])
+        target['workers'] = min(args.workers or cpus, len(target['directions']))  # There is no use for more workers than streams
+        target['control'] = None
+    if args.intervals_file:
+        if args.interval is None:
+            print("[WARNING] --intervals-file only has something to write with -i")
+        try:
+            interval_file = open(args.intervals_file, 'wb')
+        except OSError as error:
+            print(f"[ERROR] Can't write the file {args.intervals_file}: {error}")
+            sys.exit(1)
+
+    rates = {}  # (direction, source) -> the bits per second of every run, for --repeat
+    for run in range(1, args.repeat + 1):
+        if args.repeat > 1:
+            current_run = run   # Written with every record
+            print(f"[RUN {run}/{args.repeat}]")
+
+        failed = False
+        for target in targets:
+            target['cookie'] = None
+            if args.udp:    # UDP has no control connection, the FIN and report are in the datagrams
+                continue
+            try:
+                if target['control'] is None:
+                    target['control'], target['cookie'] = open_control(target['ip'], target['port'], target['directions'], target['opts'])
+                else:   # The next test on the same control connection
+                    target['cookie'] = request_test(target['control'], target['directions'], opts=target['opts'])
+            except (OSError, ValueError) as error:
+                print(f"[ERROR] Could not connect to {target['label']}, please try again ({error})")
+                failed = True
+                break
+        if failed:
+            if run == 1:
+                for target in targets:
+                    if target['control']:
+                        target['control'].close()
+                sys.exit(1)
+            break   # The runs that are done are still printed
+
+        rates_of_run = run_test(targets)
+        if rates_of_run is None:    # No stream could run, e.g. nothing listens on the UDP port
+            print("[ERROR] None of the streams could run the test")
+            if run == 1:
+                for target in targets:
+                    if target['control']:
+                        target['control'].close()
+                sys.exit(1)
+            break
+        totals, measured = rates_of_run
+        for source, measurements in (('local', totals), ('server', measured)):
+            for direction, bits_per_second in measurements.items():
+                rates.setdefault((direction, source), []).append(bits_per_second)
+
+    for target in targets:
+        if target['control']:
+            target['control'].close()
+    if interval_file is not None:
+        interval_file.close()
+    if args.repeat > 1:
+        current_run = None
+        print_repeat(rates)
+
+'''
+ASYNCIO ENGINE:
+The server and client below does the same as the thread engine, but runs every connection in one asyncio event loop
+(--engine asyncio). Connections are cheap tasks/protocols instead of threads, so thousands of them can run in one process.
+They share the rest of the code with the other engines: the control protocol and sessions, create_payload, the
+TokenBucket, the receive buffer, and print_stream_results for the tables. run_async_server and run_async_client are
+coroutines, so they can also be awaited from another asyncio program.
+'''
+
+'''
+ASYNC SERVER PROTOCOL:
+One protocol object for each connection. It is an asyncio.BufferedProtocol, so the event loop receives
+straight into the buffer from get_buffer (recv_into) and then calls buffer_updated with the number of bytes.
+buffer_updated is called right after the data is received, before any other connection is read, so every connection
+can share one receive buffer, like the select engine. The magic and DATA_HEADER are first received into a buffer of
+their own. A control connection copies its messages out of the shared buffer and handles them in the protocol, so no
+threads are needed. Streams in reverse mode are sent to by a task (send_to_client) that waits when the transport asks
+us to pause writing. The results are given to the session the same way as handle_client.
+The class is made from AsyncServerConnection and asyncio.BufferedProtocol by run_async_server, so asyncio is only
+loaded when the asyncio engine runs (see LAZY IMPORTS).
+'''
+class AsyncServerConnection:
+
+    def __init__(self, buffer, view, server_ip, port):
+        self.buffer = buffer    # Shared receive buffer
+        self.view = view
+        self.server_ip = server_ip
+        self.port = port
+        self.header = bytearray(DATA_HEADER.size)   # The magic and DATA_HEADER, until they are read
+        self.got = 0    # Bytes of the header that are read
+        self.want = len(DATA_MAGIC) # Bytes of the header to read: the magic first
+        self.phase = 'header'   # header, control, recv (the client sends), send (reverse mode) or echo (latency mode)
+        self.control = bytearray()  # Control data that is received, but not a whole message yet
+        self.session = None # The session for the test
+        self.stream = None  # The stream id, for data connections
+        self.start_time = None  # When the stream started
+        self.end_time = None    # When we were done sending in reverse mode
+        self.bytes = 0  # Bytes received, or sent in reverse mode
+        self.counter = None # The counter for the server stats (open_stream), for data connections
+        self.can_write = asyncio.Event()    # Cleared while the transport buffer is full
+        self.can_write.set()
+        self.done = False   # Set when the results are given to the session, or the session is ended
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+
+    def get_buffer(self, sizehint):
+        if self.phase == 'header':  # Only the rest of the header
+            return memoryview(self.header)[self.got:self.want]
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        if self.phase == 'header':  # Part of the header
+            self.got += nbytes
+            if self.got == self.want:
+                self.read_header()
+        elif self.phase == 'recv':
+            if self.start_time is None: # The test starts with the first data
+                self.start_time = time.time()
+            self.bytes += nbytes   # Adds the number of recieved bytes
+            self.counter[0] = self.bytes
+        elif self.phase == 'echo':
+            self.transport.write(self.view[:nbytes])    # The transport copies what it can't send now
+            self.bytes += nbytes
+            self.counter[0] = self.bytes
+        elif self.phase == 'control':
+            self.control += self.view[:nbytes]  # Copied, the buffer is used by the next connection
+            self.read_messages()
+        # The client does not send anything to a stream in reverse mode
+
+    def read_header(self):  # Finds out what the connection is when the magic or the whole DATA_HEADER is read
+        if self.want == len(DATA_MAGIC):
+            magic = bytes(self.header[:self.want])
+            if magic == CONTROL_MAGIC:
+                self.phase = 'control'
+            elif magic == DATA_MAGIC:
+                self.want = DATA_HEADER.size    # Reads the rest of the header
+            else:   # Not a simpleperf client
+                print(f"[ERROR] Unknown connection from <{self.addr[0]}:{self.addr[1]}>. Connection closed")
+                self.transport.close()
+            return
+
+        magic, cookie, stream_id = DATA_HEADER.unpack(self.header)
+        self.session = find_session(cookie, stream_id)
+        if self.session is None:
+            print(f"[ERROR] <{self.addr[0]}:{self.addr[1]}> is not part of a test. Connection closed")
+            self.transport.close()
+            return
+        self.stream = stream_id
+        self.counter = open_stream(self.session, stream_id)
+        print(f"A simpleperf client with <{self.addr[0]}:{self.addr[1]}> is connected with <{self.server_ip}:{self.port}> \n")
+        if self.session['streams'][stream_id] == REVERSE:
+            print(f"[REVERSE] Sending to <{self.addr[0]}:{self.addr[1]}> \n")
+            self.phase = 'send'
+            self.start_time = time.time()
+            asyncio.get_running_loop().create_task(self.send_to_client())
+        elif self.session['streams'][stream_id] == ECHO:    # Sends back what it receives (latency mode)
+            self.transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.phase = 'echo'
+            self.start_time = time.time()
+        else:
+            self.phase = 'recv'
+
+    def read_messages(self):    # Handles every whole control message that is received
+        while len(self.control) >= MESSAGE_LENGTH.size:
+            try:
+                length = message_length(self.control)
+            except ValueError:  # Too long: closed before the rest is buffered
+                print(f"[ERROR] Control message from <{self.addr[0]}:{self.addr[1]}> is too long. Connection closed")
+                self.control.clear()
+                self.transport.close()
+                return
+            end = MESSAGE_LENGTH.size + length
+            if len(self.control) < end: # Waits for the rest of the message
+                return
+            try:
+                message = json.loads(self.control[MESSAGE_LENGTH.size:end])
+            except ValueError:
+                message = None
+            del self.control[:end]
+            self.handle_message(message)
+
+    def handle_message(self, message):  # Does the same as handle_control in the thread engine
+        kind = message.get('type') if isinstance(message, dict) else None
+        if kind == 'hello' and self.session is None:
+            try:
+                self.session = create_session(message, self.addr, asyncio.Event())
+            except (KeyError, TypeError, ValueError, AttributeError):   # Not a valid hello (check_hello)
+                kind = None
+            else:
+                self.transport.write(pack_message({'type': 'accept', 'cookie': self.session['cookie'].hex()}))
+                return
+        elif kind == 'omit' and self.session is not None:  # The warm-up is over
+            omit_session(self.session)
+            return
+        elif kind == 'done' and self.session is not None:
+            asyncio.get_running_loop().create_task(self.send_results())
+            return
+        print(f"[ERROR] Unexpected control message from <{self.addr[0]}:{self.addr[1]}>. Connection closed")
+        self.transport.close()
+
+    async def send_results(self):   # Waits until every stream is done (at most 10 seconds) and sends the results
+        try:
+            await asyncio.wait_for(self.session['complete'].wait(), 10)
+        except asyncio.TimeoutError:    # The last streams may still be closing
+            pass
+        if not self.transport.is_closing():
+            results = list(self.session['results'].values())
+            self.transport.write(pack_message({'type': 'results', 'streams': results}))
+        self.finish()
+        self.session = None # Ready for the next hello (--repeat), until the client closes the connection
+        self.done = False
+
+    async def send_to_client(self):  # Sends to a stream in reverse mode, like send_to_client in the thread engine
+        params = self.session['params']
+        payload = create_payload(params['len'])
+        pacer = TokenBucket(params['bitrate'], params['len']) if params['bitrate'] else None
+        end_time = self.start_time + params['time'] + params['omit']   # The warm-up is sent too
+        yielded = 0 # self.bytes the last time the task gave the other connections a turn
+        while not self.transport.is_closing():
+            if params['num'] is not None:    # NUMBER OF BYTES: a full block, or what is left
+                left = params['num'] - self.bytes
+                if left <= 0:
+                    break
+                chunk = payload if left >= len(payload) else payload[:left]
+            else:   # TIME MODE: full blocks until the end time
+                if time.time() >= end_time:
+                    break
+                chunk = payload
+            await self.can_write.wait()  # Waits while the transport has too much data waiting
+            self.transport.write(chunk)
+            self.bytes += len(chunk)
+            self.counter[0] = self.bytes
+            delay = pacer.consume(len(chunk)) if pacer else 0
+            if delay or self.bytes - yielded >= ASYNC_YIELD_BYTES:  # Lets the other connections run, and waits if we are ahead of the bitrate
+                yielded = self.bytes
+                await asyncio.sleep(delay)
+        self.end_time = time.time()
+        if not self.transport.is_closing():
+            self.transport.write_eof()  # Tells the client there is no more data
+
+    def pause_writing(self):
+        self.can_write.clear()
+
+    def resume_writing(self):
+        self.can_write.set()
+
+    def eof_received(self):
+        if self.phase != 'control' or self.session is None: # The stream is done, or the client has no more tests
+            self.finish()
+            return False    # Lets the transport close itself
+        return True # A control connection in a test waits for send_results
+
+    def connection_lost(self, exc):
+        if exc is not None and not self.done:
+            print("[ERROR] Could not send or receive data. Connection closed")
+        self.can_write.set()    # Lets a waiting send task see that the connection is closed
+        self.finish()
+
+    def finish(self):   # Gives the results to the session, or ends the session for a control connection, once
+        if self.done or self.session is None:
+            return
+        self.done = True
+        if self.phase == 'control':
+            end_session(self.session)
+            return
+        end_time = self.end_time or time.time()  # Sets end time
+        sock = self.transport.get_extra_info('socket')  # None when the transport is closed
+        tcp_info = read_tcp_info(sock) if sock is not None and wants_tcp_info(self.session) else None
+        finish_stream(self.session, self.stream, self.addr, self.start_time or end_time, end_time, self.bytes, tcp_info=tcp_info)
+
+'''
+RUN ASYNC SERVER:
+Runs the server on the socket with the asyncio event loop. Every connection gets an AsyncServerProtocol. Stops if no
+new connection has come for 15 minutes, like start_server.
+'''
+async def run_async_server(sock, server_ip, port):
+    loop = asyncio.get_running_loop()
+    buffer, view = create_recv_buffer(args.len or DEFAULT_RECV_LEN)   # One buffer for all connections
+    last_connect = [time.time()]    # When the last client connected. A list so the protocol factory can change it
+
+    protocol = type('AsyncServerProtocol', (AsyncServerConnection, asyncio.BufferedProtocol), {})
+
+    def new_protocol(): # Called by the event loop for every new connection
+        last_connect[0] = time.time()
+        return protocol(buffer, view, server_ip, port)
+
+    if worker_inboxes is not None:  # --workers: the messages from the other workers are handled on this loop
+        start_inbox(loop.call_soon_threadsafe)
+    server = await loop.create_server(new_protocol, sock=sock)
+    print(f"{line} \t A simpleperf server is listening on port {port} {line}")
+
+    async with server:
+        while time.time() - last_connect[0] < 900:  # Runs as long as there has been a new client the last 15 minutes
+            await asyncio.sleep(900 - (time.time() - last_connect[0]))
+        print("[CONNECTION TIMEOUT] Timeout due to inactivity. Closing connections...")
+
+'''
+ASYNC CONTROL CONNECTION:
+The asyncio versions of open_control and finish_control, on a non-blocking socket.
+'''
+async def async_recv_exact(loop, sock, n):  # Like recv_exact
+    data = bytearray(n)
+    view = memoryview(data)
+    got = 0
+    while got < n:
+        count = await loop.sock_recv_into(sock, view[got:])
+        if not count:
+            return None
+        got += count
+    return bytes(data)
+
+async def async_recv_message(loop, sock, limit=MAX_MESSAGE):   # Like recv_message
+    header = await async_recv_exact(loop, sock, MESSAGE_LENGTH.size)
+    if header is None:
+        return None
+    data = await async_recv_exact(loop, sock, message_length(header, limit))
+    if data is None:
+        return None
+    return json.loads(data)
+
+async def async_open_control(server_ip, port, directions):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, (server_ip, port))
+        await loop.sock_sendall(sock, CONTROL_MAGIC + pack_message(create_hello(directions)))
+        reply = await async_recv_message(loop, sock)
+    except (OSError, ValueError):
+        sock.close()
+        raise
+    if not reply or reply.get('type') != 'accept':
+        sock.close()
+        raise ConnectionError((reply or {}).get('message', 'the server did not accept the test'))
+    return sock, bytes.fromhex(reply['cookie'])
+
+async def async_finish_control(sock):
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.sock_sendall(sock, pack_message({'type': 'done'}))
+        reply = await async_recv_message(loop, sock, MAX_RESULTS)
+    except (OSError, ValueError):
+        reply = None
+    sock.close()
+    if not reply or reply.get('type') != 'results':
+        return None
+    return reply['streams']
+
+'''
+ASYNC CLIENT:
+One stream as an asyncio task. Does the same as start_client: connects, sends the DATA_HEADER and blocks
+of --len bytes until the time is up or --num bytes are sent, counts the bytes in counter, gives the address and summary
+to report, and closes the sending side of the connection. Data is sent with loop.sock_sendall on a non-blocking socket, which only waits for the
+event loop when the kernel send buffer is full. The task gives the other tasks a turn after every ASYNC_YIELD_BYTES
+it has sent, or sleeps if it is ahead of --bitrate: a turn after every block would cost an event loop round for each
+block. ready is awaited after connecting. --batch and --zerocopy are not used (the client refuses them).
+With -F the file is sent in chunks with loop.sock_sendfile instead, which uses os.sendfile like send_file.
+'''
+ASYNC_YIELD_BYTES = 1024 * 1024  # Bytes an asyncio stream sends before it lets the other streams run
+
+async def async_client(server_ip, port, cookie, stream_id, report=None, ready=None, counter=None):
+    report = report or print_report
+    counter = counter if counter is not None else counter_cell()
+    loop = asyncio.get_running_loop()
+    server_addr = (server_ip, port)
+    block_len = args.len or (FILE_CHUNK if args.file else 1000)   # Size of each block from user input (default 1000 bytes)
+    payload = None if args.file else create_payload(block_len)    # The one buffer that are sent for the whole test
+    pacer = TokenBucket(args.bitrate, block_len) if args.bitrate else None  # Only paced with --bitrate
+
+    print(f"{line} A simpleperf client connecting to server {server_ip}, port {port} {line}")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
+    sock.setblocking(False)
+    try:    # Tries to connect to the server address
+        tune_socket(sock)
+        await loop.sock_connect(sock, server_addr)
+        await loop.sock_sendall(sock, DATA_HEADER.pack(DATA_MAGIC, cookie, stream_id))  # Tells the server which test and stream this is
+    except OSError: # Prints error if it can't connect to server
+        print("[ERROR] Could not connect, please try again")
+        sock.close()
+        if ready:   # The other streams are still waiting for this one
+            await ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+
+    client_addr = sock.getsockname()[:2]    # Declares the client address
+    print(f"Client connected with {server_ip} port {port} \n")
+    report('start', client_addr)    # The reporter needs the address for the interval rows
+    watch_socket(stream_id, sock)
+    if ready:   # Waits until every parallel stream is connected
+        await ready()
+    if pacer:
+        pacer.start()
+
+    file = open(args.file, 'rb') if args.file else None
+    start_time = time.time()    # Sets start time
+    bytes = file_length() if file else args.num # Bytes are the number set in CLI (or the file), None in time mode
+    end_time = start_time + send_time()  # End time in time mode, with the warm-up
+    total_bytes = 0
+    yielded = 0 # total_bytes the last time the task gave the other tasks a turn
+
+    try:
+        while True:
+            if bytes is not None:   # NUMBER OF BYTES: sends a full block, or what is left
+                if total_bytes >= bytes:
+                    break
+                size = min(block_len, bytes - total_bytes)
+            else:   # TIME MODE: sends full blocks until the end time
+                if time.time() >= end_time:
+                    break
+                size = block_len
+            if file is not None:    # -F: the next chunk of the file
+                sent = await loop.sock_sendfile(sock, file, total_bytes, size)
+                if not sent:    # The end of the file
+                    break
+            else:
+                await loop.sock_sendall(sock, payload if size == block_len else payload[:size])
+                sent = size
+            total_bytes += sent
+            counter[0] = total_bytes
+            delay = pacer.consume(sent) if pacer else 0
+            if delay or total_bytes - yielded >= ASYNC_YIELD_BYTES: # Lets the other connections send, and waits if we are ahead of --bitrate
+                yielded = total_bytes
+                await asyncio.sleep(delay)
+
+        if bytes is not None:   # In num mode the test ends when everything is sent
+            end_time = time.time()
+
+        sock.shutdown(socket.SHUT_WR)   # Tells the server that there is no more data
+        while await loop.sock_recv(sock, 1024): # Waits until the server has received everything and closes
+            pass
+        unwatch_socket(stream_id)
+    except OSError:
+        print("[ERROR] Could not send data to server. Connection closed")
+        report('error', None, 0, 0, 0, 0)
+    else:
+        report('summary', client_addr, start_time, start_time, end_time - start_time, total_bytes)  # Summary
+    if file is not None:
+        file.close()
+    sock.close()    # Closes the connection when done
+
+'''
+ASYNC REVERSE CLIENT:
+The asyncio version of start_reverse_client. Connects, waits for the other streams with ready, sends the DATA_HEADER
+and receives with loop.sock_recv_into until the server closes its side of the connection.
+'''
+async def async_reverse_client(server_ip, port, cookie, stream_id, report=None, ready=None, counter=None):
+    report = report or (lambda kind, *entry: print_report(kind, *entry, mode='S'))
+    counter = counter if counter is not None else counter_cell()
+    loop = asyncio.get_running_loop()
+    buffer, view = create_recv_buffer(DEFAULT_RECV_LEN) # The buffer that are used for the whole connection
+
+    print(f"{line} A simpleperf client connecting to server {server_ip}, port {port} (reverse) {line}")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Defines socket with family and type
+    sock.setblocking(False)
+    try:    # Tries to connect to the server address
+        tune_socket(sock)
+        await loop.sock_connect(sock, (server_ip, port))
+    except OSError: # Prints error if it can't connect to server
+        print("[ERROR] Could not connect, please try again")
+        sock.close()
+        if ready:   # The other streams are still waiting for this one
+            await ready()
+        report('error', None, 0, 0, 0, 0)
+        return
+
+    client_addr = sock.getsockname()[:2]    # Declares the client address
+    print(f"Client connected with {server_ip} port {port}, receiving \n")
+    report('start', client_addr)
+    watch_socket(stream_id, sock)
+    if ready:   # Waits until every parallel stream is connected
+        await ready()
+
+    try:
+        await loop.sock_sendall(sock, DATA_HEADER.pack(DATA_MAGIC, cookie, stream_id))  # The server starts sending when it gets this
+        start_time = time.time()    # Sets start time
+        total_bytes = 0
+        while True:
+            n = await loop.sock_recv_into(sock, view)   # Number of bytes recieved
+            if not n:   # The server is done sending
+                break
+            total_bytes += n
+            counter[0] = total_bytes
+        unwatch_socket(stream_id)
+    except OSError:
+        print("[ERROR] Could not receive data from server. Connection closed")
+        report('error', None, 0, 0, 0, 0)
+    else:
+        report('summary', client_addr, start_time, start_time, time.time() - start_time, total_bytes)
+    sock.close()    # Closes the connection when done
+
+'''
+RUN ASYNC CLIENT:
+Runs the given number of parallel connections in the event loop and waits until all of them are done.
+directions is a list with FORWARD (async_client) or REVERSE (async_reverse_client) for each connection, all FORWARD if
+not set. Every connection starts when all of them are connected. reports is a list with one report function for each
+connection (print_report if not set), and ready is called once when all are connected, before they start.
+cookie and stream_ids are from a control connection opened by the caller (client_mode). If cookie is not set, the
+control connection is opened here, and the results from the server are printed at the end. counters is a list with
+the counter for each connection (see STREAM COUNTERS), for an interval reporter.
+'''
+async def run_async_client(server_ip, port, parallel, reports=None, ready=None, directions=None, cookie=None, stream_ids=None, counters=None):
+    connected = [0] # Number of connections that are ready. A list so wait_for_all can change it
+    go = asyncio.Event()    # Set when every connection can start
+
+    async def wait_for_all():
+        connected[0] += 1
+        if connected[0] == parallel:    # The last connection is ready
+            if ready:
+                ready()
+            go.set()
+        await go.wait()
+
+    reports = reports or [None] * parallel
+    directions = directions or [FORWARD] * parallel
+    counters = counters or [None] * parallel
+    control = None
+    if cookie is None:  # Sets up the test on a control connection of our own
+        control, cookie = await async_open_control(server_ip, port, directions)
+        stream_ids = range(parallel)
+    streams = []
+    for i, stream_id in enumerate(stream_ids):
+        if directions[i] == REVERSE:
+            streams.append(async_reverse_client(server_ip, port, cookie, stream_id, reports[i], wait_for_all, counters[i]))
+        else:
+            streams.append(async_client(server_ip, port, cookie, stream_id, reports[i], wait_for_all, counters[i]))
+    await asyncio.gather(*streams)
+
+    if control: # Every stream is done. Gets what the server measured
+        server_results = await async_finish_control(control)
+        if server_results:
+            print("[SERVER RESULTS]")
+            print_stream_results(server_results, 'server')
+
+'''
+LIBRARY API:
+simpleperf can be imported and used from another Python program, without a new interpreter for every test:
+
+    import simpleperf
+    results = simpleperf.run_client(serverip='10.0.5.2', time=10, parallel=4)
+    print(results.total()['bits_per_second'])
+
+run_client and run_server take the long names of the flags as keyword arguments (parallel=4 for -P 4, tcp_info=True
+for --tcp-info, target=['10.0.5.2,P=2', '10.0.5.3'] for --target), which are checked like on the command line
+(create_args). They return a Results with every row of every table. With quiet (the default for run_client) nothing
+is printed. The options are set on the module while the test runs, so one process runs one test at a time; a server
+that runs while the client tests should run in a process of its own, e.g. multiprocessing.Process(target=run_server).
+An error that would stop the program raises RuntimeError with the message instead.
+'''
+
+'''
+RESULTS:
+What run_client and run_server return. records has every row as a dict, the same as the --json records (see RECORD
+OUTPUT), in the order they were made. find picks out the records with the given event (interval, summary, intervals,
+repeat...), role (sender or receiver), source (local or server) and id. total returns the summary of a role and
+source: the [SUM] row, or the one stream, of the last run. Without a role it is the sender, or the receiver if the
+client only received (reverse mode). None if there is none.
+'''
+class Results:
+
+    def __init__(self, records=None):
+        self.records = records if records is not None else []
+
+    def find(self, event=None, role=None, source=None, id=None):
+        return [record for record in self.records if (event is None or record['event'] == event)
+            and (role is None or record['role'] == role) and (source is None or record['source'] == source)
+            and (id is None or record['id'] == id)]
+
+    def total(self, role=None, source='local'):
+        for name in [role] if role else ['sender', 'receiver']:
+            summaries = self.find('summary', name, source)
+            sums = [record for record in summaries if record['id'] == '[SUM]']
+            if summaries:
+                return (sums or summaries)[-1]
+        return None
+
+    def __repr__(self):
+        return f"Results({len(self.records)} records)"
+
+'''
+CREATE ARGS:
+Makes the arguments for a mode ('server' or 'client') from keyword options, by turning them into a command line and
+parsing it with build_parser, so they are checked the same way. True is a flag, False and None are left out, and a list
+is the flag once for every item. Raises ValueError if an option is unknown or not valid.
+'''
+def create_args(mode, options):
+    argv = ['--server' if mode == 'server' else '--client']
+    for name, value in options.items():
+        flag = '--' + name.replace('_', '-')
+        if value is None or value is False:
+            continue
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                argv += [flag, str(item)]
+        else:
+            argv += [flag, str(value)]
+    errors = io.StringIO()  # The checks and argparse print the error before argparse exits
+    try:
+        with contextlib.redirect_stdout(errors), contextlib.redirect_stderr(errors):
+            return build_parser().parse_args(argv)
+    except SystemExit:
+        message = errors.getvalue().strip().split('\n')[-1] if errors.getvalue().strip() else ' '.join(argv)
+        raise ValueError(f"Not valid simpleperf options: {message}") from None
+
+'''
+Runs a mode with the arguments, and collects the records in a Results. With quiet the messages and tables go to a
+buffer instead of stdout, and the last [ERROR] in it is the message of the RuntimeError if the mode exits with an error.
+The module state (args, result_records, csv_writer) is put back afterwards.
+'''
+def run_mode(mode, settings, quiet):
+    global args, result_records, csv_writer
+    saved = args, result_records, csv_writer
+    settings.quiet = quiet  # For the worker processes, which don't get the redirected stdout if they are not forked
+    args, result_records, csv_writer = settings, [], None    # The CSV header is written again, to this output
+    results = Results(result_records)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+            mode()
+    except SystemExit as error:
+        if error.code not in (None, 0):
+            errors = [message for message in output.getvalue().split('\n') if message.startswith('[')
+                and 'ERROR' in message.split(']')[0]]
+            raise RuntimeError(errors[-1] if errors else "simpleperf stopped with an error, see the messages above") from None
+    finally:
+        args, result_records, csv_writer = saved
+    return results
+
+'''
+Sends the output of a worker process to os.devnull if run_client or run_server was called with quiet.
+'''
+def quiet_worker():
+    if getattr(args, 'quiet', False):   # Not set from the command line
+        sys.stdout = open(os.devnull, 'w')
+
+'''
+RUN CLIENT and RUN SERVER:
+run_client runs one client test (all of --repeat) against serverip and returns the Results, with what the client and
+the server measured. run_server runs a server on bind and port until it stops (15 minutes without a client, or ctrl+c),
+and returns the Results of every test it has run. Both take the other options as keyword arguments (see LIBRARY API).
+'''
+def run_client(serverip='127.0.0.1', port=8088, quiet=True, **options):
+    return run_mode(client_mode, create_args('client', dict(options, serverip=serverip, port=port)), quiet)
+
+def run_server(bind='127.0.0.1', port=8088, quiet=False, **options):
+    return run_mode(server_mode, create_args('server', dict(options, bind=bind, port=port)), quiet)
+
+'''
+MAIN:
+The command line. Parses argv (sys.argv without a list) and checks if the user has chosen server mode or client mode.
+Then calls upon their function respectively. Gives error message if both or none of the mode flags are chosen.
+'''
+def main(argv=None):
+    global args, record_file
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.json or args.csv:   # Only the records on stdout (record_file). The other messages goes to stderr
+        record_file = sys.stdout
+        sys.stdout = sys.stderr
+    if ((not args.server and not args.client) or (args.server and args.client)):
+        parser.print_help() # If not server/client or both are invoked it prints the help screen, then an error message, then exits
+        print(line)
+        print("[ERROR] you must run either in server or client mode \n \nSEE THE HELP MENU ABOVE FOR FLAGS AND ARGUMENTS \n")
+        sys.exit()
+    elif args.server:   # If server flag is chosen
+        print("[SERVER MODE] Starting...")
+        server_mode()   # Starts the server mode
+    elif args.client:   # If client flag is chosen
+        print("[CLIENT MODE] Starting...")
+        client_mode()   # Starts the client mode
 
 '''
 INVOKING CLIENT OR SERVER MODE:
-Checks if the user has chosen server mode or client mode. Then calls upon their function respectively.
-Gives error message if both or none of the mode flags are chosen.
-'''
-if ((not args.server and not args.client) or (args.server and args.client)):
-    parser.print_help() # If not server/client or both are invoked it prints the help screen, then an error message, then exits
-    print(line)
-    print("[ERROR] you must run either in server or client mode \n \nSEE THE HELP MENU ABOVE FOR FLAGS AND ARGUMENTS \n")
-    sys.exit()
-elif args.server:   # If server flag is chosen
-    print("[SERVER MODE] Starting...")
-    server_mode()   # Starts the server mode
-elif args.client:   # If client flag is chosen
-    print("[CLIENT MODE] Starting...")
-    client_mode()   # Starts the client mode
-    
\ No newline at end of file
+The code only runs when simpleperf is started as a program, not when the module is imported (by a worker process, or
+as a library).
+'''
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,638 @@
+'''
+simulate-topology is a fluid simulator of the network in topology.json (the network portfolio-topology.py
+starts), so the test cases can be predicted without Mininet and root, in a fraction of a second each.
+The topology is a spec that topology_spec reads, and the static routes are computed from it like portfolio-topology.py
+does. A Mininet script with the network hard-coded (like old-portfolio-topology.py) can also be read, without running
+it: the hosts, switches, routers and links in build() and the routes that are added with "ip route add" are read with
+the ast module. Flows are routed hop by hop with the same routes as the real network.
+Every shaped link is modelled like TCLink does it: netem holds the data for the delay, htb sends it at the bandwidth,
+and the netem queue drops packets when max_queue_size packets are waiting (drop-tail). TCP flows (CUBIC or Reno,
+window based) and constant-rate UDP flows (iperf -u) are simulated as bytes per step, a few steps for every RTT, and
+ping from the queues they leave. The results are printed for every test in measurements/test-case-1..5, next to what
+was measured if the measurements are there.
+With --set the link parameters can be swept: every combination of the values is simulated.
+'''
+
+# Different module imports used in this program
+import argparse # Command-line interface
+import ast  # Reads a Mininet script without running it
+import collections  # deque for the ACKs and drops on the way
+import importlib.util   # Loads analyze-measurements.py for the measured values
+import ipaddress    # Interfaces, networks and routes
+import itertools    # The combinations in a sweep
+import json # --json output
+import math # Cube root for CUBIC
+import multiprocessing  # Simulates the combinations of a sweep on every CPU core
+import os   # Paths
+import re   # Routes and delays
+import sys  # Functions that interact with the interpreter. Like sys.exit()
+
+import topology_spec    # Reads the spec and computes the routes
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUEUE = 1000    # Packets in a queue without max_queue_size, the default txqueuelen of Linux
+MSS = 1448  # TCP payload in one segment
+DATA_SIZE = 1514    # A full TCP segment on the wire: MSS, TCP/IP headers with timestamps and Ethernet
+ACK_SIZE = 66   # A TCP ACK on the wire
+UDP_PAYLOAD = 1470  # iperf -u datagram
+UDP_SIZE = 1512 # The datagram on the wire, with UDP, IP and Ethernet headers
+PING_SIZE = 98  # 56 bytes of ping data, with ICMP, IP and Ethernet headers
+INITIAL_WINDOW = 10 # TCP initial congestion window in segments
+MAX_WINDOW = 4096   # The receive window in segments, TCP can't have more in flight
+CUBIC_C = 0.4   # CUBIC constants (RFC 8312)
+CUBIC_BETA = 0.7
+
+'''
+READ SCRIPT:
+Reads the network from a Mininet script with ast, as a topology spec. The build() method of the Topo class is walked
+statement by statement: variables that are set to self.addHost/addSwitch/addNode are remembered, and for loops over a
+tuple of them are unrolled, so self.addLink(h, s1) in a loop works. addNode with a cls that has Router in the name is
+a router. Static routes are the net["node"].cmd("ip route add NET via GW ...") calls anywhere in the script.
+Returns the spec and the routes (node -> list of (network, gateway)).
+'''
+DELAY = re.compile(r'^([\d.]+)\s*(us|ms|s)?$')
+ROUTE = re.compile(r'ip route add (\S+) via (\S+)')
+
+def parse_delay(delay):
+    if delay is None:
+        return 0.0
+    match = DELAY.match(str(delay).strip())
+    if not match:
+        raise ValueError(f"can't read the delay {delay!r}")
+    return float(match.group(1)) * {'us': 1e-6, 'ms': 1e-3, 's': 1, None: 1e-6}[match.group(2)]  # netem without a unit is us
+
+def read_script(path):
+    with open(path) as script:
+        tree = ast.parse(script.read(), path)
+    build = next((node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef) and node.name == 'build'), None)
+    if build is None:
+        raise ValueError(f"no build() method in {path}")
+    spec = {'hosts': {}, 'switches': [], 'routers': {}, 'links': []}
+    names = {}  # Variable -> node name
+
+    def value(node):    # A literal, or the node a variable is bound to
+        if isinstance(node, ast.Name):
+            return names.get(node.id)
+        try:
+            return ast.literal_eval(node)
+        except ValueError:  # Like cls=LinuxRouter
+            return None
+
+    def add(call):  # Handles one self.addX() call. Returns the name of the node it adds
+        func = call.func
+        if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == 'self'):
+            return None
+        positional = [value(arg) for arg in call.args]
+        keywords = {keyword.arg: value(keyword.value) for keyword in call.keywords}
+        if func.attr == 'addLink':
+            params = [keywords.get('params1') or {}, keywords.get('params2') or {}]
+            link = {'ends': [positional[0], positional[1]], 'ips': [params[0].get('ip'), params[1].get('ip')]}
+            link.update((key, keywords[key]) for key in topology_spec.LINK_OPTIONS if keywords.get(key) is not None)
+            spec['links'].append(link)
+            return None
+        if func.attr == 'addSwitch':
+            spec['switches'].append(positional[0])
+            return positional[0]
+        if func.attr not in ('addHost', 'addNode'):
+            return None
+        cls = next((keyword.value for keyword in call.keywords if keyword.arg == 'cls'), None)
+        kind = 'routers' if func.attr == 'addNode' and isinstance(cls, ast.Name) and 'Router' in cls.id else 'hosts'
+        gateway = keywords.get('defaultRoute')
+        spec[kind][positional[0]] = {'ip': keywords.get('ip'), 'gateway': gateway.split()[-1] if gateway else None}
+        return positional[0]
+
+    def run(statements):
+        for statement in statements:
+            if isinstance(statement, ast.For) and isinstance(statement.target, ast.Name) and isinstance(statement.iter, (ast.Tuple, ast.List)):
+                for item in statement.iter.elts:
+                    names[statement.target.id] = value(item)
+                    run(statement.body)
+            elif isinstance(statement, (ast.Assign, ast.Expr)) and isinstance(statement.value, ast.Call):
+                name = add(statement.value)
+                if name and isinstance(statement, ast.Assign) and isinstance(statement.targets[0], ast.Name):
+                    names[statement.targets[0].id] = name
+    run(build.body)
+    topology_spec.check_spec(spec)
+
+    routes = {}
+    for call in ast.walk(tree):
+        if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and call.func.attr == 'cmd'
+                and isinstance(call.func.value, ast.Subscript) and call.args and isinstance(call.args[0], ast.Constant)):
+            match = ROUTE.search(str(call.args[0].value))
+            node = value(call.func.value.slice)
+            if match and node in spec['routers']:
+                routes.setdefault(node, []).append((ipaddress.ip_network(match.group(1), strict=False), ipaddress.ip_address(match.group(2))))
+    return spec, routes
+
+'''
+READ TOPOLOGY:
+Reads a topology spec (JSON or YAML), or a Mininet script (.py), and returns what the simulator needs: nodes (name ->
+kind, gateway and interfaces), links (ends, bw in Mbit/s, delay in seconds, queue in packets) and routes (node -> list
+of (network, gateway)). The routes of a spec are computed, those of a script are the ones it adds.
+'''
+def read_topology(path):
+    if path.endswith('.py'):
+        spec, routes = read_script(path)
+    else:
+        spec = topology_spec.load_spec(path)
+        routes = {name: [(network, gateway) for network, gateway, dev in table]
+            for name, table in topology_spec.compute_routes(spec).items()}
+    gateways = topology_spec.gateways(spec)
+    interfaces = topology_spec.interfaces(spec)
+    nodes = {}
+    for kind, names in (('host', spec['hosts']), ('switch', spec['switches']), ('router', spec['routers'])):
+        for name in names:
+            nodes[name] = {'kind': kind, 'interfaces': interfaces[name],
+                'gateway': ipaddress.ip_address(gateways[name]) if name in gateways else None}
+    links = [{'ends': tuple(link['ends']), 'bw': link.get('bw'), 'delay': parse_delay(link.get('delay')),
+        'queue': link.get('max_queue_size')} for link in spec['links']]
+    return {'nodes': nodes, 'links': links, 'routes': routes}
+
+'''
+Returns the name of a link, the two ends sorted with a dash, e.g. r1-r2.
+'''
+def link_name(link):
+    return '-'.join(sorted(link['ends']))
+
+'''
+ROUTING:
+Finds the path of a packet from a node to an ip address, hop by hop like the kernel does it: a network the node is
+connected to is reached directly, else the longest static route is used, else the default route. A packet to a
+neighbour goes over the link between them, or over the two links to and from the switch between them. Returns the
+path as a list of directed hops (link index, direction: 0 from the first end of the link, 1 from the second) and the
+ip of the interface the packet left the source from. Returns None if there is no route.
+'''
+def segment(topology, name, interface):  # The interfaces on the other side of an interface: [(node, interface, hops)]
+    link = topology['links'][interface['link']]
+    other = link['ends'][1 - interface['side']]
+    first = (interface['link'], interface['side'])
+    if topology['nodes'][other]['kind'] != 'switch':
+        far = next(entry for entry in topology['nodes'][other]['interfaces'] if entry['link'] == interface['link'])
+        return [(other, far, [first])]
+    neighbours = []
+    for entry in topology['nodes'][other]['interfaces']:   # Everything on the switch
+        if entry['link'] == interface['link']:
+            continue
+        node = topology['links'][entry['link']]['ends'][1 - entry['side']]
+        far = next(item for item in topology['nodes'][node]['interfaces'] if item['link'] == entry['link'])
+        neighbours.append((node, far, [first, (entry['link'], entry['side'])]))
+    return neighbours
+
+def find_path(topology, source, destination):
+    hops = []
+    name = source
+    source_ip = None
+    for i in range(64):
+        node = topology['nodes'][name]
+        if any(interface['ip'] and interface['ip'].ip == destination for interface in node['interfaces']):
+            return hops, source_ip
+        connected = [interface for interface in node['interfaces'] if interface['ip'] and destination in interface['ip'].network]
+        if connected:
+            next_ip = destination
+        else:
+            routes = [route for route in topology['routes'].get(name, []) if destination in route[0]]
+            if routes:
+                next_ip = max(routes, key=lambda route: route[0].prefixlen)[1]
+            elif node['gateway'] is not None:
+                next_ip = node['gateway']
+            else:
+                return None
+        out = next((interface for interface in node['interfaces'] if interface['ip'] and next_ip in interface['ip'].network), None)
+        if out is None:
+            return None
+        neighbour = next(((other, far, path) for other, far, path in segment(topology, name, out) if far['ip'] and far['ip'].ip == next_ip), None)
+        if neighbour is None:
+            return None
+        if source_ip is None:
+            source_ip = out['ip'].ip
+        hops += neighbour[2]
+        name = neighbour[0]
+    return None
+
+'''
+Finds the path from a node to another node and back. The ip of the destination is the one of its interfaces with the
+shortest path from the source (a router has one for each link). Returns (path, return path), or None.
+'''
+def find_route(topology, source, destination):
+    best = None
+    for interface in topology['nodes'][destination]['interfaces']:
+        if interface['ip'] is None:
+            continue
+        found = find_path(topology, source, interface['ip'].ip)
+        if found and (best is None or len(found[0]) < len(best[0])):
+            best = found
+    if best is None:
+        return None
+    back = find_path(topology, destination, best[1])
+    if back is None:
+        return None
+    return best[0], back[0]
+
+'''
+SIMULATOR:
+A fluid model of the network: time moves in steps, a few for every RTT (STEPS_PER_RTT of the shortest TCP flow in the
+run), and in every step a flow sends some bytes instead of packets. Every directed hop of a shaped link is a queue like
+TCLink makes it: netem holds the bytes for the delay, htb sends them at the bandwidth, and what comes in when the
+queue is full is dropped (drop-tail). netem counts every packet it holds, also those that wait for the delay, so on a
+busy link only max_queue_size packets minus the bandwidth-delay product can wait to be sent (the buffer of the hop).
+In every step a hop sends what is queued and what came in, at most the bandwidth, and every flow gets the share of
+what was sent that it had of what the hop held, and the share of what was dropped that it had of what came in. What
+a flow gets through a hop comes into the next hop of its path in the next step. A packet takes the delay, the time to
+send it and the time to send what is queued in front of it on every hop, so the RTT and the ping times come from the
+queues in closed form. Links without bw or delay cost nothing.
+The state of a hop is a list, indexed with the constants below, since it is read in every step.
+'''
+STEPS_PER_RTT = 10 # Steps in the shortest RTT
+MAX_STEP = 0.01 # Seconds in a step when there is no TCP flow
+DRAIN = 1.0 # Seconds the network runs after the test, so the queues empty
+RATE, DELAY_S, BUFFER, QUEUE, ARRIVING, PASSED, DROPPED = range(7)
+
+class Network:
+
+    def __init__(self, topology):
+        self.hops = {}  # (link, direction) -> state of the queue
+        for index, link in enumerate(topology['links']):
+            rate = link['bw'] * 1e6 / 8 if link['bw'] else 0.0  # Bytes per second
+            limit = (link['queue'] or DEFAULT_QUEUE) * DATA_SIZE
+            for direction in (0, 1):
+                self.hops[(index, direction)] = [rate, link['delay'], max(limit - rate * link['delay'], 2 * DATA_SIZE),
+                    0.0, 0.0, 1.0, 0.0]
+
+    def path(self, hops):   # The queue states of a path, without the hops that cost nothing
+        return [self.hops[hop] for hop in hops if self.hops[hop][RATE] or self.hops[hop][DELAY_S]]
+
+    def delay(self, path, size):    # Seconds a packet of size bytes sent now takes over a path, behind what is queued
+        seconds = 0.0
+        for hop in path:
+            seconds += hop[DELAY_S]
+            if hop[RATE]:
+                seconds += (hop[QUEUE] + size) / hop[RATE]
+        return seconds
+
+    def run(self, flows, probes, until, step):
+        hops = [hop for hop in {id(hop): hop for flow in flows for hop in flow.path}.values() if hop[RATE]]
+        now = 0.0
+        while now < until:
+            for hop in hops:
+                hop[ARRIVING] = 0.0
+            for flow in flows:  # What comes into every hop in this step
+                incoming = flow.incoming
+                incoming[0] = flow.sending(now, step)
+                for hop, nbytes in zip(flow.path, incoming):
+                    hop[ARRIVING] += nbytes
+            for hop in hops:
+                held = hop[QUEUE] + hop[ARRIVING]
+                sent = min(held, hop[RATE] * step)
+                left = held - sent
+                dropped = left - hop[BUFFER] if left > hop[BUFFER] else 0.0
+                hop[QUEUE] = left - dropped
+                hop[PASSED] = sent / held if held else 1.0
+                hop[DROPPED] = dropped / hop[ARRIVING] if dropped else 0.0
+            for flow in flows:  # From the last hop to the first, so what passes a hop is in the next hop next step
+                incoming = flow.incoming
+                queues = flow.queues
+                path = flow.path
+                lost = 0.0
+                for index in range(len(path) - 1, -1, -1):
+                    hop = path[index]
+                    held = queues[index] + incoming[index]
+                    sent = held * hop[PASSED]
+                    dropped = incoming[index] * hop[DROPPED]
+                    queues[index] = held - sent - dropped
+                    lost += dropped
+                    incoming[index + 1] = sent
+                flow.update(now, incoming[-1], lost)
+            for probe in probes:
+                probe.update(now)
+            now += step
+
+'''
+TCP FLOW:
+A window based TCP sender. It sends as much as the window has room for in every step, and what arrives at the receiver
+is ACKed after the delay of the return path (ACKs are small, and are never dropped in the tests). The window grows with
+the ACKs, with slow start and then with CUBIC or Reno. A drop is noticed by the sender one RTT after it happened (the
+duplicate ACKs), and the window is made smaller once for each window of data (like fast recovery with SACK), then the
+data is counted as no longer in flight. The goodput is what arrives at the receiver during the test.
+'''
+class TcpFlow:
+
+    def __init__(self, network, path, back, start, stop, cc):
+        self.network = network
+        self.path = path
+        self.back = back
+        self.incoming = [0.0] * (len(path) + 1)    # Bytes into every hop in this step, and to the receiver
+        self.queues = [0.0] * len(path) # Bytes of the flow that wait in every hop
+        self.start = start
+        self.stop = stop
+        self.cc = cc
+        self.cwnd = float(INITIAL_WINDOW)
+        self.ssthresh = float('inf')
+        self.in_flight = 0.0    # Bytes
+        self.acks = collections.deque() # (when the sender gets the ACK, bytes)
+        self.losses = collections.deque()   # (when the sender notices the drop, bytes)
+        self.delivered = 0.0    # Bytes that arrived during the test
+        self.drops = 0.0    # Segments
+        self.back_delay = network.delay(back, ACK_SIZE)
+        self.rtt = network.delay(path, DATA_SIZE) + self.back_delay
+        self.recover = 0.0  # No new reduction of the window before this time
+        self.w_max = 0.0    # CUBIC: the window before the last reduction, and when it was
+        self.epoch = 0.0
+
+    def sending(self, now, step):
+        if not self.start <= now < self.stop:
+            return 0.0
+        self.back_delay = self.network.delay(self.back, ACK_SIZE)   # The ACKs of this step take as long
+        self.rtt = self.network.delay(self.path, DATA_SIZE) + self.back_delay
+        room = min(self.cwnd, MAX_WINDOW) * DATA_SIZE - self.in_flight
+        if room <= 0:
+            return 0.0
+        self.in_flight += room
+        return room
+
+    def update(self, now, delivered, lost):
+        if delivered:
+            if now < self.stop:
+                self.delivered += delivered
+            self.acks.append((now + self.back_delay, delivered))
+        if lost:
+            self.drops += lost / DATA_SIZE
+            self.losses.append((now + self.rtt, lost))
+        while self.losses and self.losses[0][0] <= now:
+            self.in_flight -= self.losses.popleft()[1]
+            if now >= self.recover:
+                self.w_max = self.cwnd
+                self.epoch = now
+                self.cwnd = max(self.cwnd * (0.5 if self.cc == 'reno' else CUBIC_BETA), 2.0)
+                self.ssthresh = self.cwnd
+                self.recover = now + self.rtt
+        while self.acks and self.acks[0][0] <= now:
+            acked = self.acks.popleft()[1]
+            self.in_flight -= acked
+            acked /= DATA_SIZE  # Segments
+            if self.cwnd < self.ssthresh:   # Slow start
+                self.cwnd += acked
+            elif self.cc == 'reno':
+                self.cwnd += acked / self.cwnd
+            else:   # CUBIC, with the TCP friendly window as the least
+                t = now - self.epoch
+                k = math.pow(self.w_max * (1 - CUBIC_BETA) / CUBIC_C, 1 / 3)
+                target = max(CUBIC_C * (t - k) ** 3 + self.w_max,
+                    self.w_max * CUBIC_BETA + 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * t / self.rtt)
+                self.cwnd += (target - self.cwnd) * acked / self.cwnd if target > self.cwnd else 0.01 * acked / self.cwnd
+
+    def result(self):
+        return {'mbps': self.delivered / DATA_SIZE * MSS * 8 / (self.stop - self.start) / 1e6, 'drops': round(self.drops)}
+
+'''
+UDP FLOW:
+Sends datagrams at a constant rate, like iperf -u with -b, and counts what arrives and what is lost. The jitter (RFC
+3550, like the iperf server) is computed in closed form: without other traffic only the slowest hop spaces the
+datagrams out, and when it is slower than the flow it sends one datagram every service time, with one or more gaps
+of the sender between two of them.
+'''
+class UdpFlow:
+
+    def __init__(self, network, path, rate, start, stop):
+        self.path = path
+        self.incoming = [0.0] * (len(path) + 1)
+        self.queues = [0.0] * len(path)
+        self.wire = rate * 1e6 / 8 * UDP_SIZE / UDP_PAYLOAD  # Bytes per second with the headers
+        self.gap = UDP_PAYLOAD * 8 / (rate * 1e6)   # Seconds between datagrams
+        self.start = start
+        self.stop = stop
+        self.received = 0.0 # Bytes
+
+    def sending(self, now, step):
+        return self.wire * step if self.start <= now < self.stop else 0.0
+
+    def update(self, now, delivered, lost):
+        self.received += delivered
+
+    def jitter(self):
+        slowest = min((hop[RATE] for hop in self.path if hop[RATE]), default=0.0)
+        service = UDP_SIZE / slowest if slowest else 0.0
+        if service <= self.gap: # Every datagram is sent before the next one comes
+            return 0.0
+        ratio = service / self.gap
+        gaps = int(ratio)   # gaps or gaps + 1 between two datagrams that are sent
+        part = ratio - gaps
+        return (1 - part) * (service - gaps * self.gap) + part * ((gaps + 1) * self.gap - service)
+
+    def result(self):
+        seconds = self.stop - self.start
+        sent = round(seconds / self.gap)
+        received = min(self.received / UDP_SIZE, sent)
+        return {'mbps': sent * UDP_PAYLOAD * 8 / seconds / 1e6, 'udp_server_mbps': received * UDP_PAYLOAD * 8 / seconds / 1e6,
+            'jitter_ms': self.jitter() * 1000, 'udp_loss': (sent - received) / sent * 100 if sent else 0.0}
+
+'''
+PING FLOW:
+Sends one echo request every interval, that is sent back by the destination, and records the round-trip times. A ping
+takes the delays and the queues of the path and return path as they are when it is sent, and is lost if a queue on
+them is full.
+'''
+class PingFlow:
+
+    def __init__(self, network, path, back, start, count, interval=1.0):
+        self.network = network
+        self.path = path
+        self.back = back
+        self.times = [start + i * interval for i in range(count)]
+        self.rtts = []
+        self.sent = 0
+
+    def update(self, now):
+        while self.sent < len(self.times) and self.times[self.sent] <= now:
+            self.sent += 1
+            if not any(hop[DROPPED] for hop in self.path + self.back):
+                self.rtts.append((self.network.delay(self.path, PING_SIZE) + self.network.delay(self.back, PING_SIZE)) * 1000)
+
+    def result(self):
+        rtts = sorted(self.rtts)
+        if not rtts:
+            return {'ping_loss': 100.0}
+        mean = sum(rtts) / len(rtts)
+        return {'rtt_min': rtts[0], 'rtt_avg': mean, 'rtt_max': rtts[-1],
+            'rtt_mdev': (sum((rtt - mean) ** 2 for rtt in rtts) / len(rtts)) ** 0.5,
+            'ping_loss': (self.sent - len(rtts)) / self.sent * 100}
+
+'''
+SCENARIOS:
+The tests in measurements/test-case-1..5. Every test case is a list of runs, and every run is the flows that ran at
+the same time: (kind, source, destination, value, pair, group). value is the rate in Mbit/s for udp, the number of
+parallel streams for tcp and the number of pings for ping. The results of a flow are saved under (case, pair, group),
+the same keys as analyze-measurements. The tests ran for 25 seconds, and iperf -u for 10.
+'''
+PAIRS = [('h1', 'h4'), ('h1', 'h9'), ('h7', 'h9')]
+LINKS = {'L1': ('r1', 'r2'), 'L2': ('r2', 'r3'), 'L3': ('r3', 'r4')}
+GROUPS = {1: [('h1', 'h4'), ('h2', 'h5')], 2: [('h1', 'h4'), ('h2', 'h5'), ('h3', 'h6')],
+    3: [('h1', 'h4'), ('h7', 'h9')], 4: [('h1', 'h4'), ('h8', 'h9')]}
+SCENARIOS = {
+    1: [[('udp', 'h1', 'h4', 31.5, 'h1-h4', 0)], [('udp', 'h1', 'h9', 21, 'h1-h9', 0)], [('udp', 'h7', 'h9', 21, 'h7-h9', 0)]],
+    2: [[(kind, a, b, value, label, 0)] for label, (a, b) in LINKS.items() for kind, value in (('tcp', 1), ('ping', 25))],
+    3: [[(kind, a, b, value, f"{a}-{b}", 0)] for a, b in PAIRS for kind, value in (('tcp', 1), ('ping', 25))],
+    4: [[(kind, a, b, value, f"{a}-{b}", group) for a, b in pairs for kind, value in (('tcp', 1), ('ping', 25))]
+        for group, pairs in GROUPS.items()],
+    5: [[('tcp', 'h1', 'h4', 2, 'h1-h4', 0), ('tcp', 'h2', 'h5', 1, 'h2-h5', 0), ('tcp', 'h3', 'h6', 1, 'h3-h6', 0)]],
+}
+TEST_TIME = {1: 10}    # Seconds for the test cases that did not run for --time
+
+'''
+RUN SCENARIO:
+Simulates every run of a test case and returns one row for each (pair, group) with the throughput (sum of the streams)
+and the ping and UDP results, like the rows of analyze-measurements.
+'''
+def run_scenario(topology, case, seconds, cc):
+    rows = {}
+    for run in SCENARIOS[case]:
+        network = Network(topology)
+        flows = []
+        duration = TEST_TIME.get(case, seconds)
+        for kind, source, destination, value, pair, group in run:
+            route = find_route(topology, source, destination)
+            if route is None:
+                raise ValueError(f"no route from {source} to {destination}")
+            path, back = network.path(route[0]), network.path(route[1])
+            if kind == 'tcp':
+                streams = [TcpFlow(network, path, back, 0.0, duration, cc) for i in range(value)]
+            elif kind == 'udp':
+                streams = [UdpFlow(network, path, value, 0.0, duration)]
+            else:
+                streams = [PingFlow(network, path, back, 0.5, value)]
+            flows.append((kind, pair, group, streams))
+        rtts = [stream.rtt for kind, pair, group, streams in flows if kind == 'tcp' for stream in streams]
+        network.run([stream for kind, pair, group, streams in flows if kind != 'ping' for stream in streams],
+            [stream for kind, pair, group, streams in flows if kind == 'ping' for stream in streams], duration + DRAIN,
+            min(min(rtts) / STEPS_PER_RTT, MAX_STEP) if rtts else MAX_STEP)
+
+        for kind, pair, group, streams in flows:
+            row = rows.setdefault((pair, group), {'case': case, 'pair': pair, 'group': group})
+            results = [stream.result() for stream in streams]
+            if kind == 'tcp':
+                row['mbps'] = sum(result['mbps'] for result in results)
+                row['streams'] = len(results)
+                row['drops'] = sum(result['drops'] for result in results)
+            else:
+                row.update(results[0])
+    return list(rows.values())
+
+'''
+MEASURED:
+Loads analyze-measurements.py (it can't be imported by name because of the dash) and returns its summary rows keyed
+by (case, pair, group), or {} if the measurements are not there.
+'''
+def load_measured(directory):
+    path = os.path.join(HERE, 'analyze-measurements.py')
+    if not os.path.isdir(directory) or not os.path.exists(path):
+        return {}
+    spec = importlib.util.spec_from_file_location('analyze_measurements', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return {(row['case'], row['pair'], row['group']): row for row in module.summarize(module.load_dataset(directory))}
+
+'''
+SWEEP:
+--set LINK:PARAM=V1,V2,... changes a parameter of a link (bw in Mbit/s, delay in ms or queue in packets) for the
+simulation. LINK is the two ends, e.g. r1-r2, or L1, L2 or L3. With more than one value, or more than one --set, every
+combination is simulated. Returns a list of combinations, each a list of (link, param, value).
+'''
+SETTING = re.compile(r'^([\w-]+):(bw|delay|queue)=([\d.,]+)$')
+
+def parse_settings(settings, topology):
+    names = {link_name(link): index for index, link in enumerate(topology['links'])}
+    choices = []
+    for setting in settings:
+        match = SETTING.match(setting)
+        if not match:
+            raise ValueError(f"can't read --set {setting}, expected LINK:bw|delay|queue=V1,V2,...")
+        link = match.group(1)
+        if link in LINKS:
+            link = '-'.join(sorted(LINKS[link]))
+        if link not in names:
+            raise ValueError(f"no link {link}, the links are {', '.join(sorted(names))}")
+        choices.append([(names[link], match.group(2), float(value)) for value in match.group(3).split(',') if value])
+    return [list(combination) for combination in itertools.product(*choices)]
+
+def apply_settings(topology, combination):  # Returns a copy of the topology with the settings
+    links = [dict(link) for link in topology['links']]
+    for index, param, value in combination:
+        if param == 'delay':
+            links[index]['delay'] = value / 1000
+        elif param == 'queue':
+            links[index]['queue'] = int(value)
+        else:
+            links[index]['bw'] = value
+    return dict(topology, links=links)
+
+'''
+SIMULATE:
+Simulates the test cases with the settings of one combination. Returns the rows, with the settings in each row if
+there are any. Runs in the worker processes of a sweep.
+'''
+def simulate(topology, combination, cases, seconds, cc):
+    simulated = apply_settings(topology, combination)
+    settings = {f"{link_name(topology['links'][index])}:{param}": value for index, param, value in combination}
+    rows = []
+    for case in cases:
+        for row in run_scenario(simulated, case, seconds, cc):
+            if settings:
+                row['settings'] = settings
+            rows.append(row)
+    return rows
+
+'''
+PRINT ROWS:
+Prints the predicted rows, with the measured values next to them if there are any, and the settings of the sweep.
+'''
+def print_rows(rows, measured, as_json=False):
+    if as_json:
+        for row in rows:
+            print(json.dumps(row))
+        return
+    from prettytable import PrettyTable # Only needed for the tables
+    settings = list(rows[0].get('settings', {})) if rows else []
+    result_table = PrettyTable()
+    result_table.field_names = settings + ['Case', 'Pair', 'Group', 'Throughput', 'Measured', 'RTT avg', 'Measured ', 'Drops', 'UDP loss', 'Jitter']
+    for row in rows:
+        known = measured.get((row['case'], row['pair'], row['group']), {})
+        cells = [row['settings'][name] for name in settings] + [row['case'], row['pair'], row['group']]
+        for key, form, source in (('mbps', '%.2f Mbps', row), ('mbps', '%.2f Mbps', known), ('rtt_avg', '%.1f ms', row),
+                ('rtt_avg', '%.1f ms', known), ('drops', '%d', row), ('udp_loss', '%.1f%%', row), ('jitter_ms', '%.3f ms', row)):
+            cells.append('-' if source.get(key) is None else form % source[key])
+        result_table.add_row(cells)
+    print(result_table)
+    print("")
+
+'''
+ARGPARSE and MAIN:
+Reads the topology, and simulates the chosen test cases for every combination of --set.
+'''
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="simulate-topology",
+        description="Simulates the test cases on the network in topology.json, without Mininet")
+    parser.add_argument('--topology', default=os.path.join(HERE, 'topology.json'), help='the topology spec (JSON or YAML), or a Mininet script with the network hard-coded - default: topology.json next to this script')
+    parser.add_argument('--case', type=int, action='append', choices=sorted(SCENARIOS), help='only this test case, can be given more than once - default: all')
+    parser.add_argument('-t', '--time', type=float, default=25, help='seconds each TCP test runs - default: 25, like the measurements')
+    parser.add_argument('--cc', choices=['cubic', 'reno'], default='cubic', help='TCP congestion control - default: cubic, the default in Linux')
+    parser.add_argument('--set', action='append', default=[], metavar='LINK:PARAM=V1,V2', help='change bw (Mbit/s), delay (ms) or queue (packets) of a link, e.g. L1:bw=20,30,40 or r3-r4:queue=33,66. Every combination is simulated')
+    parser.add_argument('--measurements', default=os.path.join(HERE, 'measurements'), help='directory with the measurements to compare with - default: measurements')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='processes that simulate the combinations of a sweep - default: one for each CPU core')
+    parser.add_argument('--json', action='store_true', help='one JSON object per row instead of tables')
+    args = parser.parse_args()
+
+    try:
+        topology = read_topology(args.topology)
+        combinations = parse_settings(args.set, topology)
+    except (OSError, SyntaxError, ValueError) as error:
+        print(f"[ERROR] {error}")
+        sys.exit(1)
+    measured = {} if args.json or len(combinations) > 1 else load_measured(args.measurements)
+
+    jobs = [(topology, combination, args.case or sorted(SCENARIOS), args.time, args.cc) for combination in combinations]
+    if len(jobs) > 1 and args.jobs > 1:
+        with multiprocessing.Pool(min(args.jobs, len(jobs))) as pool:
+            results = pool.starmap(simulate, jobs)
+    else:
+        results = [simulate(*job) for job in jobs]
+    rows = [row for result in results for row in result]
+    print_rows(rows, measured, args.json)
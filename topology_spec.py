@@ -0,0 +1,211 @@
+'''
+topology_spec reads a network from a topology spec (JSON, or YAML if PyYAML is installed) instead of hard-coding it in
+a Mininet script, computes the static routes of every router with a breadth-first search, and makes one batched shell
+command for each node with its routes and offload settings. It is used by portfolio-topology.py to start the network
+and by simulate-topology.py to simulate it, and does not need Mininet itself.
+
+A spec has hosts (with an ip, and a gateway if it is not the router on the subnet), switches, routers and links in
+the order Mininet should add them, since the interfaces of a node are named by that order (r1-eth0, r1-eth1, ...):
+
+{
+  "hosts": {"h1": {"ip": "10.0.0.2/24"}},
+  "switches": ["s1"],
+  "routers": {"r1": {}},
+  "links": [
+    {"ends": ["h1", "s1"]},
+    {"ends": ["s1", "r1"], "ips": [null, "10.0.0.1/24"]},
+    {"ends": ["r1", "r2"], "ips": ["10.0.1.1/24", "10.0.1.2/24"], "bw": 40, "delay": "10ms", "max_queue_size": 67}
+  ],
+  "offload": {"disable": ["tso", "gso"], "interfaces": ["r1-eth1", "h1-eth0"]}
+}
+
+A router can also have "routes": ["10.9.0.0/16 via 10.0.1.2"], which are added before the computed ones and win over
+them for the same network.
+'''
+
+# Different module imports used in this program
+import collections  # deque for the breadth-first search
+import ipaddress    # Interfaces, networks and routes
+import json # Reads the spec
+
+LINK_OPTIONS = ('bw', 'delay', 'max_queue_size')   # What TCLink gets from a link in the spec
+
+'''
+LOAD SPEC:
+Reads a spec from a JSON file, or a YAML file (.yaml or .yml) if PyYAML is installed, and checks it. Raises ValueError
+with what is wrong.
+'''
+def load_spec(path):
+    with open(path) as spec_file:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml # Only needed for YAML specs
+            except ImportError:
+                raise ValueError("PyYAML is needed for YAML specs: python -m pip install pyyaml")
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+    check_spec(spec)
+    return spec
+
+'''
+CHECK SPEC:
+Checks that the node names are unique, every link is between two nodes in the spec, and that every ip address can be
+read. Fills in the empty sections, so the rest of the code doesn't have to check for them.
+'''
+def check_spec(spec):
+    if not isinstance(spec, dict):
+        raise ValueError("the spec must be an object with hosts, switches, routers and links")
+    spec.setdefault('hosts', {})
+    spec.setdefault('switches', [])
+    spec.setdefault('routers', {})
+    spec.setdefault('links', [])
+    names = list(spec['hosts']) + list(spec['switches']) + list(spec['routers'])
+    if len(set(names)) != len(names):
+        raise ValueError("a node name is used more than once")
+    for index, link in enumerate(spec['links']):
+        ends = link.get('ends', [])
+        if len(ends) != 2 or any(end not in names for end in ends):
+            raise ValueError(f"link {index} must have two ends that are nodes in the spec, not {ends}")
+        for ip in link.get('ips') or []:
+            if ip is not None:
+                ipaddress.ip_interface(ip)  # ValueError if it is not an address
+    for name, node in list(spec['hosts'].items()) + list(spec['routers'].items()):
+        for key in ('ip', 'gateway'):
+            if node.get(key):
+                ipaddress.ip_interface(node[key])
+
+'''
+INTERFACES:
+Returns the interfaces of every node, in the order of the links: a list of dicts with the name (node-ethN), the
+link, which end of the link it is (side 0 or 1), and the ip (ipaddress.ip_interface, or None). They are numbered like
+Mininet numbers them: the interfaces of hosts and routers from eth0, and the ports of a switch from eth1, since port 0
+is the switch itself. An interface gets the ip that the link gives it, or the ip of the node if it is the first
+interface of the node, like in Mininet.
+'''
+def interfaces(spec):
+    switches = set(spec['switches'])
+    nodes = dict(spec['hosts'], **spec['routers'])
+    result = {name: [] for name in list(spec['hosts']) + list(spec['switches']) + list(spec['routers'])}
+    for index, link in enumerate(spec['links']):
+        ips = link.get('ips') or [None, None]
+        for side, name in enumerate(link['ends']):
+            first = not result[name]
+            number = len(result[name]) + (1 if name in switches else 0)
+            ip = ips[side] or (nodes[name].get('ip') if first and name not in switches else None)
+            result[name].append({'name': f"{name}-eth{number}", 'link': index, 'side': side,
+                'ip': ipaddress.ip_interface(ip) if ip else None})
+    return result
+
+'''
+SEGMENTS:
+Returns the layer 2 segments: the interfaces (of hosts and routers) that reach each other without a router, as lists
+of (node, interface) keyed by the segment. A link between two nodes is a segment, and every switch (with the switches
+linked to it) is one.
+'''
+def segments(spec, nodes_interfaces):
+    switches = {name: name for name in spec['switches']}   # Union-find of switches that are linked
+    def find(name):
+        while switches[name] != name:
+            name = switches[name]
+        return name
+    for link in spec['links']:
+        if all(end in switches for end in link['ends']):
+            switches[find(link['ends'][0])] = find(link['ends'][1])
+    result = {}
+    for name, entries in nodes_interfaces.items():
+        if name in switches:
+            continue
+        for entry in entries:
+            other = spec['links'][entry['link']]['ends'][1 - entry['side']]
+            key = ('switch', find(other)) if other in switches else ('link', entry['link'])
+            result.setdefault(key, []).append((name, entry))
+    return result
+
+'''
+GATEWAYS:
+Returns the default gateway of every host and router that has one: the gateway in the spec, or for a host without one
+the first router on the subnet of the host.
+'''
+def gateways(spec):
+    nodes_interfaces = interfaces(spec)
+    result = {name: str(ipaddress.ip_interface(node['gateway']).ip) for name, node in
+        list(spec['hosts'].items()) + list(spec['routers'].items()) if node.get('gateway')}
+    for members in segments(spec, nodes_interfaces).values():
+        for name, entry in members:
+            if name not in spec['hosts'] or name in result or entry['ip'] is None:
+                continue
+            router = next((far for other, far in members if other in spec['routers'] and far['ip'] and far['ip'].ip in entry['ip'].network), None)
+            if router is not None:
+                result[name] = str(router['ip'].ip)
+    return result
+
+'''
+COMPUTE ROUTES:
+Computes the static routes of every router. The routers are a graph where two routers are neighbours if they share a
+subnet, and a breadth-first search from each router finds the fewest router hops to every other router, and the
+neighbour (gateway and interface) of the first hop. A subnet the router is not connected to is routed to the first
+hop towards the nearest router that is connected to it. When two paths are as short the first link in the spec wins,
+so the routes are the same every time. Routes in the spec ("routes" of a router) come first and are kept.
+Returns {router: [(network, gateway, interface name)]}.
+'''
+def compute_routes(spec):
+    nodes_interfaces = interfaces(spec)
+    routers = spec['routers']
+    neighbours = {name: [] for name in routers}    # Router -> [(neighbour, its ip, our interface)]
+    networks = {}   # Subnet -> the routers that are connected to it
+    for members in segments(spec, nodes_interfaces).values():
+        for name, entry in members:
+            if name not in routers or entry['ip'] is None:
+                continue
+            networks.setdefault(entry['ip'].network, []).append(name)
+            for other, far in members:
+                if other != name and other in routers and far['ip'] and far['ip'].ip in entry['ip'].network:
+                    neighbours[name].append((other, far['ip'].ip, entry['name']))
+
+    routes = {}
+    for router in routers:
+        first = {router: None}  # Router -> (gateway, interface) of the first hop towards it, in the order they are found
+        queue = collections.deque([router])
+        while queue:
+            current = queue.popleft()
+            for other, ip, dev in neighbours[current]:
+                if other not in first:
+                    first[other] = first[current] or (ip, dev)
+                    queue.append(other)
+        distance = {name: number for number, name in enumerate(first)}
+        table = []
+        for route in routers[router].get('routes', []):    # "NET via GW", the interface is the one on the subnet of GW
+            network, gateway = route.split(' via ')
+            gateway = ipaddress.ip_address(gateway.strip())
+            dev = next((entry['name'] for entry in nodes_interfaces[router] if entry['ip'] and gateway in entry['ip'].network), None)
+            table.append((ipaddress.ip_network(network.strip(), strict=False), gateway, dev))
+        known = {network for network, gateway, dev in table}
+        known.update(entry['ip'].network for entry in nodes_interfaces[router] if entry['ip'])
+        for network in sorted(set(networks) - known):
+            reachable = [name for name in networks[network] if name in first]
+            if reachable:
+                gateway, dev = first[min(reachable, key=distance.get)]
+                table.append((network, gateway, dev))
+        routes[router] = table
+    return routes
+
+'''
+NODE COMMANDS:
+Returns one shell command for every node that needs one, with all of its routes and one ethtool call for each of its
+interfaces in "offload", so the node is configured with one round trip to its shell instead of one for each setting.
+'''
+def node_commands(spec, routes):
+    offload = spec.get('offload', {})
+    disable = ' '.join(f"{feature} off" for feature in offload.get('disable', []))
+    wanted = set(offload.get('interfaces', []))
+    commands = {}
+    for name, table in routes.items():
+        for network, gateway, dev in table:
+            commands.setdefault(name, []).append(f"ip route add {network} via {gateway}" + (f" dev {dev}" if dev else ""))
+    if disable:
+        for name, entries in interfaces(spec).items():
+            for entry in entries:
+                if entry['name'] in wanted:
+                    commands.setdefault(name, []).append(f"ethtool -K {entry['name']} {disable}")
+    return {name: '; '.join(command) for name, command in commands.items()}